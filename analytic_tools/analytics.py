@@ -0,0 +1,183 @@
+"""Module containing the aggregate statistics of the emissions, computed on the year x source x gas array
+of an EmissionsData instead of parsing the restructured .csv files again.
+"""
+import csv
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+from analytic_tools.dataset import EmissionsData
+
+
+class EmissionsSummary(NamedTuple):
+    """Aggregate statistics of an EmissionsData. A statistic is NaN where there is no data to compute it from.
+
+    Attributes:
+        - years (np.ndarray) : 1D integer array with the years, the first axis of every array below
+        - sources (List[str]) : names of the sources, the second axis of shares
+        - gases (List[str]) : gas formulas, the last axis of totals, shares and deltas
+        - totals (np.ndarray) : 2D array (year, gas) with the emissions summed over the sources
+        - shares (np.ndarray) : 3D array (year, source, gas) with the fraction of the total emitted by each source
+        - deltas (np.ndarray) : 2D array (year, gas) with the change of the total since the previous year of the data
+        - relative_deltas (np.ndarray) : 2D array (year, gas) with deltas divided by the total of the previous year
+        - co2_equivalents (np.ndarray) : 1D array (year) with the totals of every gas weighted by its factor and summed
+    """
+
+    years: np.ndarray
+    sources: List[str]
+    gases: List[str]
+    totals: np.ndarray
+    shares: np.ndarray
+    deltas: np.ndarray
+    relative_deltas: np.ndarray
+    co2_equivalents: np.ndarray
+
+
+def totals_per_year(data: EmissionsData) -> np.ndarray:
+    """Sum the emissions of every gas over the sources.
+
+    Parameters:
+        - data (EmissionsData) : the dataset
+
+    Returns:
+        - (np.ndarray) : 2D array (year, gas), NaN where no source has data for the gas and year
+    """
+    has_data = ~np.isnan(data.values).all(axis=1)
+    return np.where(has_data, np.nansum(data.values, axis=1), np.nan)
+
+
+def source_shares(data: EmissionsData, totals: np.ndarray | None = None) -> np.ndarray:
+    """Compute the fraction of the total emissions of each gas and year emitted by each source.
+
+    Parameters:
+        - data (EmissionsData) : the dataset
+        - totals (np.ndarray or None) : totals of data as returned by totals_per_year, computed if None
+
+    Returns:
+        - (np.ndarray) : 3D array (year, source, gas), NaN where the source has no data or the total is zero
+    """
+    if totals is None:
+        totals = totals_per_year(data)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = data.values / totals[:, np.newaxis, :]
+    shares[~np.isfinite(shares)] = np.nan
+    return shares
+
+
+def year_over_year(totals: np.ndarray, relative: bool = False) -> np.ndarray:
+    """Compute the change of the totals from each year of the data to the next.
+
+    Parameters:
+        - totals (np.ndarray) : 2D array (year, gas) as returned by totals_per_year
+        - relative (bool) : If True, the changes are divided by the totals of the previous year
+
+    Returns:
+        - (np.ndarray) : 2D array (year, gas) of the same shape as totals, NaN for the first year
+    """
+    deltas = np.full(totals.shape, np.nan)
+    deltas[1:] = np.diff(totals, axis=0)
+    if relative:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deltas[1:] /= totals[:-1]
+        deltas[~np.isfinite(deltas)] = np.nan
+    return deltas
+
+
+def co2_equivalents(
+    data: EmissionsData,
+    totals: np.ndarray | None = None,
+    factors: Dict[str, float] | None = None,
+) -> np.ndarray:
+    """Sum the emissions of every gas into CO2 equivalents.
+        The original files are already expressed in 1000 tonn CO2-equivalents (AR5), so the default factor of each
+        gas is one; factors converts gasses given in other units, for instance with their global warming potential.
+
+    Parameters:
+        - data (EmissionsData) : the dataset
+        - totals (np.ndarray or None) : totals of data as returned by totals_per_year, computed if None
+        - factors (Dict[str, float] or None) : factor of each gas formula, one for the gasses not in factors
+
+    Returns:
+        - (np.ndarray) : 1D array (year), NaN where no gas has data for the year
+    """
+    if totals is None:
+        totals = totals_per_year(data)
+    factors = factors or {}
+    weights = np.array([factors.get(gas, 1.0) for gas in data.gases], dtype=float)
+    weighted = totals * weights
+    has_data = ~np.isnan(totals).all(axis=1)
+    return np.where(has_data, np.nansum(weighted, axis=1), np.nan)
+
+
+def summarize(data: EmissionsData, factors: Dict[str, float] | None = None) -> EmissionsSummary:
+    """Compute all the statistics of the dataset, summing the array over the sources only once.
+
+    Parameters:
+        - data (EmissionsData) : the dataset, e.g. from load_emissions
+        - factors (Dict[str, float] or None) : CO2 equivalent factor of each gas, see co2_equivalents
+
+    Returns:
+        - (EmissionsSummary) : the statistics
+    """
+    totals = totals_per_year(data)
+    return EmissionsSummary(
+        years=data.years,
+        sources=list(data.sources),
+        gases=list(data.gases),
+        totals=totals,
+        shares=source_shares(data, totals),
+        deltas=year_over_year(totals),
+        relative_deltas=year_over_year(totals, relative=True),
+        co2_equivalents=co2_equivalents(data, totals, factors),
+    )
+
+
+def summary_rows(summary: EmissionsSummary) -> List[Dict]:
+    """Flatten the per year and gas statistics of a summary into table rows, skipping the years without data for a gas.
+
+    Parameters:
+        - summary (EmissionsSummary) : the statistics, as returned by summarize
+
+    Returns:
+        - rows (List[Dict]) : one dictionary per year and gas, with following keys: year, gas, total, delta,
+                              relative delta, co2 equivalents (of all the gasses that year), and one share per source
+    """
+    rows = []
+    for i, year in enumerate(summary.years.tolist()):
+        for j, gas in enumerate(summary.gases):
+            if np.isnan(summary.totals[i, j]):
+                continue
+            row = {
+                "year": year,
+                "gas": gas,
+                "total": float(summary.totals[i, j]),
+                "delta": float(summary.deltas[i, j]),
+                "relative delta": float(summary.relative_deltas[i, j]),
+                "co2 equivalents": float(summary.co2_equivalents[i]),
+            }
+            for k, source in enumerate(summary.sources):
+                row[f"share {source}"] = float(summary.shares[i, k, j])
+            rows.append(row)
+    return rows
+
+
+def write_summary_csv(summary: EmissionsSummary, path: str | Path) -> None:
+    """Write the rows of summary_rows to the .csv file at path, NaN written as empty fields.
+
+    Parameters:
+        - summary (EmissionsSummary) : the statistics, as returned by summarize
+        - path (str or pathlib.Path) : Absolute path to the .csv file to write
+
+    Returns:
+        None
+    """
+    rows = summary_rows(summary)
+    fieldnames = ["year", "gas", "total", "delta", "relative delta", "co2 equivalents"]
+    fieldnames += [f"share {source}" for source in summary.sources]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: "" if isinstance(value, float) and np.isnan(value) else value
+                             for key, value in row.items()})
@@ -0,0 +1,172 @@
+"""Module containing the crash-safe writing of output files: each file is written to a temporary file in the directory
+of its destination and renamed over it, so that a destination is never seen partially written, even after a crash.
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Callable, List, Tuple, TypeVar
+
+# Policies of flushing the written files to the disk, see AtomicWriter
+FSYNC_POLICIES = ("none", "batch", "always")
+# Number of files written with the batch policy before they are flushed to the disk together
+DEFAULT_FSYNC_BATCH = 256
+# Suffix of the temporary files, which are also hidden: ".[name].[random].tmp"
+TEMP_SUFFIX = ".tmp"
+
+T = TypeVar("T")
+
+
+def temp_path(dst: str | Path) -> Path:
+    """Return a new path of a temporary file in the directory of dst, unique to the call."""
+    dst = Path(dst)
+    return dst.parent / f".{dst.name}.{os.urandom(6).hex()}{TEMP_SUFFIX}"
+
+
+def is_temp_file(name: str) -> bool:
+    """Check if name is the name of a temporary file created by temp_path."""
+    return name.startswith(".") and name.endswith(TEMP_SUFFIX)
+
+
+def remove_temp_files(directory: str | Path) -> int:
+    """Remove the temporary files left in directory by a job which was killed while writing, not recursively.
+
+    Parameters:
+        - directory (str or pathlib.Path) : Absolute path to the directory
+
+    Returns:
+        - (int) : Number of files removed
+    """
+    removed = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if is_temp_file(entry.name) and not entry.is_dir(follow_symlinks=False):
+                os.unlink(entry.path)
+                removed += 1
+    return removed
+
+
+def _fsync_path(path: str | Path, directory: bool = False) -> None:
+    """Flush the file (or directory) pointed to by path to the disk.
+        Directories cannot be opened on Windows, which has no os.O_DIRECTORY, they are not flushed there.
+    """
+    if directory and not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | (os.O_DIRECTORY if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AtomicWriter:
+    """Writes files atomically, with one of the FSYNC_POLICIES:
+
+        - none : the files are renamed over their destination without being flushed to the disk. A crash of the job
+                 leaves each destination either untouched or complete, a crash of the machine may lose recent files.
+        - batch : the files are kept under their temporary name until batch_size of them are written, or until flush
+                  is called, then flushed together and renamed, and each of their directories is flushed once.
+                  A destination only appears (or changes) when it is flushed.
+        - always : each file is flushed before being renamed, and its directory after.
+
+    The writer can be shared by several threads. Use it as a context manager to flush it at the end.
+
+    Parameters:
+        - fsync (str) : the policy, default to none
+        - batch_size (int) : number of files flushed together with the batch policy
+
+    Example:
+
+        .. highlight:: python
+        .. code-block:: python
+
+            with AtomicWriter("batch") as writer:
+                for src, dst in jobs:
+                    writer.write(dst, partial(copy_file, src))
+    """
+
+    def __init__(self, fsync: str = "none", batch_size: int = DEFAULT_FSYNC_BATCH) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Expected fsync to be one of {FSYNC_POLICIES}, but received {fsync}")
+        if isinstance(batch_size, bool) or not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError(f"Expected batch_size to be a positive integer, but received {batch_size}")
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self._pending: List[Tuple[Path, Path, bool]] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "AtomicWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
+
+    def write(self, dst: str | Path, write: Callable[[Path], T], sync_data: bool = True) -> T:
+        """Call write with a temporary path in the directory of dst, then commit the temporary file to dst.
+            The temporary file is removed if write raises.
+
+        Parameters:
+            - dst (str or pathlib.Path) : Absolute path to the destination
+            - write (Callable[[pathlib.Path], T]) : function creating the file (or link) at the given path
+            - sync_data (bool) : If False, the contents of the file are not flushed, only its directory (for links)
+
+        Returns:
+            - the result of write
+        """
+        tmp = temp_path(dst)
+        try:
+            result = write(tmp)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        self.commit(tmp, Path(dst), sync_data)
+        return result
+
+    def commit(self, tmp: Path, dst: Path, sync_data: bool = True) -> None:
+        """Rename the complete temporary file tmp over dst, now or at the next flush depending on the policy."""
+        if self.fsync == "batch":
+            with self._lock:
+                self._pending.append((tmp, dst, sync_data))
+                full = len(self._pending) >= self.batch_size
+            if full:
+                self.flush()
+            return
+
+        if self.fsync == "always" and sync_data:
+            _fsync_path(tmp)
+        os.replace(tmp, dst)
+        if self.fsync == "always":
+            _fsync_path(dst.parent, directory=True)
+
+    def flush(self) -> None:
+        """Flush and rename the files kept by the batch policy, then flush each of their directories once."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for tmp, _, sync_data in pending:
+            if sync_data:
+                _fsync_path(tmp)
+        for tmp, dst, _ in pending:
+            os.replace(tmp, dst)
+        for directory in {dst.parent for _, dst, _ in pending}:
+            _fsync_path(directory, directory=True)
+
+
+def write_bytes_atomic(dst: str | Path, raw: bytes, writer: AtomicWriter | None = None) -> int:
+    """Write raw to dst atomically, see AtomicWriter.
+
+    Parameters:
+        - dst (str or pathlib.Path) : Absolute path to the destination file
+        - raw (bytes) : contents of the file
+        - writer (AtomicWriter or None) : writer committing the file, one without fsync if None
+
+    Returns:
+        - (int) : Number of bytes written
+    """
+    def write(tmp: Path) -> int:
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        return len(raw)
+
+    return (writer or AtomicWriter()).write(dst, write)
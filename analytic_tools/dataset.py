@@ -0,0 +1,430 @@
+"""Module containing the functions used to load the restructured pollution data into one columnar dataset.
+"""
+import io
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+from analytic_tools.atomic import AtomicWriter, is_temp_file
+
+# Names of the binary cache of the dataset and of its JSON sidecar holding the labels, stored in the cache directory
+CACHE_VALUES_NAME = "emissions.npy"
+CACHE_LABELS_NAME = "emissions.json"
+
+
+class EmissionsData(NamedTuple):
+    """Emissions of every gas from every source, as one year x source x gas array.
+
+    Attributes:
+        - years (np.ndarray) : 1D integer array with the sorted years, the first axis of values
+        - sources (List[str]) : names of the src_* sources, the second axis of values
+        - gases (List[str]) : gas formulas, the third axis of values
+        - values (np.ndarray) : 3D float array of shape (len(years), len(sources), len(gases)),
+                                NaN where a source has no data for a gas and year
+    """
+
+    years: np.ndarray
+    sources: List[str]
+    gases: List[str]
+    values: np.ndarray
+
+
+def parse_emissions_csv(raw: bytes, name: str = "<bytes>") -> np.ndarray:
+    """Parse the contents of an original gas .csv file: a header line followed by "year,value" lines.
+        The whole body is parsed with a single call to np.fromstring instead of line by line.
+        Blank lines are skipped, as np.loadtxt skips the empty ones.
+
+    Parameters:
+        - raw (bytes) : Contents of the .csv file
+        - name (str) : Name of the file, used in error messages
+
+    Returns:
+        - data (np.ndarray) : 2D float array of shape (number of lines, 2) with the years and the values
+    """
+    body = raw.partition(b"\n")[2].decode("utf-8").replace("\r", "")
+    lines = [line for line in body.split("\n") if line.strip()]
+    if not lines:
+        return np.empty((0, 2))
+
+    try:
+        values = np.fromstring(",".join(lines), sep=",")
+    except ValueError:
+        raise ValueError(f"Expected numeric year,value lines in {name}")
+    # Each line must hold exactly two values, the total alone does not catch values shifted between lines
+    nlines = len(lines)
+    if values.size != 2 * nlines or any(line.count(",") != 1 for line in lines):
+        raise ValueError(f"Expected two columns on each of the {nlines} lines in {name}")
+    return values.reshape(nlines, 2)
+
+
+def read_emissions_csv(path: str | Path) -> np.ndarray:
+    """Read an original gas .csv file, see parse_emissions_csv.
+
+    Parameters:
+        - path (str or pathlib.Path) : Absolute path to the .csv file
+
+    Returns:
+        - data (np.ndarray) : 2D float array of shape (number of lines, 2) with the years and the values
+    """
+    with open(path, "rb") as f:
+        return parse_emissions_csv(f.read(), str(path))
+
+
+def _check_block(data: np.ndarray, name: str) -> np.ndarray:
+    """Check that data is a numeric (year, value) array as returned by the readers, and return it."""
+    if data.ndim != 2 or data.shape[1] != 2 or not np.issubdtype(data.dtype, np.number):
+        raise ValueError(f"Expected a numeric array of shape (number of years, 2) in {name}, "
+                         f"but received {data.dtype} {data.shape}")
+    return data
+
+
+def parse_emissions_npy(raw: bytes, name: str = "<bytes>") -> np.ndarray:
+    """Parse the contents of a .npy dump holding the (year, value) array of a gas file.
+
+    Parameters:
+        - raw (bytes) : Contents of the .npy file
+        - name (str) : Name of the file, used in error messages
+
+    Returns:
+        - data (np.ndarray) : 2D array of shape (number of years, 2) with the years and the values
+    """
+    try:
+        data = np.load(io.BytesIO(raw), allow_pickle=False)
+    except (OSError, ValueError):
+        raise ValueError(f"Expected a .npy array in {name}")
+    return _check_block(data, name)
+
+
+def read_emissions_npy(path: str | Path) -> np.ndarray:
+    """Read a .npy dump without copying it: the array is memory-mapped read-only, see parse_emissions_npy.
+
+    Parameters:
+        - path (str or pathlib.Path) : Absolute path to the .npy file
+
+    Returns:
+        - data (np.ndarray) : 2D memory-mapped array of shape (number of years, 2) with the years and the values
+    """
+    try:
+        data = np.load(path, mmap_mode="r", allow_pickle=False)
+    except ValueError:
+        raise ValueError(f"Expected a .npy array in {path}")
+    return _check_block(data, str(path))
+
+
+def parse_emissions_txt(raw: bytes, name: str = "<bytes>") -> np.ndarray:
+    """Parse the contents of a text gas file: "year value" lines separated by spaces or commas, # starting a comment.
+
+    Parameters:
+        - raw (bytes) : Contents of the .txt file
+        - name (str) : Name of the file, used in error messages
+
+    Returns:
+        - data (np.ndarray) : 2D float array of shape (number of lines, 2) with the years and the values
+    """
+    text = raw.decode("utf-8").replace(",", " ")
+    if not any(line.partition("#")[0].strip() for line in text.splitlines()):
+        return np.empty((0, 2))
+    try:
+        data = np.loadtxt(io.StringIO(text), comments="#", ndmin=2)
+    except ValueError:
+        raise ValueError(f"Expected numeric year value lines in {name}")
+    return _check_block(data, name)
+
+
+def _read_with(parse: Callable[[bytes, str], np.ndarray]) -> Callable[[str | Path], np.ndarray]:
+    """Build a reader of files from a parser of their contents."""
+    def read(path: str | Path) -> np.ndarray:
+        with open(path, "rb") as f:
+            return parse(f.read(), str(path))
+    return read
+
+
+# Parser of the contents and reader of the files of each suffix, see register_reader
+READERS: Dict[str, Tuple[Callable[[bytes, str], np.ndarray], Callable[[str | Path], np.ndarray]]] = {
+    ".csv": (parse_emissions_csv, read_emissions_csv),
+    ".npy": (parse_emissions_npy, read_emissions_npy),
+    ".txt": (parse_emissions_txt, _read_with(parse_emissions_txt)),
+}
+
+
+def register_reader(
+    suffix: str,
+    parse: Callable[[bytes, str], np.ndarray],
+    read: Callable[[str | Path], np.ndarray] | None = None,
+) -> None:
+    """Register how the gas files with the given suffix are read, replacing the reader already registered for it.
+        Register the classification rule of the format as well, see analytic_tools.formats.
+
+    Parameters:
+        - suffix (str) : suffix of the files, e.g. ".npy"
+        - parse (Callable[[bytes, str], np.ndarray]) : parser of the contents of a file, given its contents and name,
+                                                       returning a (year, value) array of shape (number of years, 2)
+        - read (Callable[[str | Path], np.ndarray] or None) : reader of a file given its path, e.g. memory-mapping it,
+                                                       the file is read and given to parse if None
+
+    Returns:
+        None
+    """
+    READERS[suffix] = (parse, read if read is not None else _read_with(parse))
+
+
+def parse_emissions(raw: bytes, name: str) -> np.ndarray:
+    """Parse the contents of a gas file with the parser registered for the suffix of its name.
+
+    Parameters:
+        - raw (bytes) : Contents of the file
+        - name (str) : Name of the file
+
+    Returns:
+        - data (np.ndarray) : 2D array of shape (number of years, 2) with the years and the values
+    """
+    suffix = os.path.splitext(name)[1]
+    if suffix not in READERS:
+        raise ValueError(f"No reader registered for the {suffix or 'missing'} suffix of {name}")
+    return READERS[suffix][0](raw, name)
+
+
+def read_emissions(path: str | Path) -> np.ndarray:
+    """Read a gas file with the reader registered for its suffix.
+
+    Parameters:
+        - path (str or pathlib.Path) : Absolute path to the file
+
+    Returns:
+        - data (np.ndarray) : 2D array of shape (number of years, 2) with the years and the values
+    """
+    suffix = os.path.splitext(path)[1]
+    if suffix not in READERS:
+        raise ValueError(f"No reader registered for the {suffix or 'missing'} suffix of {path}")
+    return READERS[suffix][1](path)
+
+
+def build_emissions(blocks: Iterable[Tuple[str, str, np.ndarray]]) -> EmissionsData:
+    """Assemble parsed (source, gas, data) blocks into one EmissionsData.
+        The year axis is the union of the years of all the blocks.
+
+    Parameters:
+        - blocks (Iterable[Tuple[str, str, np.ndarray]]) : name of the source, gas formula and
+                                                           (year, value) array as returned by read_emissions_csv
+
+    Returns:
+        - (EmissionsData) : the assembled dataset, with sources and gases sorted by name
+    """
+    blocks = list(blocks)
+    sources = sorted({source for source, _, _ in blocks})
+    gases = sorted({gas for _, gas, _ in blocks})
+    if blocks:
+        years = np.unique(np.concatenate([data[:, 0] for _, _, data in blocks])).astype(np.int64)
+    else:
+        years = np.empty(0, dtype=np.int64)
+
+    values = np.full((len(years), len(sources), len(gases)), np.nan)
+    source_pos = {source: i for i, source in enumerate(sources)}
+    gas_pos = {gas: i for i, gas in enumerate(gases)}
+    for source, gas, data in blocks:
+        rows = np.searchsorted(years, data[:, 0])
+        values[rows, source_pos[source], gas_pos[gas]] = data[:, 1]
+
+    return EmissionsData(years, sources, gases, values)
+
+
+def gas_from_dir(gas_dir: str | Path) -> str:
+    """Derive the gas formula from a gas_[gas_formula] directory name."""
+    return Path(gas_dir).name.removeprefix("gas_")
+
+
+def source_from_file(file_path: str | Path, gas: str) -> str:
+    """Derive the source name from a restructured src_[source]_[gas_formula][suffix] file name."""
+    return Path(file_path).name.rpartition(f"_{gas}")[0]
+
+
+def _read_gas_dir(gas_dir: Path) -> List[Tuple[str, str, np.ndarray]]:
+    """Read every gas file of a gas_[gas_formula] directory into (source, gas, data) blocks."""
+    gas = gas_from_dir(gas_dir)
+    blocks = []
+    for file in sorted(gas_dir.iterdir()):
+        if is_temp_file(file.name):
+            # Copy being written, its destination is read instead
+            continue
+        if not file.is_file():
+            # Invalid argument, cannot read it as a file
+            raise FileNotFoundError(f"Object pointed to by {file} is not a file")
+        elif file.suffix not in READERS:
+            # Invalid file type, must have a registered reader
+            raise TypeError(f"Object pointed to by {file} is not a .csv file or a file of a registered format")
+        blocks.append((source_from_file(file, gas), gas, read_emissions(file)))
+    return blocks
+
+
+def load_gas_dir(gas_dir: str | Path) -> EmissionsData:
+    """Load the gas files of a single gas_[gas_formula] directory.
+        The directory must contain restructured gas files only, .csv files or files of a format in READERS.
+
+    Parameters:
+        - gas_dir (str or pathlib.Path) : Absolute path to the gas_[gas_formula] directory
+
+    Returns:
+        - (EmissionsData) : the dataset, with a single gas
+    """
+    gas_dir = Path(gas_dir)
+    if not gas_dir.is_dir():
+        raise NotADirectoryError(f"Expected an existing directory, but received {gas_dir}")
+    return build_emissions(_read_gas_dir(gas_dir))
+
+
+def fingerprint_by_gas(by_gas_dir: str | Path) -> Dict[str, List[int]]:
+    """Record the size and modification time of every file under the by_gas directory.
+        Restructured files are rewritten when their source changes, so any change of contents also changes the fingerprint.
+
+    Parameters:
+        - by_gas_dir (str or pathlib.Path) : Absolute path to the by_gas directory containing gas_[gas_formula] subdirectories
+
+    Returns:
+        - (Dict[str, List[int]]) : a dictionary mapping the path of each file, relative to by_gas_dir, to [size, mtime_ns]
+    """
+    fingerprint = {}
+    with os.scandir(by_gas_dir) as gas_dirs:
+        for gas_dir in gas_dirs:
+            if not gas_dir.is_dir():
+                continue
+            with os.scandir(gas_dir.path) as files:
+                for file in files:
+                    if is_temp_file(file.name):
+                        continue
+                    stat = file.stat()
+                    fingerprint[f"{gas_dir.name}/{file.name}"] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def save_emissions_cache(data: EmissionsData, cache_dir: str | Path, fingerprint: Dict[str, List[int]]) -> None:
+    """Store the dataset in cache_dir as a raw .npy array of values, with a JSON sidecar holding
+        the labels and the fingerprint of the files the dataset was loaded from.
+
+    Parameters:
+        - data (EmissionsData) : the dataset to store
+        - cache_dir (str or pathlib.Path) : Absolute path to the directory to store the cache in
+        - fingerprint (Dict[str, List[int]]) : fingerprint of the source files, as returned by fingerprint_by_gas
+
+    Returns:
+        None
+    """
+    cache_dir = Path(cache_dir)
+    writer = AtomicWriter()
+
+    def save_values(tmp: Path) -> None:
+        # Through a file object, np.save would add the .npy suffix to the temporary path
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(data.values))
+
+    writer.write(cache_dir / CACHE_VALUES_NAME, save_values)
+    # The sidecar is written last, so that a cache interrupted while being written is never valid
+    labels = {
+        "years": data.years.tolist(),
+        "sources": data.sources,
+        "gases": data.gases,
+        "fingerprint": fingerprint,
+    }
+
+    def save_labels(tmp: Path) -> None:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(labels, f)
+
+    writer.write(cache_dir / CACHE_LABELS_NAME, save_labels)
+
+
+def read_emissions_cache(cache_dir: str | Path) -> Tuple[EmissionsData, Dict[str, List[int]]]:
+    """Read the dataset stored in cache_dir, memory-mapping the values instead of reading them.
+        The cache is not validated, see load_emissions for that.
+
+    Parameters:
+        - cache_dir (str or pathlib.Path) : Absolute path to the directory the cache is stored in
+
+    Returns:
+        - data (EmissionsData) : the dataset, with read-only memory-mapped values
+        - fingerprint (Dict[str, List[int]]) : fingerprint of the files the dataset was loaded from
+    """
+    cache_dir = Path(cache_dir)
+    with open(cache_dir / CACHE_LABELS_NAME, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+    values = np.load(cache_dir / CACHE_VALUES_NAME, mmap_mode="r")
+    years = np.array(labels["years"], dtype=np.int64)
+    if values.shape != (len(years), len(labels["sources"]), len(labels["gases"])):
+        raise ValueError(f"The cached values do not match the labels in {cache_dir}")
+    return EmissionsData(years, labels["sources"], labels["gases"], values), labels["fingerprint"]
+
+
+def load_emissions(
+    by_gas_dir: str | Path,
+    gases: Iterable[str] | None = None,
+    cache_dir: str | Path | None = None,
+) -> EmissionsData:
+    """Load every src_[source]_[gas_formula].csv file (or file of another format in READERS)
+        under pollution_data_restructured/by_gas into one dataset.
+
+    Parameters:
+        - by_gas_dir (str or pathlib.Path) : Absolute path to the by_gas directory containing gas_[gas_formula] subdirectories
+        - gases (Iterable[str] or None) : Names of the gas_[gas_formula] subdirectories to load, all of them if None
+        - cache_dir (str or pathlib.Path or None) : Absolute path to the directory holding the binary cache of the dataset.
+                                    If provided, the cache is memory-mapped when no file under by_gas_dir changed
+                                    since it was written, otherwise all the files are parsed and the cache is rewritten.
+
+    Returns:
+        - (EmissionsData) : the dataset
+    """
+    by_gas_dir = Path(by_gas_dir)
+    if not by_gas_dir.is_dir():
+        raise NotADirectoryError(f"Expected an existing directory, but received {by_gas_dir}")
+    if gases is not None:
+        gases = set(gases)
+
+    if cache_dir is not None:
+        fingerprint = fingerprint_by_gas(by_gas_dir)
+        try:
+            data, cached_fingerprint = read_emissions_cache(cache_dir)
+        except (OSError, ValueError, KeyError):
+            # Missing or corrupt cache
+            cached_fingerprint = None
+        if cached_fingerprint != fingerprint:
+            data = load_emissions(by_gas_dir)
+            save_emissions_cache(data, cache_dir, fingerprint)
+        if gases is None:
+            return data
+        # Keep only the requested gases
+        keep = [i for i, gas in enumerate(data.gases) if f"gas_{gas}" in gases]
+        return EmissionsData(data.years, data.sources, [data.gases[i] for i in keep], data.values[:, :, keep])
+
+    blocks = []
+    for gas_dir in sorted(by_gas_dir.iterdir()):
+        if not gas_dir.is_dir():
+            # Invalid structure of by_gas_dir
+            raise NotADirectoryError(f"Object pointed to by {gas_dir} is not a directory")
+        if gases is None or gas_dir.name in gases:
+            blocks.extend(_read_gas_dir(gas_dir))
+    return build_emissions(blocks)
+
+
+def select_gas(data: EmissionsData, gas: str) -> EmissionsData:
+    """Extract the dataset of a single gas, keeping only the years and sources with data for it.
+
+    Parameters:
+        - data (EmissionsData) : the dataset to select from
+        - gas (str) : the gas formula
+
+    Returns:
+        - (EmissionsData) : the dataset of the gas, empty if the gas is not present in data
+    """
+    if gas not in data.gases:
+        return EmissionsData(np.empty(0, dtype=np.int64), [], [gas], np.empty((0, 0, 1)))
+    values = data.values[:, :, [data.gases.index(gas)]]
+    has_data = ~np.isnan(values[:, :, 0])
+    rows = has_data.any(axis=1)
+    columns = has_data.any(axis=0)
+    return EmissionsData(
+        data.years[rows],
+        [source for source, keep in zip(data.sources, columns) if keep],
+        [gas],
+        values[rows][:, columns],
+    )
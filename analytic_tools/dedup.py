@@ -0,0 +1,107 @@
+"""Module containing the content-addressed deduplication of files: finding the groups of byte-identical files.
+Files are grouped by size first, then by their first block, and only the files still sharing both are hashed,
+so that most files are never read in full.
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple
+
+from analytic_tools.manifest import hash_file
+
+# Number of bytes read from the start of each file of the same size as another one, before hashing them in full
+PREFIX_SIZE = 4096
+
+
+class DuplicateGroup(NamedTuple):
+    """Byte-identical files.
+
+    Attributes:
+        - size (int) : size of each file in bytes
+        - sha256 (str) : hexadecimal SHA-256 digest of the contents of each file
+        - paths (List[pathlib.Path]) : paths to the files, at least two, sorted
+    """
+
+    size: int
+    sha256: str
+    paths: List[Path]
+
+
+def _read_prefix(path: Path) -> bytes:
+    """Read the first PREFIX_SIZE bytes of the file pointed to by path."""
+    with open(path, "rb") as f:
+        return f.read(PREFIX_SIZE)
+
+
+def find_duplicates(files: Iterable[str | Path | os.DirEntry], workers: int = 1) -> List[DuplicateGroup]:
+    """Find the groups of byte-identical files among files.
+        A file whose size is unique is never opened, and a file whose first block is unique among the files of
+        its size is only read up to PREFIX_SIZE bytes. The empty files of files form a group without being opened.
+
+    Parameters:
+        - files (Iterable[str or pathlib.Path or os.DirEntry]) : Absolute paths to the files, or their directory
+                                                                 entries (e.g. from scan_directory or from a
+                                                                 FileSystemIndex) whose recorded stat is used
+        - workers (int) : Number of threads reading files at the same time, default to one
+
+    Returns:
+        - groups (List[DuplicateGroup]) : the groups of at least two identical files, ordered by size and digest
+    """
+    # Pre-filter: only the files sharing their size with another file can be duplicates
+    by_size: Dict[int, List[Path]] = {}
+    for file in files:
+        if isinstance(file, (str, Path)):
+            size, path = os.stat(file).st_size, Path(file)
+        else:
+            size, path = file.stat().st_size, Path(file.path)
+        by_size.setdefault(size, []).append(path)
+
+    groups = []
+    candidates = {size: paths for size, paths in by_size.items() if len(paths) > 1}
+    if 0 in candidates:
+        groups.append(DuplicateGroup(0, hashlib.sha256().hexdigest(), sorted(candidates.pop(0))))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Second filter: the first block of each file
+        to_hash = []
+        for size, paths in candidates.items():
+            by_prefix: Dict[bytes, List[Path]] = {}
+            for path, prefix in zip(paths, executor.map(_read_prefix, paths)):
+                by_prefix.setdefault(prefix, []).append(path)
+            for prefix, same in by_prefix.items():
+                if len(same) < 2:
+                    continue
+                if size <= PREFIX_SIZE:
+                    # The whole file was read already
+                    groups.append(DuplicateGroup(size, hashlib.sha256(prefix).hexdigest(), sorted(same)))
+                else:
+                    to_hash.append((size, same))
+
+        # Hash the remaining candidates in full, in chunks
+        for size, paths in to_hash:
+            by_digest: Dict[str, List[Path]] = {}
+            for path, digest in zip(paths, executor.map(hash_file, paths)):
+                by_digest.setdefault(digest, []).append(path)
+            groups.extend(
+                DuplicateGroup(size, digest, sorted(same)) for digest, same in by_digest.items() if len(same) > 1)
+
+    return sorted(groups, key=lambda group: (group.size, group.sha256))
+
+
+def duplicate_report(groups: Iterable[DuplicateGroup]) -> Dict[str, int]:
+    """Summarize the duplicates found by find_duplicates.
+
+    Parameters:
+        - groups (Iterable[DuplicateGroup]) : the groups of identical files
+
+    Returns:
+        - (Dict[str, int]) : a dictionary with following keys: duplicate groups, duplicate files (the files beyond the
+                             first of each group) and wasted bytes (the bytes taken by these files)
+    """
+    groups = list(groups)
+    return {
+        "duplicate groups": len(groups),
+        "duplicate files": sum(len(group.paths) - 1 for group in groups),
+        "wasted bytes": sum(group.size * (len(group.paths) - 1) for group in groups),
+    }
@@ -0,0 +1,71 @@
+"""Module containing the names of the figures and the record of the options they were drawn with,
+so that a figure is redrawn when its data or its options change. It does not import matplotlib,
+so that the figures to draw can be planned without it.
+"""
+import json
+from pathlib import Path
+from typing import Dict, Tuple
+
+from analytic_tools.atomic import AtomicWriter
+
+# Size of the plots in inches and resolution of the raster formats in dots per inch
+DEFAULT_FIGSIZE = (10.0, 8.0)
+DEFAULT_DPI = 200
+# Resolution of the preview plots
+PREVIEW_DPI = 72
+# Inserted before the format suffix of the preview plots, which are kept next to the full plots: gas_CO2.preview.png
+PREVIEW_SUFFIX = ".preview"
+# Suffix of the record of the options of the figures, stored next to the figures directory, which only holds figures:
+# pollution_data_restructured/figures.options.json for pollution_data_restructured/figures
+FIGURE_OPTIONS_SUFFIX = ".options.json"
+
+
+def figure_name(gas_dir_name: str, fmt: str, preview: bool = False) -> str:
+    """Return the file name of the plot of the gas_[gas_formula] directory gas_dir_name,
+        gas_[gas_formula].[fmt], or gas_[gas_formula].preview.[fmt] for a preview.
+    """
+    return f"{gas_dir_name}{PREVIEW_SUFFIX if preview else ''}.{fmt}"
+
+
+def gas_dir_of_figure(name: str) -> str:
+    """Return the name of the gas_[gas_formula] directory of the plot named name, see figure_name."""
+    return name.split(".", 1)[0]
+
+
+def render_options(figsize: Tuple[float, float], dpi: int | None, preview: bool) -> Dict:
+    """Return the options a plot is drawn with, as recorded next to the figures directory: its size in inches and its
+        resolution, dpi or the default resolution of the plots (or of the previews if preview is True) if None.
+    """
+    return {"figsize": [float(size) for size in figsize], "dpi": dpi or (PREVIEW_DPI if preview else DEFAULT_DPI)}
+
+
+def figure_options_path(fig_dir: str | Path) -> Path:
+    """Return the path to the record of the options of the plots of fig_dir, see FIGURE_OPTIONS_SUFFIX."""
+    fig_dir = Path(fig_dir)
+    return fig_dir.parent / f"{fig_dir.name}{FIGURE_OPTIONS_SUFFIX}"
+
+
+def load_figure_options(fig_dir: str | Path) -> Dict[str, Dict]:
+    """Load the options of the plots of fig_dir, by file name. A missing or unreadable record is treated as empty,
+        which simply means that every plot is redrawn.
+    """
+    try:
+        with open(figure_options_path(fig_dir), "r", encoding="utf-8") as f:
+            options = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return options if isinstance(options, dict) else {}
+
+
+def save_figure_options(fig_dir: str | Path, options: Dict[str, Dict]) -> None:
+    """Store the options of the plots of fig_dir, by file name, see load_figure_options."""
+    def write(tmp: Path) -> None:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(options, f, indent=1, sort_keys=True)
+
+    AtomicWriter().write(figure_options_path(fig_dir), write)
+
+
+def is_up_to_date(fig_dir: str | Path, name: str, options: Dict, recorded: Dict[str, Dict]) -> bool:
+    """Check that the plot named name exists in fig_dir and was drawn with options, according to recorded."""
+    return recorded.get(name) == options and (Path(fig_dir) / name).exists()
@@ -0,0 +1,114 @@
+"""Module containing the classification rules of the source file formats: which files of the pollution_data tree
+are original gas files, and of which gas. The files are read by the readers of analytic_tools.dataset.
+"""
+import os
+import re
+from typing import Iterable, NamedTuple, Tuple
+
+# Environment variable holding the comma-separated names of the formats returned by get_formats,
+# inherited by worker processes
+SOURCE_FORMATS_ENV = "POLLUTION_SOURCE_FORMATS"
+
+
+class SourceFormat(NamedTuple):
+    """Classification rule of the original gas files of one format.
+
+    Attributes:
+        - name (str) : name of the format
+        - suffix (str) : suffix of the files, which also selects their reader
+        - pattern (str) : regular expression the file name without suffix must fully match,
+                          the "gas" group being a gas formula registered in the gas registry
+    """
+
+    name: str
+    suffix: str
+    pattern: str
+
+
+# Formats known by name, e.g. on the command line
+BUILTIN_FORMATS = {
+    "csv": SourceFormat("csv", ".csv", r"(?P<gas>.+)"),
+    "npy": SourceFormat("npy", ".npy", r"(?P<gas>.+)_\d+"),
+    "txt": SourceFormat("txt", ".txt", r"(?P<gas>.+)_\d+"),
+}
+# Formats ingested by default, the original [gas_formula].csv files only
+DEFAULT_FORMATS = (BUILTIN_FORMATS["csv"],)
+
+
+class FormatRules:
+    """Ordered set of formats, one per suffix. When several files hold the same gas of the same source,
+        the file of the first format is kept.
+
+    Parameters:
+        - formats (Iterable[SourceFormat]) : the formats, by priority
+
+    Example:
+
+        .. highlight:: python
+        .. code-block:: python
+
+            rules = FormatRules([BUILTIN_FORMATS["csv"], BUILTIN_FORMATS["npy"]])
+            rules.match("CH4_198.npy", {"CH4"})  # ("CH4", 1)
+            rules.match("CH4_AgG.csv", {"CH4"})  # None
+    """
+
+    def __init__(self, formats: Iterable[SourceFormat]) -> None:
+        self.formats: Tuple[SourceFormat, ...] = tuple(formats)
+        self._by_suffix = {}
+        for priority, source_format in enumerate(self.formats):
+            if source_format.suffix in self._by_suffix:
+                raise ValueError(f"Expected one format per suffix, but {source_format.suffix} is given twice")
+            self._by_suffix[source_format.suffix] = (re.compile(source_format.pattern), priority)
+        self.suffixes = frozenset(self._by_suffix)
+
+    def match(self, name: str, formulas: frozenset | set) -> Tuple[str, int] | None:
+        """Return the gas formula and the priority of the format of the file name if it is an original gas file,
+            None otherwise.
+        """
+        stem, suffix = os.path.splitext(name)
+        rule = self._by_suffix.get(suffix)
+        if rule is None:
+            return None
+        match = rule[0].fullmatch(stem)
+        if match is None or match.group("gas") not in formulas:
+            return None
+        return match.group("gas"), rule[1]
+
+
+def parse_formats(names: Iterable[str]) -> FormatRules:
+    """Build the rules of the builtin formats with the given names, by priority.
+
+    Parameters:
+        - names (Iterable[str]) : names of formats of BUILTIN_FORMATS
+
+    Returns:
+        - (FormatRules) : the rules
+    """
+    names = list(names)
+    unknown = [name for name in names if name not in BUILTIN_FORMATS]
+    if unknown or not names:
+        raise ValueError(f"Expected some of the formats {sorted(BUILTIN_FORMATS)}, but received {names}")
+    return FormatRules(BUILTIN_FORMATS[name] for name in names)
+
+
+# Rules used by classify_csv_files, see get_formats
+_formats: FormatRules | None = None
+
+
+def get_formats() -> FormatRules:
+    """Return the rules in use: the ones given to set_formats, otherwise the builtin formats named by the
+        POLLUTION_SOURCE_FORMATS environment variable, otherwise the rules of DEFAULT_FORMATS.
+    """
+    global _formats
+    if _formats is None:
+        names = os.environ.get(SOURCE_FORMATS_ENV)
+        _formats = parse_formats(names.split(",")) if names else FormatRules(DEFAULT_FORMATS)
+    return _formats
+
+
+def set_formats(formats: FormatRules | None) -> None:
+    """Use formats from now on in this process, or go back to the default lookup of get_formats if None.
+        Other processes do not see it, unless the formats are named by the POLLUTION_SOURCE_FORMATS environment variable.
+    """
+    global _formats
+    _formats = formats
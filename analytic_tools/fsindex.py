@@ -0,0 +1,257 @@
+"""Module containing the persistent index of a directory tree, stored in SQLite.
+The index records the entries of every directory with their stat data and classification, and is refreshed
+incrementally: a directory whose modification time did not change is not listed again.
+"""
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, List, NamedTuple
+
+from analytic_tools.formats import FormatRules, get_formats
+from analytic_tools.gases import get_registry
+from analytic_tools.utilities import DirectoryIndex
+
+# Name of the index database, stored next to the manifest in pollution_data_restructured
+INDEX_NAME = "fsindex.sqlite"
+# Version of the schema, an index of another version is rebuilt
+INDEX_VERSION = 1
+# A directory modified less than this many nanoseconds before it was listed may still change within the same
+# modification time tick, its modification time is not trusted and it is listed again on the next refresh
+RACY_WINDOW_NS = 2_000_000_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS entries (
+    parent TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    is_file INTEGER NOT NULL,
+    is_symlink INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    gas TEXT,
+    PRIMARY KEY (parent, name)
+);
+"""
+
+
+class IndexedStat(NamedTuple):
+    """The stat data of an entry recorded in the index, the subset of os.stat_result used by the package."""
+
+    st_size: int
+    st_mtime_ns: int
+    st_ino: int
+
+
+class IndexedEntry:
+    """Directory entry read from the index, usable in place of the os.DirEntry objects of scan_directory.
+        Its type and stat data are those recorded by the last refresh of the index, no syscall is made.
+
+    Attributes:
+        - name (str) : name of the entry
+        - path (str) : path of the entry, joined to the path of its directory
+        - gas (str or None) : gas formula of an original gas file, see classify_csv_files, None for the other entries
+    """
+
+    __slots__ = ("name", "path", "gas", "_is_dir", "_is_file", "_is_symlink", "_stat")
+
+    def __init__(self, parent: str, row: tuple) -> None:
+        name, is_dir, is_file, is_symlink, size, mtime_ns, inode, gas = row
+        self.name = name
+        self.path = os.path.join(parent, name)
+        self.gas = gas
+        self._is_dir = bool(is_dir)
+        self._is_file = bool(is_file)
+        self._is_symlink = bool(is_symlink)
+        self._stat = IndexedStat(size, mtime_ns, inode)
+
+    def is_dir(self, *, follow_symlinks: bool = True) -> bool:
+        return self._is_dir and (follow_symlinks or not self._is_symlink)
+
+    def is_file(self, *, follow_symlinks: bool = True) -> bool:
+        return self._is_file and (follow_symlinks or not self._is_symlink)
+
+    def is_symlink(self) -> bool:
+        return self._is_symlink
+
+    def stat(self, *, follow_symlinks: bool = True) -> IndexedStat:
+        return self._stat
+
+    def inode(self) -> int:
+        return self._stat.st_ino
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def __repr__(self) -> str:
+        return f"<IndexedEntry {self.name!r}>"
+
+
+def _entry_row(entry: os.DirEntry, position: int, formats: FormatRules, formulas: frozenset) -> tuple:
+    """Record the type, stat data and classification of a directory entry from os.scandir."""
+    try:
+        stat = entry.stat()
+    except OSError:
+        # Broken symbolic link
+        stat = entry.stat(follow_symlinks=False)
+    is_file = entry.is_file()
+    match = formats.match(entry.name, formulas) if is_file else None
+    return (position, entry.name, entry.is_dir(), is_file, entry.is_symlink(),
+            stat.st_size, stat.st_mtime_ns, stat.st_ino, match[0] if match else None)
+
+
+class FileSystemIndex:
+    """Persistent index of the directory tree with root directory root.
+
+    Parameters:
+        - root (str or pathlib.Path) : Absolute path to the root directory of the tree, e.g. pollution_data
+        - db_path (str or pathlib.Path) : Absolute path to the SQLite database, created if it does not exist
+
+    Example:
+
+        .. highlight:: python
+        .. code-block:: python
+
+            with FileSystemIndex(work_dir / "pollution_data", work_dir / INDEX_NAME) as fsindex:
+                changed = fsindex.refresh()
+                res = get_diagnostics(fsindex.root, index=fsindex.directory_index())
+    """
+
+    def __init__(self, root: str | Path, db_path: str | Path) -> None:
+        # Check if root and db_path are of type str or Path, otherwise raise TypeError
+        if not isinstance(root, (str, Path)) or not isinstance(db_path, (str, Path)):
+            raise TypeError("The provided path must be a str or Path object")
+        self.root = Path(root)
+        if not self.root.is_dir():
+            raise NotADirectoryError(f"Expected an existing directory, but received {self.root}")
+
+        self._db = sqlite3.connect(db_path)
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            # Outdated (or new) index, start from scratch
+            self._db.executescript("DROP TABLE IF EXISTS directories; DROP TABLE IF EXISTS entries;")
+            self._db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the database."""
+        self._db.close()
+
+    def __enter__(self) -> "FileSystemIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _rows(self, parent: str) -> List[tuple]:
+        """Rows of the entries of the directory parent, in scandir order, without the position."""
+        return self._db.execute(
+            "SELECT name, is_dir, is_file, is_symlink, size, mtime_ns, inode, gas FROM entries "
+            "WHERE parent = ? ORDER BY position", (parent,)).fetchall()
+
+    def refresh(self, full: bool = False) -> List[Path]:
+        """Bring the index up to date with the tree. Every directory is stat'ed, but only the directories whose
+            modification time changed (or which were marked with mark_changed) are listed again.
+            A file modified in place does not change the modification time of its directory: it is found by a full
+            refresh, or must be reported with mark_changed, e.g. by a file system watcher.
+
+        Parameters:
+            - full (bool) : If True, every directory is listed again and every file is stat'ed
+
+        Returns:
+            - changed (List[pathlib.Path]) : paths of the files added, modified or removed since the last refresh
+        """
+        formats, formulas = get_formats(), get_registry().formulas
+        stored_mtimes = dict(self._db.execute("SELECT path, mtime_ns FROM directories"))
+        changed = []
+        seen = set()
+        now = time.time_ns()
+
+        with self._db:
+            stack = [self.root]
+            while stack:
+                directory = stack.pop()
+                key = str(directory)
+                seen.add(key)
+                mtime_ns = os.stat(directory).st_mtime_ns
+
+                if not full and stored_mtimes.get(key) == mtime_ns:
+                    rows = self._rows(key)
+                else:
+                    with os.scandir(directory) as it:
+                        new = [_entry_row(entry, i, formats, formulas) for i, entry in enumerate(it)]
+                    old = {row[0]: row for row in self._rows(key)}
+                    for row in new:
+                        previous = old.pop(row[1], None)
+                        if row[3] and (previous is None or previous[4:7] != row[5:8]):
+                            changed.append(directory / row[1])
+                    changed.extend(directory / name for name, row in old.items() if row[2])
+
+                    self._db.execute("DELETE FROM entries WHERE parent = ?", (key,))
+                    self._db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         [(key, *row) for row in new])
+                    # A recently modified directory may still change within the same tick, it is listed again next time
+                    trusted = mtime_ns if now - mtime_ns > RACY_WINDOW_NS else None
+                    self._db.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)", (key, trusted))
+                    rows = [row[1:] for row in new]
+
+                # Push subdirectories in reverse so that they are visited in scandir order, as scan_directory does
+                for name, is_dir, _, is_symlink, *_ in reversed(rows):
+                    if is_dir and not is_symlink:
+                        stack.append(directory / name)
+
+            # Forget the directories which no longer exist, their files are removed
+            for (key,) in self._db.execute("SELECT path FROM directories").fetchall():
+                if key not in seen:
+                    changed.extend(Path(key) / name for name, _, is_file, *_ in self._rows(key) if is_file)
+                    self._db.execute("DELETE FROM entries WHERE parent = ?", (key,))
+                    self._db.execute("DELETE FROM directories WHERE path = ?", (key,))
+
+        return changed
+
+    def mark_changed(self, paths: Iterable[str | Path]) -> None:
+        """Report files or directories created, modified or removed since the last refresh, for instance by an
+            inotify watcher, so that their directories are listed again by the next refresh.
+
+        Parameters:
+            - paths (Iterable[str or pathlib.Path]) : Absolute paths to the changed entries
+
+        Returns:
+            None
+        """
+        with self._db:
+            for path in paths:
+                path = Path(path)
+                self._db.executemany("UPDATE directories SET mtime_ns = NULL WHERE path = ?",
+                                     [(str(path),), (str(path.parent),)])
+
+    def directory_index(self) -> DirectoryIndex:
+        """Build the DirectoryIndex of the tree from the index, as of the last refresh, without any syscall.
+
+        Returns:
+            - index (DirectoryIndex) : a dictionary mapping the root and each of its subdirectories to the list
+                                       of IndexedEntry objects found in it, see scan_directory
+        """
+        index = {}
+        rows = self._db.execute(
+            "SELECT parent, name, is_dir, is_file, is_symlink, size, mtime_ns, inode, gas FROM entries "
+            "ORDER BY parent, position")
+        for parent, *row in rows:
+            index.setdefault(Path(parent), []).append(IndexedEntry(parent, row))
+        # Keep the depth-first order of scan_directory, empty directories included
+        ordered = {}
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            entries = index.get(directory, [])
+            ordered[directory] = entries
+            for entry in reversed(entries):
+                if entry.is_dir() and not entry.is_symlink():
+                    stack.append(directory / entry.name)
+        return ordered
@@ -0,0 +1,134 @@
+"""Module containing the registry of the greenhouse gasses: their formula, display label and unit.
+The registry decides which files are original gas files, [gas_formula].csv, and how their plots are labelled.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, NamedTuple
+
+# Environment variable holding the path to a JSON registry loaded by get_registry, inherited by worker processes
+GAS_REGISTRY_ENV = "POLLUTION_GAS_REGISTRY"
+# Unit of the emissions in the original gas files
+DEFAULT_UNIT = r"1000 tonn $\mathrm{CO_2}$-equivalents AR5"
+
+
+class Gas(NamedTuple):
+    """A greenhouse gas.
+
+    Attributes:
+        - formula (str) : chemical formula, the name of its original files [formula].csv
+        - label (str) : label used in the plots, may contain matplotlib mathtext
+        - unit (str) : unit of the emissions, used as label of the y axis of the plots
+    """
+
+    formula: str
+    label: str
+    unit: str = DEFAULT_UNIT
+
+
+# Gasses present in the original pollution_data
+DEFAULT_GASES = (
+    Gas("CO2", r"$\mathrm{CO_2}$"),
+    Gas("CH4", r"$\mathrm{CH_4}$"),
+    Gas("N2O", r"$\mathrm{N_2O}$"),
+    Gas("SF6", r"$\mathrm{SF_6}$"),
+    Gas("H2", r"$\mathrm{H_2}$"),
+)
+
+
+class GasRegistry:
+    """Set of known gasses, indexed by formula so that matching a file name is a single set lookup.
+
+    Parameters:
+        - gases (Iterable[Gas]) : the gasses, a later gas replaces an earlier one with the same formula
+
+    Example:
+
+        .. highlight:: python
+        .. code-block:: python
+
+            registry = GasRegistry(DEFAULT_GASES + (Gas("NH3", "ammonia", "tonnes"),))
+            "NH3" in registry  # True
+            registry.label("NH3")  # "ammonia"
+    """
+
+    def __init__(self, gases: Iterable[Gas]) -> None:
+        self._gases: Dict[str, Gas] = {gas.formula: gas for gas in gases}
+        self.formulas = frozenset(self._gases)
+
+    def __contains__(self, formula: str) -> bool:
+        return formula in self.formulas
+
+    def __iter__(self) -> Iterator[Gas]:
+        return iter(self._gases.values())
+
+    def __len__(self) -> int:
+        return len(self._gases)
+
+    def get(self, formula: str) -> Gas | None:
+        """Return the gas with the given formula, None if it is not registered."""
+        return self._gases.get(formula)
+
+    def label(self, formula: str) -> str:
+        """Return the display label of the gas, the formula itself if it is not registered."""
+        gas = self._gases.get(formula)
+        return gas.label if gas is not None else formula
+
+    def unit(self, formula: str) -> str:
+        """Return the unit of the emissions of the gas, DEFAULT_UNIT if it is not registered."""
+        gas = self._gases.get(formula)
+        return gas.unit if gas is not None else DEFAULT_UNIT
+
+
+def load_registry(path: str | Path, include_defaults: bool = True) -> GasRegistry:
+    """Load a registry from the JSON file at path, holding a list of gasses under the "gases" key:
+
+        {"gases": [{"formula": "NH3", "label": "$\\mathrm{NH_3}$", "unit": "tonnes"}]}
+
+    The label defaults to the formula and the unit to DEFAULT_UNIT.
+
+    Parameters:
+        - path (str or pathlib.Path) : Absolute path to the JSON file
+        - include_defaults (bool) : If True, the gasses of the file extend (or replace) DEFAULT_GASES
+
+    Returns:
+        - (GasRegistry) : the registry
+    """
+    # Check if path is of type str or Path, otherwise raise TypeError
+    if not isinstance(path, (str, Path)):
+        raise TypeError("The provided path must be a str or Path object")
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    if not isinstance(config, dict) or not isinstance(config.get("gases"), list):
+        raise ValueError(f"Expected a list of gasses under the 'gases' key of {path}")
+    gases = list(DEFAULT_GASES) if include_defaults else []
+    for entry in config["gases"]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("formula"), str) or not entry["formula"]:
+            raise ValueError(f"Expected every gas of {path} to have a formula, but received {entry}")
+        gases.append(Gas(entry["formula"], entry.get("label", entry["formula"]), entry.get("unit", DEFAULT_UNIT)))
+    return GasRegistry(gases)
+
+
+# Registry used by is_gas_csv, classify_csv_files and the plots, see get_registry
+_registry: GasRegistry | None = None
+
+
+def get_registry() -> GasRegistry:
+    """Return the registry in use: the one given to set_registry, otherwise the one loaded from the JSON file
+        named by the POLLUTION_GAS_REGISTRY environment variable, otherwise the registry of DEFAULT_GASES.
+    """
+    global _registry
+    if _registry is None:
+        config = os.environ.get(GAS_REGISTRY_ENV)
+        _registry = load_registry(config) if config else GasRegistry(DEFAULT_GASES)
+    return _registry
+
+
+def set_registry(registry: GasRegistry | None) -> None:
+    """Use registry from now on in this process, or go back to the default lookup of get_registry if None.
+        Other processes do not see it, unless it is passed to them (as plot_pollution_data does)
+        or named by the POLLUTION_GAS_REGISTRY environment variable.
+    """
+    global _registry
+    _registry = registry
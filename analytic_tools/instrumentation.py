@@ -0,0 +1,150 @@
+"""Module containing the instrumentation used to time the stages of analyze_pollution_data
+and to count the files, bytes and figures they process.
+"""
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator
+
+# Supported values of the profile argument of Metrics
+PROFILE_MODES = (None, "cprofile", "tracemalloc")
+
+
+class Metrics:
+    """Collector of the wall time of named stages, of counters and of per-item samples (e.g. per-figure render times).
+    Every measure is also passed to an optional callback as soon as it is recorded, as a dictionary with
+    following keys: kind ("stage", "count" or "sample"), name and value (plus key for samples).
+
+    Parameters:
+        - callback (Callable[[Dict], None] or None) : function called with each recorded measure
+        - profile (str or None) : None, "cprofile" to profile the stages with cProfile (see dump_profile),
+                                  or "tracemalloc" to record the peak memory of each stage
+
+    Stages can be nested, e.g. a "load" stage inside a "plot" stage: the profiler runs from the start of the
+    outermost stage to its end, and the peak memory of a stage includes the peaks of the stages nested in it.
+
+    Example:
+
+        .. highlight:: python
+        .. code-block:: python
+
+            metrics = Metrics()
+            with metrics.stage("restructure"):
+                ...
+            metrics.count("bytes copied", 1024)
+            metrics.write_json("metrics.json")
+    """
+
+    def __init__(self, callback: Callable[[Dict], None] | None = None, profile: str | None = None) -> None:
+        if profile not in PROFILE_MODES:
+            raise ValueError(f"Expected profile to be one of {PROFILE_MODES}, but received {profile}")
+        self.callback = callback
+        self.profile = profile
+        self.stages = {}
+        self.counters = {}
+        self.samples = {}
+        self.peak_memory = {}
+        self._profiler = cProfile.Profile() if profile == "cprofile" else None
+        # Peak memory of each open stage before the last reset of the tracemalloc peak, outermost first
+        self._open_stages = []
+        self._lock = threading.Lock()
+
+    def _emit(self, measure: Dict) -> None:
+        if self.callback is not None:
+            self.callback(measure)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Context manager measuring the wall time of the code it encloses as the stage name.
+            The time of a stage entered several times is accumulated.
+        """
+        peak = [0]
+        with self._lock:
+            # Only the outermost stage starts the profiler, a nested stage starts measuring its own peak
+            if not self._open_stages:
+                if self._profiler is not None:
+                    self._profiler.enable()
+                if self.profile == "tracemalloc":
+                    tracemalloc.start()
+            elif self.profile == "tracemalloc":
+                current = tracemalloc.get_traced_memory()[1]
+                for open_peak in self._open_stages:
+                    open_peak[0] = max(open_peak[0], current)
+                tracemalloc.reset_peak()
+            self._open_stages.append(peak)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._open_stages = [open_peak for open_peak in self._open_stages if open_peak is not peak]
+                if self.profile == "tracemalloc":
+                    peak[0] = max(peak[0], tracemalloc.get_traced_memory()[1])
+                    self.peak_memory[name] = max(self.peak_memory.get(name, 0), peak[0])
+                # Only the outermost stage stops the profiler
+                if not self._open_stages:
+                    if self._profiler is not None:
+                        self._profiler.disable()
+                    if self.profile == "tracemalloc":
+                        tracemalloc.stop()
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self._emit({"kind": "stage", "name": name, "value": seconds})
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add amount to the counter name."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        self._emit({"kind": "count", "name": name, "value": amount})
+
+    def sample(self, name: str, key: str, value: float) -> None:
+        """Record the measure value of the item key in the series name, e.g. sample("render seconds", "gas_CO2", 0.8)."""
+        with self._lock:
+            self.samples.setdefault(name, {})[key] = value
+        self._emit({"kind": "sample", "name": name, "key": key, "value": value})
+
+    def to_dict(self) -> Dict:
+        """Return all the measures as a dictionary with following keys: stages (seconds per stage),
+            counters, samples and, in tracemalloc mode, peak memory (bytes per stage).
+        """
+        with self._lock:
+            measures = {
+                "stages": dict(self.stages),
+                "counters": dict(self.counters),
+                "samples": {name: dict(series) for name, series in self.samples.items()},
+            }
+            if self.profile == "tracemalloc":
+                measures["peak memory"] = dict(self.peak_memory)
+        return measures
+
+    def to_json(self) -> str:
+        """Return all the measures as a JSON string, see to_dict."""
+        return json.dumps(self.to_dict(), indent=2)
+
+    def write_json(self, path: str | Path) -> None:
+        """Write all the measures to the JSON file at path, see to_dict."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+
+    def dump_profile(self, path: str | Path) -> None:
+        """Write the cProfile statistics of all the stages to path, readable with pstats or snakeviz.
+            Only available with profile="cprofile".
+        """
+        if self._profiler is None:
+            raise RuntimeError("The cProfile statistics are only collected with profile='cprofile'")
+        pstats.Stats(self._profiler).dump_stats(str(path))
+
+
+@contextmanager
+def optional_stage(metrics: Metrics | None, name: str) -> Iterator[None]:
+    """Context manager timing the enclosed code as the stage name of metrics, doing nothing if metrics is None."""
+    if metrics is None:
+        yield
+    else:
+        with metrics.stage(name):
+            yield
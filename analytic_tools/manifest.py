@@ -0,0 +1,138 @@
+"""Module containing the functions used to keep track of the source files already restructured,
+so that unchanged files do not have to be copied (and plotted) again.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict
+
+from analytic_tools.atomic import AtomicWriter
+
+# Version of the manifest layout, a manifest with another version is ignored
+MANIFEST_VERSION = 2
+# Number of bytes read at a time when hashing a file
+HASH_CHUNK_SIZE = 2**20
+
+
+def hash_file(path: str | Path, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """Compute the SHA-256 digest of the contents of the file pointed to by path, reading it in chunks.
+
+    Parameters:
+        - path (str or pathlib.Path) : Absolute path to the file to hash
+        - chunk_size (int) : Number of bytes read at a time
+
+    Returns:
+        - (str) : Hexadecimal digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str | Path) -> Dict[str, Dict]:
+    """Load the manifest stored at path.
+        A missing, unreadable or outdated manifest is treated as empty, which simply means that every file is copied again.
+
+    Parameters:
+        - path (str or pathlib.Path) : Absolute path to the manifest file
+
+    Returns:
+        - files (Dict[str, Dict]) : a dictionary mapping the absolute path of each source file to its record, with following keys:
+                                    destination, placement, size, mtime_ns, sha256
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(path: str | Path, files: Dict[str, Dict]) -> None:
+    """Store the records of the restructured source files as the manifest at path.
+
+    Parameters:
+        - path (str or pathlib.Path) : Absolute path to the manifest file
+        - files (Dict[str, Dict]) : a dictionary of the same type as return type of load_manifest
+
+    Returns:
+        None
+    """
+    def write(tmp: Path) -> None:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": files}, f, indent=1, sort_keys=True)
+
+    # A run interrupted while saving keeps the previous manifest
+    AtomicWriter().write(path, write)
+
+
+def make_record(destination: str | Path, stat: os.stat_result, sha256: str, placement: str = "copy") -> Dict:
+    """Create the manifest record of a source file.
+
+    Parameters:
+        - destination (str or pathlib.Path) : Absolute path to the restructured copy of the source file
+        - stat (os.stat_result) : Result of stat on the source file
+        - sha256 (str) : Hexadecimal digest of the source file contents
+        - placement (str) : How the copy was placed at destination, see `analytic_tools.utilities.place_file`
+
+    Returns:
+        - (Dict) : the record, as stored in the manifest
+    """
+    return {
+        "destination": str(destination),
+        "placement": placement,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+    }
+
+
+def is_placed(record: Dict | None, destination: str | Path, placement: str = "copy") -> bool:
+    """Check that the restructured copy of a source file is still at destination, placed as requested:
+        the manifest record must have the same destination and placement, and the copy must exist and be
+        a symbolic link for the symlink placement, a regular file for the others.
+
+    Parameters:
+        - record (Dict or None) : Manifest record of the source file, None if the file is new
+        - destination (str or pathlib.Path) : Absolute path to the restructured copy of the source file
+        - placement (str) : Placement mode requested for the copy
+
+    Returns:
+        - (bool) : Truth value of whether the copy does not need to be placed again
+    """
+    if record is None or record["destination"] != str(destination) or record["placement"] != placement:
+        return False
+    if os.path.islink(destination):
+        return placement == "symlink" and os.path.exists(destination)
+    return placement != "symlink" and os.path.isfile(destination)
+
+
+def is_unchanged(
+    record: Dict | None,
+    destination: str | Path,
+    stat: os.stat_result,
+    placement: str = "copy",
+) -> bool:
+    """Check, without reading the file, that a source file still matches its manifest record.
+        The size and modification time must be the same and the restructured copy must still be in place, see is_placed.
+
+    Parameters:
+        - record (Dict or None) : Manifest record of the source file, None if the file is new
+        - destination (str or pathlib.Path) : Absolute path to the restructured copy of the source file
+        - stat (os.stat_result) : Result of stat on the source file
+        - placement (str) : Placement mode requested for the copy
+
+    Returns:
+        - (bool) : Truth value of whether the source file can be skipped
+    """
+    return (
+        is_placed(record, destination, placement)
+        and record["size"] == stat.st_size
+        and record["mtime_ns"] == stat.st_mtime_ns
+    )
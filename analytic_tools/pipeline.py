@@ -0,0 +1,114 @@
+"""Module containing the streaming restructuring pipeline: parse/validate -> write, over the (source, destination)
+jobs planned by restructure_pollution_data from classify_csv_files.
+Each source file is read exactly once, and only one file per worker is held in memory at a time.
+"""
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+from analytic_tools.atomic import AtomicWriter, write_bytes_atomic
+from analytic_tools.dataset import parse_emissions
+from analytic_tools.utilities import place_file, validate_placement, validate_workers
+
+
+def process_file(
+    job: Tuple[Path, Path],
+    placement: str = "copy",
+    writer: AtomicWriter | None = None,
+    placed: Dict[Path, str] | None = None,
+) -> Dict:
+    """Third and fourth stages for a single file: read the source once, hash, parse and validate its contents
+        with the reader of its format (see `analytic_tools.dataset.READERS`), and write the renamed copy only if
+        the contents are valid. Errors are reported instead of raised.
+
+    Parameters:
+        - job (Tuple[Path, Path]) : absolute paths to the source file and to its destination
+        - placement (str) : How the valid file is placed at its destination, see `place_file`. With copy,
+                            the contents already read are written out instead of reading the source again.
+        - writer (AtomicWriter or None) : writer committing the destination, see `place_file`
+        - placed (Dict[Path, str] or None) : sha256 of the contents already placed at the destination, by source file.
+                            The source is not written again if its contents have this sha256.
+
+    Returns:
+        - result (Dict) : a dictionary with following keys: source, destination, bytes (number of bytes written),
+                          error (None or error message), data (the parsed (year, value) array, None on error),
+                          sha256 (hex digest of the contents read, None on error) and unchanged (True if the
+                          destination already held these contents and was not written)
+    """
+    src, dst = job
+    result = {"source": src, "destination": dst, "bytes": 0, "error": None, "data": None, "sha256": None,
+              "unchanged": False}
+    try:
+        with open(src, "rb") as f:
+            raw = f.read()
+        sha256 = hashlib.sha256(raw).hexdigest()
+        data = parse_emissions(raw, str(src))
+        if placed is not None and placed.get(src) == sha256:
+            # Same contents, only the modification time changed
+            result["unchanged"] = True
+            written = 0
+        elif placement == "copy":
+            written = write_bytes_atomic(dst, raw, writer)
+        else:
+            written = place_file(src, dst, placement, writer)
+    except (OSError, ValueError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    result["bytes"] = written
+    result["data"] = data
+    result["sha256"] = sha256
+    return result
+
+
+def bounded_map(function: Callable, items: Iterable, workers: int = 1) -> Iterator:
+    """Lazily apply function to every item with a pool of threads, yielding the results in the order of items.
+        At most 2 * workers items are in flight at any time, so the memory used does not grow with the number of items.
+
+    Parameters:
+        - function (Callable) : function to apply
+        - items (Iterable) : items to apply the function to, consumed lazily
+        - workers (int) : Number of threads, default to one (apply in the calling thread)
+
+    Yields:
+        - the result of function for each item
+    """
+    validate_workers(workers)
+    if workers == 1:
+        yield from map(function, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(executor.submit(function, item))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def stream_restructure(
+    jobs: Iterable[Tuple[Path, Path]],
+    workers: int = 1,
+    placement: str = "copy",
+    writer: AtomicWriter | None = None,
+    placed: Dict[Path, str] | None = None,
+) -> Iterator[Dict]:
+    """Run the parse/validate and write stages over a stream of (source, destination) jobs.
+
+    Parameters:
+        - jobs (Iterable[Tuple[Path, Path]]) : pairs of absolute paths (source file, destination file), consumed lazily
+        - workers (int) : Number of threads processing files at the same time, default to one
+        - placement (str) : How the valid files are placed at their destination, see `process_file`
+        - writer (AtomicWriter or None) : writer shared by the writes, see `process_file`
+        - placed (Dict[Path, str] or None) : contents already placed, see `process_file`
+
+    Yields:
+        - result (Dict) : the result of process_file for each job, in the order of jobs
+    """
+    validate_placement(placement)
+    yield from bounded_map(partial(process_file, placement=placement, writer=writer, placed=placed), jobs, workers=workers)
+
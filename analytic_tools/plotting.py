@@ -1,12 +1,149 @@
 """Module containing the functions used to plot the resulting data.
 """
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
+from typing import Iterable, List, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
+# The figures are drawn on their own Agg canvas, without pyplot, so the backend selected by the user is left alone
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
+from analytic_tools.atomic import AtomicWriter, remove_temp_files
+from analytic_tools.dataset import (
+    EmissionsData,
+    gas_from_dir,
+    load_emissions,
+    load_gas_dir,
+    select_gas,
+)
+from analytic_tools.figures import (
+    DEFAULT_DPI,
+    DEFAULT_FIGSIZE,
+    PREVIEW_DPI,
+    figure_name,
+    gas_dir_of_figure,
+    is_up_to_date,
+    load_figure_options,
+    render_options,
+    save_figure_options,
+)
+from analytic_tools.gases import GasRegistry, get_registry
+from analytic_tools.instrumentation import Metrics, optional_stage
+from analytic_tools.utilities import validate_workers
 
-def create_plot(src_dir: str | Path, dest_dir: str | Path) -> None:
+# File formats the plots can be saved as
+FIGURE_FORMATS = ("png", "svg", "pdf")
+# zlib compression level (0-9, 6 being the default of Pillow) of the preview plots
+PREVIEW_PNG_COMPRESSION = 1
+# Mathtext markup removed from the labels of the preview plots, e.g. $\mathrm{CO_2}$ becomes CO2
+_MATHTEXT_MARKUP = re.compile(r"\$|\\[A-Za-z]+|[{}_^]")
+
+
+def _plain_text(text: str) -> str:
+    """Remove the mathtext markup of text, which is then drawn as plain text without parsing it."""
+    return _MATHTEXT_MARKUP.sub("", text) if "$" in text else text
+
+
+def _check_figure_options(fmt: str, figsize: Tuple[float, float], dpi: int | None) -> None:
+    """Raise ValueError if the format, size or resolution of the plots is invalid."""
+    if fmt not in FIGURE_FORMATS:
+        raise ValueError(f"Expected fmt to be one of {FIGURE_FORMATS}, but received {fmt}")
+    if len(figsize) != 2 or not all(size > 0 for size in figsize):
+        raise ValueError(f"Expected figsize to be a positive (width, height) in inches, but received {figsize}")
+    if dpi is not None and (isinstance(dpi, bool) or not isinstance(dpi, int) or dpi < 1):
+        raise ValueError(f"Expected dpi to be a positive integer, but received {dpi}")
+
+
+def draw_gas_plot(
+    data: EmissionsData,
+    gas: str,
+    dest_dir: str | Path,
+    fmt: str = "png",
+    registry: GasRegistry | None = None,
+    figsize: Tuple[float, float] = DEFAULT_FIGSIZE,
+    dpi: int | None = None,
+    preview: bool = False,
+) -> Path:
+    """Display the emissions of one gas from every source in data in one plot.
+        Store the plot at dest_dir, named as gas_[formula].[fmt], or gas_[formula].preview.[fmt] for a preview.
+        The plot is drawn on its own Figure with the Agg canvas, without the global pyplot state,
+        so that several plots can be created at the same time in different processes.
+        A preview plot is cheaper to render: the labels are drawn as plain text instead of mathtext,
+        and a .png preview is saved at PREVIEW_DPI with the fast PREVIEW_PNG_COMPRESSION level.
+
+    Parameters:
+        - data (EmissionsData) : the dataset containing the gas
+        - gas (str) : formula of the gas to plot
+        - dest_dir (str or pathlib.Path) : Absolute path to the directory to save the plot in
+        - fmt (str) : File format of the plot, one of FIGURE_FORMATS
+        - registry (GasRegistry or None) : registry holding the label and unit of the gas, the one in use if None
+        - figsize (Tuple[float, float]) : Width and height of the plot in inches, default to DEFAULT_FIGSIZE
+        - dpi (int or None) : Resolution of the plot in dots per inch, DEFAULT_DPI (PREVIEW_DPI for a preview) if None
+        - preview (bool) : If True, draw a cheaper preview plot
+
+    Returns:
+        - figpath (pathlib.Path) : Absolute path to the saved plot
+    """
+    dest_dir = Path(dest_dir)
+    if registry is None:
+        registry = get_registry()
+    _check_figure_options(fmt, figsize, dpi)
+    if dpi is None:
+        dpi = PREVIEW_DPI if preview else DEFAULT_DPI
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    # Create labels with correct syntax, or plain ones for a preview
+    gas_name = _plain_text(registry.label(gas)) if preview else registry.label(gas)
+    ax.set_title(
+        r"Air pollution of "
+        + gas_name
+        + r" from five different sources as function of year"
+    )
+    gas_values = data.values[:, :, data.gases.index(gas)] if gas in data.gases else np.empty((0, 0))
+    for i, source in enumerate(data.sources):
+        # Create a label for the plot from the source name, src_[source]
+        label = " ".join(source.split("_")[1:])
+        # Plotting, skipping the years without data for this source
+        has_data = ~np.isnan(gas_values[:, i])
+        if has_data.any():
+            ax.plot(data.years[has_data], gas_values[has_data, i], label=label)
+
+    ax.legend()
+    ax.set_xlabel("Year")
+    ax.set_ylabel(_plain_text(registry.unit(gas)) if preview else registry.unit(gas))
+    # Create a name for the plot to store in dest_dir, the previews do not replace the full plots
+    figpath = dest_dir / figure_name(f"gas_{gas}", fmt, preview)
+    # Pillow compresses the .png files, a lower level trades a larger file for a faster save
+    save_kwargs = {"pil_kwargs": {"compress_level": PREVIEW_PNG_COMPRESSION}} if preview and fmt == "png" else {}
+    # Save under a temporary name and rename, so that a reader never sees a partially written figure
+    AtomicWriter().write(figpath, lambda tmp: fig.savefig(tmp, dpi=dpi, format=fmt, **save_kwargs))
+    return figpath
+
+
+def _draw_gas_plot_timed(
+    data: EmissionsData,
+    gas: str,
+    dest_dir: Path,
+    fmt: str,
+    registry: GasRegistry,
+    figsize: Tuple[float, float],
+    dpi: int | None,
+    preview: bool,
+) -> Tuple[Path, float]:
+    """Call draw_gas_plot and measure how long the plot took to render and save, in seconds."""
+    start = time.perf_counter()
+    figpath = draw_gas_plot(data, gas, dest_dir, fmt, registry, figsize, dpi, preview)
+    return figpath, time.perf_counter() - start
+
+
+def create_plot(src_dir: str | Path, dest_dir: str | Path) -> Path:
     """Read all the .csv files within src_dir and display the data in one plot.
         Store the plot at dest_dir, named as gas_[formula].png.
         This function assumes that src_dir contains original gas .csv files only and no other files and subdirectories
@@ -15,6 +152,8 @@ def create_plot(src_dir: str | Path, dest_dir: str | Path) -> None:
         - src_dir (str or pathlib.Path) : Absolute path to gas_[gas_formula] directory containing .csv files with data
         - dest_dir (str or pathlib.Path) : Absolute path to the directory to save the plot in
 
+    Returns:
+        - figpath (pathlib.Path) : Absolute path to the saved plot
     """
     src_dir = Path(src_dir)
     dest_dir = Path(dest_dir)
@@ -28,60 +167,45 @@ def create_plot(src_dir: str | Path, dest_dir: str | Path) -> None:
             f"Expected an existing directory for dest_dir, but received {dest_dir}"
         )
 
-    plt.figure(1, figsize=(10, 8))
-
-    # Create labels with correct syntax
-    name_dict = {
-        "CH4": r"$\mathrm{CH_4}$",
-        "CO2": r"$\mathrm{CO_2}$",
-        "N2O": r"$\mathrm{N_2O}$",
-    }
-    label = str(src_dir)[-3:]
-    gas_name = name_dict.get(label, label)
-    plt.title(
-        r"Air pollution of "
-        + gas_name
-        + r" from five different sources as function of year"
-    )
-    for file in src_dir.iterdir():
-        if not file.is_file():
-            # Invalid argument, cannot read it as a file
-            raise FileNotFoundError(f"Object pointed to by {file} is not a file")
-        elif not file.suffix == ".csv":
-            # Invalid file type, must be .csv
-            raise TypeError(f"Object pointed to by {file} is not a .csv file")
-        # Create a label for the plot
-        label_parts = str(file.name).split("_")
-        label = ""
-        for i in range(1, len(label_parts) - 1):
-            label += label_parts[i] + " "
-        # Plotting
-        data = np.loadtxt(file, delimiter=",", skiprows=1)
-        plt.plot(data[:, 0], data[:, 1], label=label)
-
-    plt.legend()
-    plt.xlabel("Year")
-    plt.ylabel(r"1000 tonn $\mathrm{CO_2}$-equivalents AR5")
-    # Create a name for the plot to store in dest_dir
-    figname = src_dir.name + ".png"
-    figpath = dest_dir / figname
-    plt.savefig(figpath, dpi=200)
-    plt.close()
-
-
-def plot_pollution_data(by_gas_dir: str | Path, fig_dir: str | Path) -> None:
+    return draw_gas_plot(load_gas_dir(src_dir), gas_from_dir(src_dir), dest_dir)
+
+
+def plot_pollution_data(
+    by_gas_dir: str | Path,
+    fig_dir: str | Path,
+    gases: Iterable[str] | None = None,
+    workers: int = 1,
+    cache_dir: str | Path | None = None,
+    metrics: Metrics | None = None,
+    fmt: str = "png",
+    figsize: Tuple[float, float] = DEFAULT_FIGSIZE,
+    dpi: int | None = None,
+    preview: bool = False,
+) -> List[Path]:
     """This function traverses the subdirectories of directory pointed to by by_gas_dir, which should be pollution_data_restructured/by_gas,
       and creates plots for each of them.
       It assumes that pollution_data_restructured/by_gas has only subdirectories of type gas_[gas_formula] as its contents,
       and that each of these subdirectories contains only original gas .csv files filtered by gas type.
-      Each plot is saved as .png file in fig_dir directory.
+      Each plot is saved as .png file (or in the format fmt) in fig_dir directory, next to the previews drawn with preview.
+      The options each plot was drawn with are recorded next to fig_dir (see `analytic_tools.figures`).
 
     Parameters:
         - by_gas_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/by_gas directory containing gas_[gas_formula] subdirectories
         - fig_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/figures directory where the plots are to be stored
+        - gases (Iterable[str] or None) : Names of the gas_[gas_formula] subdirectories whose contents changed.
+                                          If provided, only these plots, the missing ones and the ones drawn with other
+                                          options are redrawn, and the plots of subdirectories that no longer exist
+                                          are removed. If None, every plot is redrawn.
+        - workers (int) : Number of processes drawing plots at the same time, default to one (draw in the calling process)
+        - cache_dir (str or pathlib.Path or None) : Absolute path to the directory holding the binary cache of the data,
+                                          see `load_emissions`. If None, the .csv files are always parsed.
+        - metrics (Metrics or None) : If provided, records the time spent loading the data, the render time
+                                          ("render seconds") and the file size ("figure bytes") of each plot
+        - fmt (str) : File format of the plots, one of FIGURE_FORMATS, default to png
+        - figsize, dpi, preview : Size, resolution and preview mode of the plots, see `draw_gas_plot`.
 
     Returns:
-    None
+        - figpaths (List[pathlib.Path]) : Absolute paths to the plots drawn, ordered by gas_[gas_formula] subdirectory name
     """
     by_gas_dir = Path(by_gas_dir)
     fig_dir = Path(fig_dir)
@@ -91,11 +215,68 @@ def plot_pollution_data(by_gas_dir: str | Path, fig_dir: str | Path) -> None:
     elif not fig_dir.exists():
         raise NotADirectoryError(f"Object pointed to by {fig_dir} does not exist")
 
-    for gas_subdir in by_gas_dir.iterdir():
+    validate_workers(workers)
+    _check_figure_options(fmt, figsize, dpi)
+
+    # Remove the temporary files left by an interrupted run
+    remove_temp_files(fig_dir)
+
+    recorded = load_figure_options(fig_dir)
+    options = render_options(figsize, dpi, preview)
+    removed = False
+    if gases is not None:
+        gases = set(gases)
+        # Remove the plots (and previews) of gasses that are no longer present
+        for figpath in fig_dir.glob(f"gas_*.{fmt}"):
+            if not (by_gas_dir / gas_dir_of_figure(figpath.name)).is_dir():
+                figpath.unlink()
+                recorded.pop(figpath.name, None)
+                removed = True
+
+    to_plot = []
+    for gas_subdir in sorted(by_gas_dir.iterdir()):
         if not gas_subdir.is_dir():
             # Invalid structure of by_gas_dir
             raise NotADirectoryError(
                 f"Object pointed to by {gas_subdir} is not a directory"
             )
+        elif gases is not None and gas_subdir.name not in gases and is_up_to_date(
+                fig_dir, figure_name(gas_subdir.name, fmt, preview), options, recorded):
+            # Unchanged data and options, the existing plot is up to date
+            continue
         else:
-            create_plot(gas_subdir, fig_dir)
+            to_plot.append(gas_subdir)
+
+    if not to_plot:
+        if removed:
+            save_figure_options(fig_dir, recorded)
+        return []
+
+    # The registry in use in this process is passed on to the processes drawing the plots
+    registry = get_registry()
+
+    # Parse all the data once, each plot then only reads its slice of the dataset
+    with optional_stage(metrics, "load emissions"):
+        data = load_emissions(by_gas_dir, gases=[gas_subdir.name for gas_subdir in to_plot], cache_dir=cache_dir)
+        gas_names = [gas_from_dir(gas_subdir) for gas_subdir in to_plot]
+        gas_data = [select_gas(data, gas) for gas in gas_names]
+
+    if workers == 1 or len(to_plot) <= 1:
+        drawn = [_draw_gas_plot_timed(d, gas, fig_dir, fmt, registry, figsize, dpi, preview)
+                 for d, gas in zip(gas_data, gas_names)]
+    else:
+        # Rendering is CPU bound, each plot is drawn in its own process; map keeps the results in to_plot order
+        with ProcessPoolExecutor(max_workers=min(workers, len(to_plot))) as executor:
+            drawn = list(executor.map(
+                _draw_gas_plot_timed, gas_data, gas_names, repeat(fig_dir), repeat(fmt), repeat(registry),
+                repeat(figsize), repeat(dpi), repeat(preview)))
+
+    recorded.update((figpath.name, options) for figpath, _ in drawn)
+    save_figure_options(fig_dir, recorded)
+
+    if metrics is not None:
+        for figpath, seconds in drawn:
+            metrics.sample("render seconds", figpath.stem, seconds)
+            metrics.sample("figure bytes", figpath.stem, figpath.stat().st_size)
+        metrics.count("figures drawn", len(drawn))
+    return [figpath for figpath, _ in drawn]
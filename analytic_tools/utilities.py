@@ -1,24 +1,102 @@
 """Module containing functions used to achieve the desired restructuring of the pollution_data directory
 """
 # Include the necessary packages here
+import errno
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice, repeat
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
 
+from analytic_tools.atomic import AtomicWriter
+from analytic_tools.dedup import duplicate_report, find_duplicates
+from analytic_tools.formats import FormatRules, get_formats
+from analytic_tools.gases import get_registry
 
-def get_diagnostics(dir: str | Path) -> Dict[str, int]:
-    """Get diagnostics for the directory tree, with root directory pointed to by dir.
-       Counts up all the files, subdirectories, and specifically .csv, .txt, .npy, .md and other files in the whole directory tree.
+# In-memory index of a directory tree produced by scan_directory:
+# maps every directory in the tree to the os.DirEntry objects it contains, in scandir order
+DirectoryIndex = Dict[Path, List[os.DirEntry]]
+
+# Largest number of created destination directories remembered by classify_csv_files
+DEST_DIR_CACHE_SIZE = 4096
+
+
+def scan_directory(dir: str | Path) -> DirectoryIndex:
+    """Walk the directory tree with root directory pointed to by dir exactly once, using os.scandir.
+       The returned index keeps the os.DirEntry objects, so the file type information (and the stat data,
+       once requested) cached by scandir can be reused by every consumer of the index without new syscalls.
+       Like Path.rglob, symbolic links to directories are listed but not descended into, and the subdirectories
+       which cannot be read (e.g. without permission) are listed but left out of the index.
 
     Parameters:
-        dir (str or pathlib.Path) : Absolute path to the directory of interest
+        dir (str or pathlib.Path) : Absolute path to the root directory of the tree
 
     Returns:
-        res (Dict[str, int]) : a dictionary of the findings with following keys: files, subdirectories, .csv files, .txt files, .npy files, .md files, other files.
+        index (DirectoryIndex) : a dictionary mapping the root and each of its subdirectories to the list
+                                 of os.DirEntry objects found in it
 
     """
 
-    # Dictionary to return
-    res = {
+    # Check if directory is of type str or Path, otherwise raise TypeError
+    if not isinstance(dir, (str, Path)):
+        raise TypeError(f"The provided path must be a str or Path object")
+    path = Path(dir)
+
+    if not path.exists():
+        raise NotADirectoryError("The provided path must exist")
+    if not path.is_dir():
+        raise NotADirectoryError("The provided path must be a directory")
+
+    index = {}
+    # Iterative depth-first walk, a stack avoids hitting the recursion limit on deep trees
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError:
+            # Skip the unreadable subdirectories, as os.walk does, but not an unreadable root
+            if current == path:
+                raise
+            continue
+        index[current] = entries
+        # Push subdirectories in reverse so that they are visited in scandir order
+        for entry in reversed(entries):
+            if entry.is_dir() and not entry.is_symlink():
+                stack.append(current / entry.name)
+
+    return index
+
+
+def iter_index_files(index: DirectoryIndex, suffix: str | None = None) -> Iterator[os.DirEntry]:
+    """Iterate over the files recorded in an index produced by scan_directory.
+
+    Parameters:
+        index (DirectoryIndex) : index of the directory tree
+        suffix (str or None) : only yield files whose name ends with this suffix (e.g. '.csv'), all files if None
+
+    Yields:
+        (os.DirEntry) : the directory entry of each matching file
+    """
+    for entries in index.values():
+        for entry in entries:
+            if suffix is not None and not entry.name.endswith(suffix):
+                continue
+            if entry.is_file():
+                yield entry
+
+
+# Key of get_diagnostics counting the files of each suffix, the other suffixes are counted as "other files"
+_SUFFIX_KEYS = {".csv": ".csv files", ".txt": ".txt files", ".npy": ".npy files", ".md": ".md files"}
+
+
+def _empty_diagnostics() -> Dict[str, int]:
+    """Dictionary of get_diagnostics with every count at zero."""
+    return {
         "files": 0,
         "subdirectories": 0,
         ".csv files": 0,
@@ -28,6 +106,22 @@ def get_diagnostics(dir: str | Path) -> Dict[str, int]:
         "other files": 0,
     }
 
+
+def _count_entry(entry: os.DirEntry, res: Dict[str, int], bytes_per_extension: Dict[str, int] | None) -> None:
+    """Add the directory entry to the counts res and, if bytes_per_extension is provided, add its size there."""
+    if entry.is_dir():
+        res["subdirectories"] += 1
+    elif entry.is_file():              # elif and not simply else, as there could be other types of content in the directory (i.e. symbolic links, mount points, and sockets)
+        res["files"] += 1
+        suffix = os.path.splitext(entry.name)[1]
+        res[_SUFFIX_KEYS.get(suffix, "other files")] += 1
+        if bytes_per_extension is not None:
+            # The stat result is cached by the entry, later users of the same entry do not stat the file again
+            bytes_per_extension[suffix] = bytes_per_extension.get(suffix, 0) + entry.stat().st_size
+
+
+def _check_diagnostics_dir(dir: str | Path) -> Path:
+    """Check that dir is an existing directory and return it as a Path object."""
     # Check if directory is of type str or Path, otherwise raise TypeError
     if not isinstance(dir, (str, Path)):
         raise TypeError(f"The provided path must be a str or Path object")
@@ -44,30 +138,155 @@ def get_diagnostics(dir: str | Path) -> Dict[str, int]:
     # Check if the given path is a directory otherwaise raise NotADirectoryError
     if not path.is_dir():
         raise NotADirectoryError("The provided path must be a directory")
+    return path
 
-    # Traverse the directory and find its contents
-    contents = path.rglob('*')
-
-    # Iterate over all Path objects present in the given directory and increment the appropriate dictionary counter
-    for item in contents:
-        if item.is_dir():
-            res["subdirectories"] += 1
-        elif item.is_file():              # elif and not simply else, as there could be other types of content in the directory (i.e. symbolic links, mount points, and sockets)
-            res["files"] += 1
-            if item.suffix == '.csv':
-                res[".csv files"] += 1
-            elif item.suffix == '.txt':
-                res[".txt files"] += 1
-            elif item.suffix == '.npy':
-                res[".npy files"] += 1
-            elif item.suffix == '.md':
-                res[".md files"] += 1
-            else:
-                res["other files"] += 1
+
+def _diagnose_shard(root: str, with_sizes: bool) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Walk the tree below root with os.scandir and return its counts and its bytes per extension (empty unless with_sizes).
+        Runs in a worker thread or process, so it only takes and returns picklable values.
+    """
+    res = _empty_diagnostics()
+    bytes_per_extension = {} if with_sizes else None
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                _count_entry(entry, res, bytes_per_extension)
+                if entry.is_dir() and not entry.is_symlink():
+                    stack.append(entry.path)
+    return res, bytes_per_extension or {}
+
+
+def _diagnose_sharded(path: Path, workers: int, processes: bool, with_sizes: bool) -> Dict:
+    """Diagnose the tree below path, walking each src_* directory as a separate shard in a pool of workers.
+        Returns the dictionary of get_detailed_diagnostics.
+    """
+    res = _empty_diagnostics()
+    bytes_per_extension = {} if with_sizes else None
+
+    # Walk everything outside the src_* directories in the calling thread, collecting the shards
+    shards = []
+    stack = [str(path)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                _count_entry(entry, res, bytes_per_extension)
+                if entry.is_dir() and not entry.is_symlink():
+                    (shards if entry.name.startswith("src_") else stack).append(entry.path)
+
+    if workers == 1 or len(shards) <= 1:
+        partials = [_diagnose_shard(shard, with_sizes) for shard in shards]
+    else:
+        # Threads overlap the scandir and stat syscalls, processes also spread the counting over several cores
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with pool(max_workers=min(workers, len(shards))) as executor:
+            partials = list(executor.map(_diagnose_shard, shards, repeat(with_sizes)))
+
+    # Merge the counts of the shards
+    bytes_per_source = {}
+    bytes_per_extension = bytes_per_extension or {}
+    for shard, (shard_res, shard_bytes) in zip(shards, partials):
+        for key, count in shard_res.items():
+            res[key] += count
+        for suffix, size in shard_bytes.items():
+            bytes_per_extension[suffix] = bytes_per_extension.get(suffix, 0) + size
+        if with_sizes:
+            source = os.path.basename(shard)
+            bytes_per_source[source] = bytes_per_source.get(source, 0) + sum(shard_bytes.values())
+
+    return {"counts": res, "bytes per extension": bytes_per_extension, "bytes per source": bytes_per_source}
+
+
+def get_diagnostics(
+    dir: str | Path,
+    index: DirectoryIndex | None = None,
+    workers: int = 1,
+    duplicates: bool = False,
+) -> Dict[str, int]:
+    """Get diagnostics for the directory tree, with root directory pointed to by dir.
+       Counts up all the files, subdirectories, and specifically .csv, .txt, .npy, .md and other files in the whole directory tree.
+
+    Parameters:
+        dir (str or pathlib.Path) : Absolute path to the directory of interest
+        index (DirectoryIndex or None) : index of the tree from scan_directory, the tree is scanned if not provided
+        workers (int) : Number of threads walking the src_* directories of the tree at the same time when no index is
+                        provided, default to one (scan the tree once in the calling thread)
+        duplicates (bool) : If True, the byte-identical files are found as well, see `analytic_tools.dedup`
+
+    Returns:
+        res (Dict[str, int]) : a dictionary of the findings with following keys: files, subdirectories, .csv files, .txt files, .npy files, .md files, other files,
+                               and, if duplicates is True, duplicate groups, duplicate files and wasted bytes.
+
+    """
+    path = _check_diagnostics_dir(dir)
+    validate_workers(workers)
+
+    if index is None and workers > 1 and not duplicates:
+        return _diagnose_sharded(path, workers, processes=False, with_sizes=False)["counts"]
+
+    # Dictionary to return
+    res = _empty_diagnostics()
+
+    # Traverse the directory once and find its contents
+    if index is None:
+        index = scan_directory(path)
+
+    # Iterate over all entries present in the given directory tree and increment the appropriate dictionary counter
+    for entries in index.values():
+        for item in entries:
+            _count_entry(item, res, None)
+
+    # Group the identical files, reading only the files which share their size with another one
+    if duplicates:
+        res.update(duplicate_report(find_duplicates(iter_index_files(index), workers=workers)))
 
     return res
 
 
+def get_detailed_diagnostics(
+    dir: str | Path,
+    index: DirectoryIndex | None = None,
+    workers: int = 1,
+    processes: bool = False,
+) -> Dict:
+    """Get the diagnostics of get_diagnostics for the directory tree with root directory pointed to by dir,
+        together with the total size of the files per extension and per source, i.e. per src_* directory.
+        Without an index, the tree is split into one shard per src_* directory, walked by a pool of workers.
+        The sizes cost one stat per file, which scandir does not provide on POSIX systems; the result is cached
+        by the directory entries, so a shared index is not stat'ed again by the later stages.
+
+    Parameters:
+        dir (str or pathlib.Path) : Absolute path to the directory of interest
+        index (DirectoryIndex or None) : index of the tree from scan_directory, the tree is walked if not provided
+        workers (int) : Number of workers walking the src_* directories at the same time, default to one
+        processes (bool) : If True, the workers are processes instead of threads
+
+    Returns:
+        (Dict) : a dictionary with following keys: counts (the dictionary of get_diagnostics),
+                 bytes per extension (e.g. ".csv", "" for the files without extension) and
+                 bytes per source (the name of each src_* directory, the files outside them are not attributed)
+    """
+    path = _check_diagnostics_dir(dir)
+    validate_workers(workers)
+    if index is None:
+        return _diagnose_sharded(path, workers, processes, with_sizes=True)
+
+    res = _empty_diagnostics()
+    bytes_per_extension = {}
+    bytes_per_source = {}
+    for directory, entries in index.items():
+        # The outermost src_* directory containing this directory, if any
+        parts = directory.relative_to(path).parts
+        source = next((part for part in parts if part.startswith("src_")), None)
+        before = sum(bytes_per_extension.values())
+        for entry in entries:
+            _count_entry(entry, res, bytes_per_extension)
+        if source is not None:
+            bytes_per_source[source] = bytes_per_source.get(source, 0) + sum(bytes_per_extension.values()) - before
+
+    return {"counts": res, "bytes per extension": bytes_per_extension, "bytes per source": bytes_per_source}
+
+
 def display_diagnostics(dir: str | Path, contents: Dict[str, int]) -> None:
     """Display diagnostics for the directory tree, with root directory pointed to by dir.
         Objects to display: files, subdirectories, .csv files, .txt files, .npy files, .md files, other files.
@@ -126,23 +345,14 @@ def display_diagnostics(dir: str | Path, contents: Dict[str, int]) -> None:
     print(f"Number of .npy files: {contents['.npy files']}")
     print(f"Number of .md files: {contents['.md files']}")
     print(f"Number of other files: {contents['other files']}")
+    if "wasted bytes" in contents:
+        print(f"Number of duplicate files: {contents['duplicate files']} "
+              f"in {contents['duplicate groups']} groups, wasting {contents['wasted bytes']} bytes")
     print("----------------------------------------------")
 
 
-def display_directory_tree(dir: str | Path, maxfiles: int = 3) -> None:
-    """Display a directory tree, with root directory pointed to by dir.
-       Limit the number of files to be displayed for convenience to maxfiles.
-       This tree is built with inspiration from the code written by "Flimm" at https://stackoverflow.com/questions/6639394/what-is-the-python-way-to-walk-a-directory-tree
-
-    Parameters:
-        dir (str or pathlib.Path) : Absolute path to the directory of interest
-        maxfiles (int) : Maximum number of files to be displayed at each level in the tree, default to three.
-
-    Returns:
-        None
-
-    """
-
+def _check_tree_arguments(dir: str | Path, maxfiles: int, max_depth: int | None) -> Path:
+    """Validate the arguments of build_directory_tree and return dir as a Path object."""
     # Validate the path
     if not isinstance(dir, (str, Path)):
         raise TypeError(f"The provided path must be a str or Path object")
@@ -163,34 +373,122 @@ def display_directory_tree(dir: str | Path, maxfiles: int = 3) -> None:
     if maxfiles < 1:
         raise ValueError("Maxfiles must be greater or equal to 1")
 
-    # Declere recursive function to traverse the directory
-    def recursive_display(current_path: [str | Path], indent: str = "") -> None:
-        """Takes as input the current directory and how much indentation is required to display.
-            Returns nothing.
-        """
-        # If the current path is a file, display it
-        if current_path.is_file():
-            print(f"{indent}- {current_path.name}")
-        # If the current path is a directory, diaplay its name and files up to maxfiles
-        elif current_path.is_dir():
-            print(f"{indent}{current_path.stem}/")
-            files = list(current_path.iterdir())
-            displayed_files = min(maxfiles, len(files))
-            for i in range(displayed_files):
-                recursive_display(files[i], indent + "    ")
-            if len(files) > maxfiles:
-                print(f"{indent}    ...")
-
-    # Display the root directory and start the recursive tree traversal
-    print(f"{path.stem}/")
-    for item in path.iterdir():
-        recursive_display(item, "    ")
+    # Validate max_depth
+    if max_depth is not None and not isinstance(max_depth, int):
+        raise TypeError("Max_depth must be an integer or None")
+    if max_depth is not None and max_depth < 0:
+        raise ValueError("Max_depth must be greater or equal to 0")
+    return path
+
+
+def build_directory_tree(
+    dir: str | Path,
+    maxfiles: int = 3,
+    max_depth: int | None = None,
+    index: DirectoryIndex | None = None,
+) -> Dict:
+    """Build the directory tree with root directory pointed to by dir, keeping at most maxfiles entries per directory.
+        Without an index, each directory is read lazily with os.scandir and at most maxfiles + 1 of its entries
+        are read, so the cost does not depend on the size of the directories.
+
+    Parameters:
+        dir (str or pathlib.Path) : Absolute path to the directory of interest
+        maxfiles (int) : Maximum number of entries kept in each directory of the tree, default to three.
+        max_depth (int or None) : Maximum depth of the directories whose entries are kept, the root being at depth 0.
+                                  None for no limit.
+        index (DirectoryIndex or None) : index of the tree from scan_directory, the directories are read if not provided
+
+    Returns:
+        tree (Dict) : the root directory as a dictionary with following keys: name, type ("directory"), children
+                      (the kept entries, files as dictionaries with keys name and type "file" and directories in the
+                      same form as the root) and truncated (True if entries of the directory were left out).
+                      The tree only holds strings, lists and booleans, so it can be serialized with json.dumps.
+    """
+    path = _check_tree_arguments(dir, maxfiles, max_depth)
+
+    def list_entries(directory: Path, limit: int) -> List[os.DirEntry]:
+        """Return the first limit entries of directory, without reading the others."""
+        if index is not None:
+            return index.get(directory, [])[:limit]
+        with os.scandir(directory) as it:
+            return list(islice(it, limit))
+
+    def build(directory: Path, depth: int) -> Dict:
+        """Build the node of directory, at depth in the tree."""
+        node = {"name": directory.name, "type": "directory", "children": [], "truncated": False}
+        if max_depth is not None and depth >= max_depth:
+            # Only check whether there is anything left out
+            node["truncated"] = bool(list_entries(directory, 1))
+            return node
+
+        entries = list_entries(directory, maxfiles + 1)
+        node["truncated"] = len(entries) > maxfiles
+        for entry in entries[:maxfiles]:
+            if entry.is_file():
+                node["children"].append({"name": entry.name, "type": "file"})
+            elif entry.is_dir():
+                node["children"].append(build(directory / entry.name, depth + 1))
+        return node
+
+    return build(path, 0)
+
+
+def format_directory_tree(tree: Dict) -> str:
+    """Render the tree returned by build_directory_tree as text: directories as "name/", files as "- name",
+        one level of indentation per level of the tree, and "..." where entries were left out.
+
+    Parameters:
+        tree (Dict) : the tree returned by build_directory_tree
+
+    Returns:
+        (str) : the rendered tree, one line per entry
+    """
+    lines = [f"{Path(tree['name']).stem}/"]
+
+    def render(node: Dict, indent: str) -> None:
+        """Add the lines of the children of node, indented by indent."""
+        for child in node["children"]:
+            if child["type"] == "file":
+                lines.append(f"{indent}- {child['name']}")
+            else:
+                lines.append(f"{indent}{Path(child['name']).stem}/")
+                render(child, indent + "    ")
+        if node["truncated"]:
+            lines.append(f"{indent}...")
+
+    render(tree, "    ")
+    return "\n".join(lines) + "\n"
+
+
+def display_directory_tree(
+    dir: str | Path,
+    maxfiles: int = 3,
+    index: DirectoryIndex | None = None,
+    max_depth: int | None = None,
+) -> None:
+    """Display a directory tree, with root directory pointed to by dir.
+       Limit the number of files to be displayed for convenience to maxfiles.
+       This tree is built with inspiration from the code written by "Flimm" at https://stackoverflow.com/questions/6639394/what-is-the-python-way-to-walk-a-directory-tree
+       The tree is built with build_directory_tree and written in a single write.
+
+    Parameters:
+        dir (str or pathlib.Path) : Absolute path to the directory of interest
+        maxfiles (int) : Maximum number of files to be displayed at each level in the tree, default to three.
+        index (DirectoryIndex or None) : index of the tree from scan_directory, the directories are read lazily if not provided
+        max_depth (int or None) : Maximum depth of the directories whose contents are displayed, None for no limit
+
+    Returns:
+        None
+
+    """
+    tree = build_directory_tree(dir, maxfiles=maxfiles, max_depth=max_depth, index=index)
+    sys.stdout.write(format_directory_tree(tree))
 
 
 def is_gas_csv(path: str | Path) -> bool:
     """Checks if a csv file pointed to by path is an original gas statistics file.
         An original file must be called '[gas_formula].csv' where [gas_formula] is
-        in ['CO2', 'CH4', 'N2O', 'SF6', 'H2'].
+        registered in the gas registry, see analytic_tools.gases (by default 'CO2', 'CH4', 'N2O', 'SF6' and 'H2').
 
     Parameters:
          - path (str of pathlib.Path) : Absolute path to .csv file that will be checked
@@ -216,11 +514,8 @@ def is_gas_csv(path: str | Path) -> bool:
         raise ValueError(
             f"Expected path to a .cvs file, got something else instead")
 
-    # List of greenhouse gasses, correct filenames in front of a .csv ending
-    gasses = ["CO2", "CH4", "N2O", "SF6", "H2"]
-
     # Return if the file satisfies the [gas_formula].csv pattern
-    return True if path.stem in gasses else False
+    return path.stem in get_registry().formulas
 
 
 def get_dest_dir_from_csv_file(dest_parent: str | Path, file_path: str | Path) -> Path:
@@ -228,7 +523,7 @@ def get_dest_dir_from_csv_file(dest_parent: str | Path, file_path: str | Path) -
         Checks if a directory "gas_[gas_formula]", exists and if not, it creates one as a subdirectory under dest_parent.
 
         The file pointed to by file_path must be a valid file. A valid file must be called '[gas_formula].csv' where [gas_formula]
-        is in ['CO2', 'CH4', 'N2O', 'SF6', 'H2'].
+        is registered in the gas registry, see is_gas_csv.
 
     Parameters:
         - dest_parent (str or pathlib.Path) : Absolute path to parent directory where gas_[gas_formula] should/will exist
@@ -314,6 +609,338 @@ def merge_parent_and_basename(path: str | Path) -> str:
     return new_base
 
 
+class CsvClassification(NamedTuple):
+    """Classification of a batch of source files, as parallel lists in the order of the batch.
+
+    Attributes:
+        - sources (List[pathlib.Path]) : paths to the classified files
+        - gases (List[str or None]) : gas formula of each original gas file, None for the other files
+        - destinations (List[pathlib.Path or None]) : destination of each original gas file in the by_gas directory,
+                                                      gas_[gas_formula]/[parent]_[gas_formula][suffix], None for the
+                                                      other files
+        - new_names (List[str or None]) : new basename of each original gas file, see merge_parent_and_basename,
+                                          None for the other files
+    """
+
+    sources: List[Path]
+    gases: List[str | None]
+    destinations: List[Path | None]
+    new_names: List[str | None]
+
+
+@lru_cache(maxsize=DEST_DIR_CACHE_SIZE)
+def _make_dir_once(path: str, parent_state: Tuple[int, int, int]) -> None:
+    """Create the directory at path if it does not exist. The call is memoized on the (device, inode, mtime)
+        of the parent directory, so it is made again if the parent was recreated or its entries changed.
+    """
+    os.makedirs(path, exist_ok=True)
+
+
+def forget_created_dirs() -> None:
+    """Empty the cache of the destination directories created by classify_csv_files.
+        Must be called after removing one of them within the same modification time tick of its parent.
+    """
+    _make_dir_once.cache_clear()
+
+
+def classify_csv_files(
+    paths: Iterable[str | Path],
+    dest_dir: str | Path,
+    create_dirs: bool = False,
+    formats: FormatRules | None = None,
+) -> CsvClassification:
+    """Classify a batch of source files in one pass: find the original gas files and derive their gas_[gas_formula]
+        directory and new name in dest_dir, with the same rules as is_gas_csv, get_dest_dir_from_csv_file and
+        merge_parent_and_basename, but with plain string operations and without any per-file syscall.
+        Files of other formats are classified as not original instead of raising a ValueError.
+        With several formats, the [parent]_[gas_formula] pair of each original file is kept once: only the file of the
+        format of highest priority (then the first by name) gets a destination, the others are not original.
+
+    Parameters:
+        - paths (Iterable[str | Path]) : Absolute paths to the files to classify
+        - dest_dir (str or pathlib.Path) : Absolute path to the by_gas directory
+        - create_dirs (bool) : If True, the gas_[gas_formula] directories of the original files are created,
+                               each of them once; the directories already created are remembered between calls
+        - formats (FormatRules or None) : Classification rules of the formats, the ones in use if None (by default,
+                                          original [gas_formula].csv files only), see analytic_tools.formats
+
+    Returns:
+        - (CsvClassification) : the gas, destination and new name of each file
+    """
+    # Check if dest_dir is of type str or Path, otherwise raise TypeError
+    if not isinstance(dest_dir, (str, Path)):
+        raise TypeError("The provided path must be a str or Path object")
+    dest_dir = Path(dest_dir)
+    if create_dirs:
+        # A single stat of dest_dir for the whole batch, which also checks that it exists
+        st = os.stat(dest_dir)
+        parent_state = (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+    if formats is None:
+        formats = get_formats()
+    result = CsvClassification([], [], [], [])
+    formulas = get_registry().formulas
+    # Gas, [parent]_[gas_formula] pair and suffix of each original file, and the position of the file kept for each pair
+    matches = []
+    kept = {}
+    for path in paths:
+        parent, name = os.path.split(path)
+        result.sources.append(path if isinstance(path, Path) else Path(path))
+        match = formats.match(name, formulas)
+        if match is None:
+            matches.append(None)
+            continue
+        gas, priority = match
+        pair = os.path.splitext(os.path.basename(parent))[0] + "_" + gas
+        matches.append((gas, pair, os.path.splitext(name)[1]))
+        if pair not in kept or (priority, name) < kept[pair][0]:
+            kept[pair] = ((priority, name), len(matches) - 1)
+
+    gas_dirs = {}
+    for i, match in enumerate(matches):
+        if match is None or kept[match[1]][1] != i:
+            result.gases.append(None)
+            result.destinations.append(None)
+            result.new_names.append(None)
+            continue
+
+        gas, pair, suffix = match
+        if gas not in gas_dirs:
+            gas_dirs[gas] = dest_dir / f"gas_{gas}"
+            if create_dirs:
+                _make_dir_once(str(gas_dirs[gas]), parent_state)
+        new_name = pair + suffix
+        result.gases.append(gas)
+        result.destinations.append(gas_dirs[gas] / new_name)
+        result.new_names.append(new_name)
+    return result
+
+
+# Errors meaning that a kernel copy primitive is not usable for this pair of files, so the next one must be tried
+_KERNEL_COPY_FALLBACK_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+# Largest number of bytes requested from the kernel in a single copy call
+_KERNEL_COPY_CHUNK = 2**30
+# Ways of placing a restructured file at its destination, see place_file
+PLACEMENT_MODES = ("copy", "hardlink", "reflink", "symlink")
+# ioctl request cloning a whole file on Linux (btrfs, XFS, bcachefs, ...), _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# Errors meaning that a file cannot be linked or cloned at the destination, so it is copied instead
+_LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP,
+                         errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EBADF}
+
+
+def validate_workers(workers: int) -> None:
+    """Check that workers is a valid number of parallel workers, i.e. an integer greater or equal to 1.
+
+    Parameters:
+        - workers (int) : Number of workers to validate
+
+    Returns:
+        None
+    """
+    if not isinstance(workers, int) or isinstance(workers, bool):
+        raise TypeError("Workers must be an integer")
+    if workers < 1:
+        raise ValueError("Workers must be greater or equal to 1")
+
+
+def _copy_fd_copy_file_range(infd: int, outfd: int) -> int:
+    """Copy everything from infd to outfd with os.copy_file_range, which stays in the kernel
+        and lets filesystems that support it (NFS 4.2, btrfs, XFS, ...) copy server side.
+    """
+    copied = 0
+    while True:
+        sent = os.copy_file_range(infd, outfd, _KERNEL_COPY_CHUNK)
+        if sent == 0:
+            return copied
+        copied += sent
+
+
+def _copy_fd_sendfile(infd: int, outfd: int) -> int:
+    """Copy everything from infd to outfd with os.sendfile, avoiding the round trip through user space."""
+    copied = 0
+    while True:
+        sent = os.sendfile(outfd, infd, copied, _KERNEL_COPY_CHUNK)
+        if sent == 0:
+            return copied
+        copied += sent
+
+
+def copy_file(src: str | Path, dst: str | Path) -> int:
+    """Copy the contents of the file pointed to by src to dst, overwriting dst if it already exists.
+        The copy is done with os.copy_file_range or os.sendfile where the platform and the filesystems support it,
+        falling back to a regular buffered copy otherwise.
+
+    Parameters:
+        - src (str or pathlib.Path) : Absolute path to the file to copy
+        - dst (str or pathlib.Path) : Absolute path to the destination file
+
+    Returns:
+        - copied (int) : Number of bytes copied
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        kernel_copiers = []
+        if hasattr(os, "copy_file_range"):
+            kernel_copiers.append(_copy_fd_copy_file_range)
+        if hasattr(os, "sendfile"):
+            kernel_copiers.append(_copy_fd_sendfile)
+
+        for copier in kernel_copiers:
+            try:
+                return copier(infd, outfd)
+            except OSError as e:
+                if e.errno not in _KERNEL_COPY_FALLBACK_ERRNOS:
+                    raise
+                # Start over with the next copier
+                os.lseek(infd, 0, os.SEEK_SET)
+                os.lseek(outfd, 0, os.SEEK_SET)
+                os.ftruncate(outfd, 0)
+
+        # No kernel copy primitive available, copy through user space
+        shutil.copyfileobj(fsrc, fdst)
+        return fdst.tell()
+
+
+def validate_placement(placement: str) -> None:
+    """Check that placement is one of PLACEMENT_MODES.
+
+    Parameters:
+        - placement (str) : Placement mode to validate
+
+    Returns:
+        None
+    """
+    if placement not in PLACEMENT_MODES:
+        raise ValueError(f"Expected placement to be one of {PLACEMENT_MODES}, but received {placement}")
+
+
+def reflink_file(src: str | Path, dst: str | Path) -> int:
+    """Clone the file pointed to by src to dst with the FICLONE ioctl, so that both share the same data blocks
+        until one of them is modified. Falls back to copy_file where the platform or the filesystem cannot clone.
+
+    Parameters:
+        - src (str or pathlib.Path) : Absolute path to the file to clone
+        - dst (str or pathlib.Path) : Absolute path to the destination file
+
+    Returns:
+        - (int) : Number of bytes copied, 0 if the file was cloned
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Not a Unix platform
+        return copy_file(src, dst)
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return 0
+        except OSError as e:
+            if e.errno not in _LINK_FALLBACK_ERRNOS:
+                raise
+    return copy_file(src, dst)
+
+
+def place_file(src: str | Path, dst: str | Path, placement: str = "copy", writer: AtomicWriter | None = None) -> int:
+    """Place the file pointed to by src at dst, replacing dst if it already exists.
+
+        - copy : copy the contents, see copy_file
+        - hardlink : create a hard link, falling back to a copy if src and dst are on different filesystems
+        - reflink : clone the file, see reflink_file
+        - symlink : create a symbolic link pointing to src relative to the directory of dst
+
+    The file (or link) is created under a temporary name in the directory of dst and renamed over dst, so that dst is
+    never seen partially written, and placing a file never writes through a link left by a previous placement
+    into the source file itself.
+
+    Parameters:
+        - src (str or pathlib.Path) : Absolute path to the file to place
+        - dst (str or pathlib.Path) : Absolute path to the destination file
+        - placement (str) : Placement mode, one of PLACEMENT_MODES
+        - writer (AtomicWriter or None) : writer renaming the file over dst, and flushing it to the disk according to
+                                          its policy, see `analytic_tools.atomic.AtomicWriter`; one without fsync if None
+
+    Returns:
+        - (int) : Number of bytes copied, 0 if no data was copied
+    """
+    validate_placement(placement)
+    if writer is None:
+        writer = AtomicWriter()
+
+    if placement == "copy":
+        return writer.write(dst, partial(copy_file, src))
+    if placement == "reflink":
+        return writer.write(dst, partial(reflink_file, src))
+    if placement == "symlink":
+        target = os.path.relpath(src, os.path.dirname(dst))
+
+        def symlink(tmp: Path) -> int:
+            """Create a symbolic link to src at tmp."""
+            os.symlink(target, tmp)
+            return 0
+
+        return writer.write(dst, symlink, sync_data=False)
+
+    def link(tmp: Path) -> int:
+        """Hard link src at tmp, or copy it there."""
+        try:
+            os.link(src, tmp)
+            return 0
+        except OSError as e:
+            if e.errno not in _LINK_FALLBACK_ERRNOS:
+                raise
+        return copy_file(src, tmp)
+
+    return writer.write(dst, link)
+
+
+def _copy_job(job: Tuple[Path, Path], placement: str = "copy", writer: AtomicWriter | None = None) -> Dict:
+    """Place a single (source, destination) pair and report the outcome instead of raising."""
+    src, dst = job
+    result = {"source": src, "destination": dst, "bytes": 0, "error": None}
+    try:
+        result["bytes"] = place_file(src, dst, placement, writer)
+    except OSError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def copy_files(
+    jobs: Iterable[Tuple[str | Path, str | Path]],
+    workers: int = 1,
+    placement: str = "copy",
+    writer: AtomicWriter | None = None,
+) -> List[Dict]:
+    """Copy every (source, destination) pair in jobs, optionally with a pool of threads.
+        A failing copy does not stop the others, its error is reported in the returned results instead.
+        The destination directories must already exist.
+
+    Parameters:
+        - jobs (Iterable[Tuple[str | Path, str | Path]]) : pairs of absolute paths (source file, destination file)
+        - workers (int) : Number of threads copying at the same time, default to one (copy in the calling thread)
+        - placement (str) : How the files are placed at their destination, see `place_file`, default to copy
+        - writer (AtomicWriter or None) : writer shared by the copies, see `place_file`. With the batch fsync policy,
+                                 the destinations only appear once the writer is flushed.
+
+    Returns:
+        - results (List[Dict]) : one dictionary per job, in the order of jobs, with following keys:
+                                 source, destination, bytes (number of bytes copied), error (None or error message)
+    """
+    validate_workers(workers)
+    validate_placement(placement)
+
+    jobs = [(Path(src), Path(dst)) for src, dst in jobs]
+    place = partial(_copy_job, placement=placement, writer=writer)
+
+    if workers == 1:
+        return [place(job) for job in jobs]
+
+    # Copying is dominated by I/O latency, during which the threads release the GIL
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(place, jobs))
+
+
 def delete_directories(path_list: List[str | Path]) -> None:
     """Prompt the user for permission and delete the objects pointed to by the paths in path_list if
        permission is given. If the object is a directory, its whole directory tree is removed.
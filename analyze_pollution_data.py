@@ -2,22 +2,403 @@
 """
 
 # Import necessary packages here
-from pathlib import Path
+import argparse
+import asyncio
+import contextlib
+import glob
+import io
+import json
+import os
 import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+# analytic_tools.dataset, analytic_tools.pipeline and analytic_tools.plotting import numpy and matplotlib,
+# they are imported in the functions which need them so that runs without validation or plotting start fast
+from analytic_tools.atomic import FSYNC_POLICIES, AtomicWriter, remove_temp_files
+from analytic_tools.dedup import find_duplicates
+from analytic_tools.figures import DEFAULT_FIGSIZE, figure_name, is_up_to_date, load_figure_options, render_options
+from analytic_tools.formats import BUILTIN_FORMATS, SOURCE_FORMATS_ENV, get_formats, parse_formats, set_formats
+from analytic_tools.fsindex import INDEX_NAME, FileSystemIndex
+from analytic_tools.gases import GAS_REGISTRY_ENV, load_registry, set_registry
+from analytic_tools.instrumentation import Metrics, optional_stage
+from analytic_tools.manifest import (
+    hash_file,
+    is_placed,
+    is_unchanged,
+    load_manifest,
+    make_record,
+    save_manifest,
+)
 from analytic_tools.utilities import (
+    PLACEMENT_MODES,
+    DirectoryIndex,
+    classify_csv_files,
+    copy_file,
+    copy_files,
     display_diagnostics,
     display_directory_tree,
-    get_dest_dir_from_csv_file,
+    forget_created_dirs,
     get_diagnostics,
-    is_gas_csv,
-    merge_parent_and_basename,
-)
-from analytic_tools.plotting import (
-    plot_pollution_data,
+    iter_index_files,
+    place_file,
+    scan_directory,
+    validate_placement,
+    validate_workers,
 )
 
+# Stages of analyze_pollution_data, in the order they run
+STAGES = ("diagnose", "tree", "restructure", "plot")
+# Memory-backed directories holding the scratch workspace of analyze_pollution_data_tmp, the first usable one is taken
+SCRATCH_DIRS = ("/dev/shm",)
+
+
+def _split_duplicates(jobs: List[Tuple[Path, Path]], workers: int) -> Tuple[List[Tuple[Path, Path]], Dict[Path, Path]]:
+    """Find the jobs whose source file is byte-identical to the source of an earlier job.
+        Returns the other jobs, and the source of the earlier job for the source of each duplicate.
+    """
+    position = {src: i for i, (src, _) in enumerate(jobs)}
+    original = {}
+    for group in find_duplicates([src for src, _ in jobs], workers=workers):
+        first, *others = sorted(group.paths, key=position.__getitem__)
+        for other in others:
+            original[other] = first
+    return [job for job in jobs if job[0] not in original], original
+
+
+def _link_duplicates(
+    jobs: List[Tuple[Path, Path]],
+    results: List[Dict],
+    original: Dict[Path, Path],
+    writer: AtomicWriter | None = None,
+) -> List[Dict]:
+    """Hard link the destination of each duplicate job to the destination of the job it duplicates,
+        so that their contents are stored once. Returns the results of all the jobs, in the order of jobs,
+        the results of the duplicates having a "duplicate of" entry with the source they duplicate.
+    """
+    by_source = {result["source"]: result for result in results}
+    ordered = []
+    for src, dst in jobs:
+        if src not in original:
+            ordered.append(by_source[src])
+            continue
+        first = by_source[original[src]]
+        result = {"source": src, "destination": dst, "bytes": 0, "error": first["error"],
+                  "status": "failed" if first["error"] is not None else "copied", "duplicate of": original[src]}
+        for key in ("data", "sha256"):
+            if key in first:
+                result[key] = first[key]
+        if first["error"] is None:
+            try:
+                result["bytes"] = place_file(first["destination"], dst, "hardlink", writer)
+            except OSError as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                result["status"] = "failed"
+        ordered.append(result)
+    return ordered
+
+
+def _set_status(result: Dict) -> Dict:
+    """Set the "status" of the result of a copy to "copied", "failed" or "unchanged" (the pipeline found the contents
+        already placed at the destination, see `analytic_tools.pipeline.process_file`).
+    """
+    unchanged = result.pop("unchanged", False)
+    if result["error"] is not None:
+        result["status"] = "failed"
+    else:
+        result["status"] = "unchanged" if unchanged else "copied"
+    return result
+
+
+def _transfer_files(
+    jobs: List[Tuple[Path, Path]],
+    workers: int,
+    validate: bool,
+    placement: str,
+    dedup: bool = False,
+    writer: AtomicWriter | None = None,
+    keep_data: bool = False,
+    placed: Dict[Path, str] | None = None,
+) -> List[Dict]:
+    """Place the (source, destination) jobs, or run them through the streaming pipeline if validate is True,
+        and set the "status" of each result, see _set_status. The pipeline skips the sources whose contents
+        are already placed according to placed. With dedup, the copies of identical source files
+        are hard links to a single copy; the link placements already store the contents once.
+        The writer is flushed before returning, so that every copy reported as copied is in place.
+        The blocks parsed by the pipeline are dropped as the files are written, unless keep_data is True and every
+        file is valid, so that the memory used does not grow with the number of files.
+    """
+    if writer is None:
+        writer = AtomicWriter()
+    original = {}
+    transfer_jobs = jobs
+    if dedup and placement in ("copy", "reflink"):
+        transfer_jobs, original = _split_duplicates(jobs, workers)
+
+    if validate:
+        from analytic_tools.pipeline import stream_restructure
+
+        results = []
+        for result in stream_restructure(transfer_jobs, workers, placement, writer, placed):
+            # The dataset cache is only built when every file is valid, the blocks are no longer needed otherwise
+            if keep_data and result["error"] is not None:
+                keep_data = False
+                for kept in results:
+                    kept.pop("data", None)
+            if not keep_data:
+                result.pop("data", None)
+            results.append(result)
+    else:
+        results = copy_files(transfer_jobs, workers=workers, placement=placement, writer=writer)
+    for result in results:
+        _set_status(result)
+
+    if original:
+        # The duplicates are linked to the copies, which must be in place first
+        writer.flush()
+        results = _link_duplicates(jobs, results, original, writer)
+    writer.flush()
+    return results
+
+
+def _source_stat(entry: os.DirEntry) -> os.stat_result:
+    """Stat data of a source file to compare with the manifest. The entries of scan_directory were stat'ed by this run,
+        whereas an entry of the persistent index holds the stat data of the last listing of its directory, which
+        misses the files modified in place: the file is stat'ed again.
+    """
+    if isinstance(entry, os.DirEntry):
+        return entry.stat()
+    return os.stat(entry)
+
+
+def _plan_incremental(
+    jobs: List[Tuple[Path, Path]],
+    entries: Dict[Path, os.DirEntry],
+    manifest_path: Path,
+    placement: str = "copy",
+    hash_sources: bool = True,
+) -> Dict:
+    """Compare the jobs with the manifest at manifest_path and select those whose source file is new or changed,
+        or whose copy is no longer placed with placement (e.g. a symbolic link left by a previous run when copies
+        are now requested). Returns the state of the incremental run, to be passed to _finish_incremental with the results of the copies.
+        If hash_sources is False, the files whose size or modification time changed are not read: they are all
+        selected, and the "placed" entry of the state holds the sha256 of their contents already placed,
+        for the streaming pipeline to compare with the contents it reads.
+    """
+    state = {
+        "old_manifest": load_manifest(manifest_path),
+        "new_manifest": {},
+        "results": {},
+        "pending": {},
+        "placed": {},
+        "to_copy": [],
+    }
+    old_manifest, new_manifest, results = state["old_manifest"], state["new_manifest"], state["results"]
+
+    for src, dst in jobs:
+        key = str(src)
+        record = old_manifest.get(key)
+        try:
+            stat = _source_stat(entries[src])
+            # Same size and modification time, the file is trusted without being read
+            if is_unchanged(record, dst, stat, placement):
+                new_manifest[key] = record
+                results[src] = {"source": src, "destination": dst, "bytes": 0, "error": None, "status": "unchanged"}
+                continue
+            if not hash_sources:
+                # The pipeline hashes the contents as it reads them
+                if record is not None and is_placed(record, dst, placement):
+                    state["placed"][src] = record["sha256"]
+                state["pending"][src] = make_record(dst, stat, None, placement)
+                state["to_copy"].append((src, dst))
+                continue
+            # Same contents, only the modification time changed
+            sha256 = hash_file(src)
+        except OSError as e:
+            results[src] = {"source": src, "destination": dst, "bytes": 0,
+                            "error": f"{type(e).__name__}: {e}", "status": "failed"}
+            continue
+        if record is not None and record["sha256"] == sha256 and is_placed(record, dst, placement):
+            new_manifest[key] = make_record(dst, stat, sha256, placement)
+            results[src] = {"source": src, "destination": dst, "bytes": 0, "error": None, "status": "unchanged"}
+            continue
+        state["pending"][src] = make_record(dst, stat, sha256, placement)
+        state["to_copy"].append((src, dst))
+
+    return state
+
+
+def _stale_copies(jobs: List[Tuple[Path, Path]], old_manifest: Dict[str, Dict]) -> List[Tuple[str, Path]]:
+    """Manifest keys and restructured copies of the source files that disappeared since the manifest was saved,
+        except the copies which another source file now has as destination.
+    """
+    sources = {str(src) for src, _ in jobs}
+    destinations = {str(dst) for _, dst in jobs}
+    return [
+        (key, Path(record["destination"]))
+        for key, record in old_manifest.items()
+        if key not in sources and record["destination"] not in destinations
+    ]
+
+
+def _finish_incremental(
+    jobs: List[Tuple[Path, Path]],
+    state: Dict,
+    copy_results: List[Dict],
+    manifest_path: Path,
+) -> List[Dict]:
+    """Record the results of the copies selected by _plan_incremental, delete the restructured copies of source files
+        that no longer exist and save the updated manifest.
+        Returns the results of all the jobs, followed by the results of the removed copies.
+    """
+    old_manifest, new_manifest, results = state["old_manifest"], state["new_manifest"], state["results"]
+
+    for result in copy_results:
+        if result["error"] is None:
+            record = state["pending"][result["source"]]
+            # The sha256 of the files read by the pipeline is only known once they are read
+            if record["sha256"] is None:
+                record["sha256"] = result["sha256"]
+            new_manifest[str(result["source"])] = record
+        results[result["source"]] = result
+
+    ordered = [results[src] for src, _ in jobs]
+
+    # Delete the copies of source files that disappeared
+    for key, stale in _stale_copies(jobs, old_manifest):
+        stale.unlink(missing_ok=True)
+        # Remove the gas directory as well if it is now empty
+        try:
+            stale.parent.rmdir()
+            forget_created_dirs()
+        except OSError:
+            pass
+        ordered.append({"source": Path(key), "destination": stale, "bytes": 0, "error": None, "status": "removed"})
+
+    save_manifest(manifest_path, new_manifest)
+    return ordered
+
+
+def _remove_temp_files(dest_dir: Path) -> int:
+    """Remove the temporary files left in the gas directories of dest_dir by an interrupted run."""
+    return sum(remove_temp_files(gas_dir) for gas_dir in dest_dir.glob("gas_*") if gas_dir.is_dir())
+
+
+def _check_restructure_dirs(pollution_dir: str | Path, dest_dir: str | Path) -> Tuple[Path, Path]:
+    """Check that pollution_dir and dest_dir are existing directories and return them as Path objects."""
+    # Check that pollution_dir and dest_dir are path-like objects
+    if not isinstance(pollution_dir, (str, Path)) or not isinstance(dest_dir, (str, Path)):
+        raise TypeError("The provided path must be a str or Path object")
+
+    pollution_dir = Path(pollution_dir)
+    dest_dir = Path(dest_dir)
+
+    # Check that pollution_dir and dest_dir are existing directories
+    if not pollution_dir.exists():
+        raise NotADirectoryError("The provided path must exist")
+    if not dest_dir.exists():
+        raise NotADirectoryError("The provided path must exist")
+    if not pollution_dir.is_dir() or not dest_dir.is_dir():
+        raise NotADirectoryError("The provided path must be a directory")
+    return pollution_dir, dest_dir
+
+
+def _plan_jobs(
+    pollution_dir: Path,
+    dest_dir: Path,
+    index: DirectoryIndex | None,
+    create_dirs: bool = True,
+) -> Tuple[List[Tuple[Path, Path]], Dict[Path, os.DirEntry]]:
+    """Find the original gas files in the pollution_data tree and pair each of them with its destination,
+        creating the gas_[gas_formula] directories unless create_dirs is False. Returns the (source, destination)
+        jobs and the directory entries of all the files of the formats in use, by path.
+    """
+    # Contents of pollution_data tree
+    if index is None:
+        index = scan_directory(pollution_dir)
+    formats = get_formats()
+    entries = {Path(entry.path): entry for entry in iter_index_files(index)
+               if os.path.splitext(entry.name)[1] in formats.suffixes}
+
+    # Find the valid files and their destinations, creating each gas_[gas_formula] directory once
+    batch = classify_csv_files(entries, dest_dir, create_dirs=create_dirs, formats=formats)
+    jobs = [(src, dst) for src, dst in zip(batch.sources, batch.destinations) if dst is not None]
+
+    return jobs, entries
+
+
+def _finish_restructure(
+    results: List[Dict],
+    dest_dir: Path,
+    validate: bool,
+    cache_dir: str | Path | None,
+    metrics: Metrics | None = None,
+) -> List[Dict]:
+    """Drop the parsed blocks from the results, writing the dataset cache from them first when
+        every file was validated and written in this pass, and count the files and bytes processed in metrics.
+    """
+    if metrics is not None:
+        for result in results:
+            metrics.count(f"files {result['status']}")
+            metrics.count("bytes copied", result["bytes"])
+            if result.get("duplicate of") is not None:
+                metrics.count("files deduplicated")
+
+    # The parsed blocks are only kept until the dataset cache is written
+    parsed = [(result["destination"], result.pop("data", None)) for result in results]
+    if validate and cache_dir is not None and all(result["status"] == "copied" for result in results):
+        from analytic_tools.dataset import (
+            build_emissions,
+            fingerprint_by_gas,
+            gas_from_dir,
+            save_emissions_cache,
+            source_from_file,
+        )
+
+        fingerprint = fingerprint_by_gas(dest_dir)
+        written = {f"{r['destination'].parent.name}/{r['destination'].name}" for r in results}
+        # Other files left in dest_dir would be missing from the dataset
+        if set(fingerprint) == written:
+            blocks = []
+            for destination, data in parsed:
+                gas = gas_from_dir(destination.parent)
+                blocks.append((source_from_file(destination, gas), gas, data))
+            save_emissions_cache(build_emissions(blocks), cache_dir, fingerprint)
+
+    return results
+
+
+def _changed_gases(results: List[Dict]) -> set:
+    """Names of the gas_[gas_formula] directories with files copied or removed by a restructuring."""
+    return {result["destination"].parent.name for result in results if result["status"] in ("copied", "removed")}
 
-def restructure_pollution_data(pollution_dir: str | Path, dest_dir: str | Path) -> None:
+
+def _check_results(results: List[Dict], by_gas_dir: Path) -> None:
+    """Raise an OSError if any file failed to be restructured."""
+    failed = [result for result in results if result["error"] is not None]
+    if failed:
+        raise OSError(
+            f"Failed to restructure {len(failed)} file(s) to {by_gas_dir}, first error: {failed[0]['error']}")
+
+
+def restructure_pollution_data(
+    pollution_dir: str | Path,
+    dest_dir: str | Path,
+    index: DirectoryIndex | None = None,
+    workers: int = 1,
+    manifest_path: str | Path | None = None,
+    validate: bool = False,
+    cache_dir: str | Path | None = None,
+    metrics: Metrics | None = None,
+    placement: str = "copy",
+    dedup: bool = False,
+    fsync: str = "none",
+) -> List[Dict]:
     """This function searches the tree of pollution_data directory pointed to by pollution_dir for .csv files
         that satisfy the criteria described in the assignment. It then moves a renamed copy of these files to gas-specific
         sub-directories in dest_dir, which will be created based on the gasses present in pollution_data directory.
@@ -26,52 +407,227 @@ def restructure_pollution_data(pollution_dir: str | Path, dest_dir: str | Path)
         - pollution_dir (str or pathlib.Path) : The absolute path to pollution_data directory
         - dest_dir (str or pathlib.Path) : The absolute path to new directory where gas-specific subdirectories will
                                      be created, which must be pollution_data_restructured/by_gas
+        - index (DirectoryIndex or None) : index of the pollution_data tree from scan_directory,
+                                     the tree is scanned if not provided
+        - workers (int) : Number of threads copying files at the same time, default to one
+        - manifest_path (str or pathlib.Path or None) : Absolute path to the manifest of the previous run.
+                                     If provided, only new or changed files are copied, the copies of deleted source
+                                     files are removed and the manifest is updated. If None, every file is copied.
+        - validate (bool) : If True, the files are processed by the streaming pipeline of `analytic_tools.pipeline`,
+                                     which reads each file once, checks that it contains numeric year,value lines and
+                                     only then writes its copy. Malformed files are reported as failed and not copied.
+        - cache_dir (str or pathlib.Path or None) : Absolute path to the directory holding the binary cache of the
+                                     emissions dataset. If provided together with validate, and every file was
+                                     (re)written in this pass, the cache is built from the blocks parsed while copying.
+        - metrics (Metrics or None) : If provided, counts the files by status ("files copied", "files unchanged", ...)
+                                     and the bytes copied
+        - placement (str) : How the files are placed in dest_dir: copy (default), hardlink, reflink or symlink
+                                     (relative), see `place_file`. The names are the same in every mode, and the
+                                     links avoid copying the data.
+        - dedup (bool) : If True, the source files copied in this pass are grouped by contents (see
+                                     `analytic_tools.dedup.find_duplicates`) and the copy of each identical file is a
+                                     hard link to the copy of the first one, whose source is given in its
+                                     "duplicate of" result entry. Has no effect with the hardlink and symlink placements.
+        - fsync (str) : How the files are flushed to the disk, one of FSYNC_POLICIES: none (default), batch (flushed
+                                     together by batches, with one flush per directory) or always (each file and its
+                                     directory). Whatever the policy, each file is written under a temporary name and
+                                     renamed over its destination, so that an interrupted run never leaves a partial
+                                     copy, see `analytic_tools.atomic.AtomicWriter`. The manifest is saved once the
+                                     copies are in place.
+
+    The formats of the source files ingested besides the original .csv files, such as the [gas_formula]_NNN.npy dumps,
+    are selected with `analytic_tools.formats.set_formats`; each gas of each source is restructured from one file only.
 
     Returns:
-    None
+        - results (List[Dict]) : one dictionary per file, as returned by `copy_files`, with an additional
+                                 "status" entry: "copied", "unchanged", "removed" or "failed".
+                                 A failed copy is reported in its "error" entry and does not stop the others.
 
     Pseudocode:
     1. Iterate through the contents of `pollution_dir`
     2. Find valid .csv files for gasses ([`[gas_formula].csv` files of correct gas types).
-    3. Create/assign new directory to store them under `dest_dir` using `get_dest_dir_from_csv_file`
-    4. Assign a new name using `merge_parent_and_basename` and copy the file to the new destination.
+    3. Create/assign new directory to store them under `dest_dir` using `get_dest_dir_from_csv_file`,
+       once per gas
+    4. Assign a new name using `merge_parent_and_basename` and copy the files to the new destination.
        If the file happens already to exist there, it should be overwritten.
     """
 
+    pollution_dir, dest_dir = _check_restructure_dirs(pollution_dir, dest_dir)
+    validate_placement(placement)
+    writer = AtomicWriter(fsync)
+
+    # Remove the temporary files left by an interrupted run
+    _remove_temp_files(dest_dir)
+
+    # Find the files to restructure and their destinations
+    jobs, entries = _plan_jobs(pollution_dir, dest_dir, index)
+
+    # Copy files to the new destination, overwrite them if they already exist
+    if manifest_path is not None:
+        # The pipeline reads every selected file anyway, it hashes them instead of the planning
+        state = _plan_incremental(jobs, entries, Path(manifest_path), placement, hash_sources=not validate)
+        # The dataset cache is only built when every file is written in this pass
+        keep_data = cache_dir is not None and not state["results"]
+        copy_results = _transfer_files(
+            state["to_copy"], workers, validate, placement, dedup, writer, keep_data, state["placed"])
+        results = _finish_incremental(jobs, state, copy_results, Path(manifest_path))
+    else:
+        results = _transfer_files(jobs, workers, validate, placement, dedup, writer, cache_dir is not None)
+
+    return _finish_restructure(results, dest_dir, validate, cache_dir, metrics)
+
+
+def plan_restructure(
+    pollution_dir: str | Path,
+    dest_dir: str | Path,
+    index: DirectoryIndex | None = None,
+    manifest_path: str | Path | None = None,
+    placement: str = "copy",
+) -> List[Dict]:
+    """Work out what restructure_pollution_data would do, without copying, removing or creating anything.
+
+    Parameters:
+        - pollution_dir, dest_dir, index, manifest_path, placement : see `restructure_pollution_data`,
+                                 dest_dir does not need to exist
+
+    Returns:
+        - results (List[Dict]) : the results restructure_pollution_data would return, where bytes is the size of
+                                 each file to copy and status is the status each file would have
+    """
     # Check that pollution_dir and dest_dir are path-like objects
     if not isinstance(pollution_dir, (str, Path)) or not isinstance(dest_dir, (str, Path)):
         raise TypeError("The provided path must be a str or Path object")
-
     pollution_dir = Path(pollution_dir)
     dest_dir = Path(dest_dir)
+    if index is None and not pollution_dir.exists():
+        # restructure_pollution_data would find nothing to copy
+        index = {pollution_dir: []}
 
-    # Check that pollution_dir and dest_dir are existing directories
-    if not pollution_dir.exists():
-        raise NotADirectoryError("The provided path must exist")
-    if not dest_dir.exists():
-        raise NotADirectoryError("The provided path must exist")
-    if not pollution_dir.is_dir() or not dest_dir.is_dir():
-        raise NotADirectoryError("The provided path must be a directory")
+    jobs, entries = _plan_jobs(pollution_dir, dest_dir, index, create_dirs=False)
+    if manifest_path is None:
+        return [{"source": src, "destination": dst, "bytes": _source_stat(entries[src]).st_size, "error": None,
+                 "status": "copied"} for src, dst in jobs]
 
-    # Contents of pollution_data tree
-    contents = pollution_dir.glob('**/*.csv')
-
-    # Iterate through the contents of `pollution_dir
-    for path in contents:
-        # Find valid .csv files
-        if is_gas_csv(path):
-            # Create/assign new directory to store them using `get_dest_dir_from_csv_file`
-            destination = get_dest_dir_from_csv_file(dest_dir, path)
-            # Assign new name using `merge_parent_and_basename`
-            new_file = destination / Path(merge_parent_and_basename(path))
-            # Create new_file if new_file does not exists
-            if not new_file.exists():
-                new_file.touch()
-            # Copy file to the new destination, overwrite it if it already exists
-            shutil.copy(path, new_file)  # Replaces existing file
-
-
-def analyze_pollution_data(work_dir: str | Path) -> None:
+    state = _plan_incremental(jobs, entries, Path(manifest_path), placement)
+    results = state["results"]
+    for src, dst in state["to_copy"]:
+        results[src] = {"source": src, "destination": dst, "bytes": state["pending"][src]["size"], "error": None,
+                        "status": "copied"}
+    planned = [results[src] for src, _ in jobs]
+    for key, stale in _stale_copies(jobs, state["old_manifest"]):
+        planned.append({"source": Path(key), "destination": stale, "bytes": 0, "error": None, "status": "removed"})
+    return planned
+
+
+def plan_analysis(
+    work_dir: str | Path,
+    stages: Iterable[str] | None = None,
+    incremental: bool = True,
+    fmt: str = "png",
+    index: DirectoryIndex | None = None,
+    placement: str = "copy",
+    figsize: Tuple[float, float] | None = None,
+    dpi: int | None = None,
+    preview: bool = False,
+) -> Dict:
+    """Work out which files analyze_pollution_data would copy or remove and which figures it would draw,
+        without writing anything.
+
+    Parameters:
+        - work_dir, stages, incremental, fmt, placement, figsize, dpi, preview : see `analyze_pollution_data`
+        - index (DirectoryIndex or None) : index of the pollution_data tree, scanned if None
+
+    Returns:
+        - plan (Dict) : a dictionary with following keys: files (see `plan_restructure`, None if the restructure
+                        stage is not selected) and figures (the paths to the figures which would be drawn,
+                        None if the plot stage is not selected)
+    """
+    stages = _check_stages(stages)
+    work_dir = Path(work_dir)
+    restructured_dir = work_dir / "pollution_data_restructured"
+    by_gas_dir = restructured_dir / "by_gas"
+    figures_dir = restructured_dir / "figures"
+    plan = {"files": None, "figures": None}
+
+    if "restructure" in stages:
+        manifest_path = restructured_dir / "manifest.json" if incremental else None
+        plan["files"] = plan_restructure(work_dir / "pollution_data", by_gas_dir, index=index,
+                                         manifest_path=manifest_path, placement=placement)
+
+    if "plot" in stages:
+        gas_dirs = {path.name for path in by_gas_dir.iterdir() if path.is_dir()} if by_gas_dir.is_dir() else set()
+        changed = None
+        if plan["files"] is not None:
+            gas_dirs |= {r["destination"].parent.name for r in plan["files"] if r["status"] != "removed"}
+            changed = _changed_gases(plan["files"]) if incremental else None
+        recorded = load_figure_options(figures_dir)
+        options = render_options(figsize or DEFAULT_FIGSIZE, dpi, preview)
+        names = {name: figure_name(name, fmt, preview) for name in gas_dirs}
+        plan["figures"] = [
+            figures_dir / names[name]
+            for name in sorted(gas_dirs)
+            if changed is None or name in changed or not is_up_to_date(figures_dir, names[name], options, recorded)
+        ]
+    return plan
+
+
+def display_plan(plan: Dict) -> None:
+    """Display the plan returned by plan_analysis.
+
+    Parameters:
+        - plan (Dict) : the plan returned by plan_analysis
+
+    Returns:
+        None
+    """
+    if plan["files"] is not None:
+        counts = {status: [r for r in plan["files"] if r["status"] == status]
+                  for status in ("copied", "unchanged", "removed", "failed")}
+        total = sum(r["bytes"] for r in counts["copied"])
+        print(f"Would copy {len(counts['copied'])} file(s) ({total} bytes), "
+              f"{len(counts['unchanged'])} unchanged, {len(counts['removed'])} to remove, "
+              f"{len(counts['failed'])} unreadable")
+        for result in counts["copied"]:
+            print(f"    copy {result['source']} -> {result['destination']}")
+        for result in counts["removed"]:
+            print(f"    remove {result['destination']}")
+        for result in counts["failed"]:
+            print(f"    unreadable {result['source']}: {result['error']}")
+    if plan["figures"] is not None:
+        print(f"Would draw {len(plan['figures'])} figure(s)")
+        for figpath in plan["figures"]:
+            print(f"    draw {figpath}")
+
+
+def _check_stages(stages: Iterable[str] | None) -> set:
+    """Check the names of the selected stages and return them as a set, all the stages if stages is None."""
+    if stages is None:
+        return set(STAGES)
+    stages = set(stages)
+    unknown = stages - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stage(s) {sorted(unknown)}, expected some of {STAGES}")
+    return stages
+
+
+def analyze_pollution_data(
+    work_dir: str | Path,
+    workers: int = 1,
+    incremental: bool = True,
+    plot_workers: int = 1,
+    validate: bool = False,
+    metrics: Metrics | None = None,
+    stages: Iterable[str] | None = None,
+    dry_run: bool = False,
+    fmt: str = "png",
+    placement: str = "copy",
+    figsize: Tuple[float, float] | None = None,
+    dpi: int | None = None,
+    preview: bool = False,
+    dedup: bool = False,
+    persistent_index: bool = False,
+    fsync: str = "none",
+) -> None:
     """Do the restructuring of the pollution_data and plot
        the statistics showing emissions of each gas as function of all the corresponding
        sources. The new structure and the plots are saved in a separate directory under work_dir
@@ -79,6 +635,33 @@ def analyze_pollution_data(work_dir: str | Path) -> None:
     Parameters:
         - work_dir (str or pathlib.Path) : Absolute path to the working directory that
                                     contains the pollution_data directory and where the new directories will be created
+        - workers (int) : Number of threads copying files during the restructuring, default to one
+        - incremental (bool) : If True, only the source files changed since the previous run are copied and only
+                               the figures of the affected gasses are redrawn, using the manifest stored in
+                               pollution_data_restructured. If False, everything is copied and redrawn.
+        - plot_workers (int) : Number of processes drawing the plots, default to one
+        - validate (bool) : If True, the source files are parsed and validated while being copied,
+                            see `restructure_pollution_data`
+        - metrics (Metrics or None) : If provided, records the wall time of each stage (scan, diagnostics, tree,
+                            restructure, plot), the files and bytes copied and the render time of each figure
+        - stages (Iterable[str] or None) : Stages to run, some of STAGES (diagnose, tree, restructure, plot),
+                            all of them if None. Without the restructure stage, every figure is redrawn.
+        - dry_run (bool) : If True, the diagnose and tree stages run as usual but, instead of restructuring and plotting,
+                            the files which would be copied or removed and the figures which would be drawn are
+                            displayed, see `plan_analysis`. Nothing is written.
+        - fmt (str) : File format of the figures, see `plot_pollution_data`
+        - placement (str) : How the files are placed in by_gas, see `restructure_pollution_data`
+        - figsize, dpi, preview : Size, resolution and preview mode of the figures, see `draw_gas_plot`.
+                            figsize defaults to DEFAULT_FIGSIZE if None.
+        - dedup (bool) : If True, the diagnostics report the identical files of pollution_data and their copies
+                            are stored once, see `restructure_pollution_data`
+        - persistent_index (bool) : If True, the pollution_data tree is not walked again: the index stored in
+                            pollution_data_restructured (see `analytic_tools.fsindex.FileSystemIndex`) is refreshed,
+                            listing only the directories modified since the previous run, and shared by the stages.
+                            The index only finds the files: the original gas files are stat'ed again to be compared
+                            with the manifest, so that the files modified in place are still restructured.
+                            Ignored for a dry run, which writes nothing.
+        - fsync (str) : How the restructured files are flushed to the disk, see `restructure_pollution_data`
 
     Returns:
     None
@@ -102,58 +685,554 @@ def analyze_pollution_data(work_dir: str | Path) -> None:
         raise NotADirectoryError(
             "Work directory must be an existing directory")
 
+    stages = _check_stages(stages)
+
     # Create pollution_data_restructured in work_dir
     pollution_dir = work_dir / "pollution_data"
     restructured_dir = work_dir / "pollution_data_restructured"
-    if not pollution_dir.exists():
+    if not pollution_dir.exists() and not dry_run:
         pollution_dir.mkdir(parents=True)
+    # A dry run does not create pollution_data, there is nothing to diagnose and the plan is empty
+    missing = not pollution_dir.exists()
+    if missing:
+        stages = stages - {"diagnose", "tree"}
+        print(f"{pollution_dir} does not exist, a run would create it empty")
+
+    # Walk the pollution_data tree once, the index is shared by all the stages below
+    index = None
+    if stages & {"diagnose", "tree", "restructure"}:
+        with optional_stage(metrics, "scan"):
+            if persistent_index and not dry_run:
+                restructured_dir.mkdir(parents=True, exist_ok=True)
+                with FileSystemIndex(pollution_dir, restructured_dir / INDEX_NAME) as fsindex:
+                    changed = fsindex.refresh()
+                    index = fsindex.directory_index()
+                if metrics is not None:
+                    metrics.count("files changed", len(changed))
+            elif not missing:
+                index = scan_directory(pollution_dir)
+            else:
+                index = {pollution_dir: []}
+        if metrics is not None:
+            metrics.count("files scanned", sum(len(entries) for entries in index.values()))
 
     # Make a call to display_diagnostics and display_directory_tree
-    display_diagnostics(pollution_dir, get_diagnostics(pollution_dir))
-    display_directory_tree(pollution_dir, maxfiles=3)
+    if "diagnose" in stages:
+        with optional_stage(metrics, "diagnostics"):
+            display_diagnostics(pollution_dir, get_diagnostics(pollution_dir, index=index, duplicates=dedup))
+    if "tree" in stages:
+        with optional_stage(metrics, "tree"):
+            display_directory_tree(pollution_dir, maxfiles=3, index=index)
+
+    if dry_run:
+        display_plan(plan_analysis(work_dir, stages=stages, incremental=incremental, fmt=fmt, index=index,
+                                   placement=placement, figsize=figsize, dpi=dpi, preview=preview))
+        return
 
     # Populate it with a by_gas sub-folder
     by_gas_dir = restructured_dir / "by_gas"
-    if not by_gas_dir.exists():
+    if not by_gas_dir.exists() and stages & {"restructure", "plot"}:
         by_gas_dir.mkdir(parents=True)
 
     # Make a call to restructure_pollution_data
-    restructure_pollution_data(pollution_dir, by_gas_dir)
+    results = None
+    if "restructure" in stages:
+        manifest_path = restructured_dir / "manifest.json" if incremental else None
+        with optional_stage(metrics, "restructure"):
+            results = restructure_pollution_data(
+                pollution_dir, by_gas_dir, index=index, workers=workers, manifest_path=manifest_path,
+                validate=validate, cache_dir=restructured_dir, metrics=metrics, placement=placement, dedup=dedup,
+                fsync=fsync)
+        _check_results(results, by_gas_dir)
+
+    if "plot" not in stages:
+        return
 
     # Populate pollution_data_restructured with a sub folder named figures
     figures_dir = restructured_dir / "figures"
     if not figures_dir.exists():
         figures_dir.mkdir(parents=True)
 
-    # Make a call to plot_pollution_data
-    plot_pollution_data(by_gas_dir, figures_dir)
+    # Make a call to plot_pollution_data, redrawing only the figures of the gasses that changed
+    changed_gases = _changed_gases(results) if incremental and results is not None else None
+    with optional_stage(metrics, "plot"):
+        from analytic_tools.plotting import plot_pollution_data
+
+        plot_pollution_data(by_gas_dir, figures_dir, gases=changed_gases, workers=plot_workers,
+                            cache_dir=restructured_dir, metrics=metrics, fmt=fmt,
+                            figsize=figsize or DEFAULT_FIGSIZE, dpi=dpi, preview=preview)
+
+
+async def _transfer_files_async(
+    jobs: List[Tuple[Path, Path]],
+    validate: bool,
+    placement: str,
+    executor: Executor | None,
+    semaphore: asyncio.Semaphore,
+    max_concurrent_copies: int,
+    keep_data: bool = False,
+    placed: Dict[Path, str] | None = None,
+) -> List[Dict]:
+    """Asynchronous version of _transfer_files: each file is copied in executor, with at most max_concurrent_copies
+        copies of this call in flight and each copy holding semaphore while it runs.
+    """
+    loop = asyncio.get_running_loop()
+    if validate:
+        from analytic_tools.pipeline import process_file
+
+        transfer = partial(process_file, placement=placement, placed=placed)
+    else:
+        transfer = lambda job: copy_files([job], placement=placement)[0]  # noqa: E731
+    results = [None] * len(jobs)
+    # The copy coroutines share this iterator, so that each job is taken exactly once
+    pending = iter(enumerate(jobs))
+
+    async def copy_worker() -> None:
+        for i, job in pending:
+            async with semaphore:
+                results[i] = await loop.run_in_executor(executor, transfer, job)
+                if not keep_data:
+                    results[i].pop("data", None)
+
+    await asyncio.gather(*(copy_worker() for _ in range(min(max_concurrent_copies, len(jobs)))))
+    for result in results:
+        _set_status(result)
+    return results
+
+
+async def restructure_pollution_data_async(
+    pollution_dir: str | Path,
+    dest_dir: str | Path,
+    index: DirectoryIndex | None = None,
+    manifest_path: str | Path | None = None,
+    validate: bool = False,
+    cache_dir: str | Path | None = None,
+    placement: str = "copy",
+    executor: Executor | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+    max_concurrent_copies: int = 4,
+) -> List[Dict]:
+    """Asynchronous version of restructure_pollution_data, which does not block the event loop.
+        All the filesystem work runs in executor, and the files are copied one per executor task.
+
+    Parameters:
+        - pollution_dir, dest_dir, index, manifest_path, validate, cache_dir, placement : see `restructure_pollution_data`
+        - executor (concurrent.futures.Executor or None) : Executor running the filesystem work,
+                                     the default executor of the event loop if None
+        - semaphore (asyncio.Semaphore or None) : Semaphore held by each copy while it runs. Share one semaphore
+                                     between several calls to bound the total number of copies in flight.
+                                     If None, a semaphore of max_concurrent_copies is used.
+        - max_concurrent_copies (int) : Number of copies of this call in flight at the same time, default to four
+
+    Returns:
+        - results (List[Dict]) : see `restructure_pollution_data`
+    """
+    validate_workers(max_concurrent_copies)
+    validate_placement(placement)
+    loop = asyncio.get_running_loop()
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max_concurrent_copies)
+
+    pollution_dir, dest_dir = await loop.run_in_executor(executor, _check_restructure_dirs, pollution_dir, dest_dir)
+    jobs, entries = await loop.run_in_executor(executor, _plan_jobs, pollution_dir, dest_dir, index)
+
+    if manifest_path is not None:
+        manifest_path = Path(manifest_path)
+        state = await loop.run_in_executor(
+            executor, _plan_incremental, jobs, entries, manifest_path, placement, not validate)
+        copy_results = await _transfer_files_async(
+            state["to_copy"], validate, placement, executor, semaphore, max_concurrent_copies,
+            cache_dir is not None and not state["results"], state["placed"])
+        results = await loop.run_in_executor(
+            executor, _finish_incremental, jobs, state, copy_results, manifest_path)
+    else:
+        results = await _transfer_files_async(
+            jobs, validate, placement, executor, semaphore, max_concurrent_copies, cache_dir is not None)
 
+    return await loop.run_in_executor(executor, _finish_restructure, results, dest_dir, validate, cache_dir)
 
-def analyze_pollution_data_tmp(work_dir: str | Path) -> None:
+
+async def analyze_pollution_data_async(
+    work_dir: str | Path,
+    incremental: bool = True,
+    plot_workers: int = 1,
+    validate: bool = False,
+    placement: str = "copy",
+    executor: Executor | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+    max_concurrent_copies: int = 4,
+) -> None:
+    """Asynchronous version of analyze_pollution_data, which does not block the event loop.
+
+    Parameters:
+        - work_dir, incremental, plot_workers, validate, placement : see `analyze_pollution_data`
+        - executor, semaphore, max_concurrent_copies : see `restructure_pollution_data_async`
+
+    Returns:
+    None
+    """
+
+    # Check that work_dir is a path-like object
+    if not isinstance(work_dir, (str, Path)):
+        raise TypeError("The provided path must be a str or Path object")
+
+    work_dir = Path(work_dir)
+    loop = asyncio.get_running_loop()
+
+    pollution_dir = work_dir / "pollution_data"
+    restructured_dir = work_dir / "pollution_data_restructured"
+    by_gas_dir = restructured_dir / "by_gas"
+    figures_dir = restructured_dir / "figures"
+
+    def prepare() -> DirectoryIndex:
+        """Create the directories, walk the pollution_data tree and display it."""
+        # Check that work_dir exists
+        if not work_dir.exists() or not work_dir.is_dir():
+            raise NotADirectoryError(
+                "Work directory must be an existing directory")
+        pollution_dir.mkdir(parents=True, exist_ok=True)
+        by_gas_dir.mkdir(parents=True, exist_ok=True)
+        figures_dir.mkdir(parents=True, exist_ok=True)
+
+        index = scan_directory(pollution_dir)
+        display_diagnostics(pollution_dir, get_diagnostics(pollution_dir, index=index))
+        display_directory_tree(pollution_dir, maxfiles=3, index=index)
+        return index
+
+    index = await loop.run_in_executor(executor, prepare)
+
+    manifest_path = restructured_dir / "manifest.json" if incremental else None
+    results = await restructure_pollution_data_async(
+        pollution_dir, by_gas_dir, index=index, manifest_path=manifest_path, validate=validate, placement=placement,
+        cache_dir=restructured_dir, executor=executor, semaphore=semaphore,
+        max_concurrent_copies=max_concurrent_copies)
+    _check_results(results, by_gas_dir)
+
+    changed_gases = _changed_gases(results) if incremental else None
+    from analytic_tools.plotting import plot_pollution_data
+
+    await loop.run_in_executor(executor, partial(
+        plot_pollution_data, by_gas_dir, figures_dir, gases=changed_gases, workers=plot_workers,
+        cache_dir=restructured_dir))
+
+
+async def analyze_many_async(
+    work_dirs: Iterable[str | Path],
+    max_workers: int = 8,
+    max_concurrent_copies: int = 8,
+    copies_per_dir: int = 2,
+    **kwargs,
+) -> Dict[Path, BaseException | None]:
+    """Run analyze_pollution_data_async on several work directories at the same time.
+        All of them share one thread pool of max_workers threads and one semaphore of max_concurrent_copies copies.
+        Each work directory has at most copies_per_dir copies waiting for the semaphore, which is served
+        first come first served, so the copies of the different work directories are interleaved
+        instead of a large directory holding up the others.
+
+    Parameters:
+        - work_dirs (Iterable[str | Path]) : Absolute paths to the working directories
+        - max_workers (int) : Number of threads running the filesystem work of all the work directories
+        - max_concurrent_copies (int) : Total number of copies in flight at the same time
+        - copies_per_dir (int) : Number of copies of each work directory in flight at the same time
+        - **kwargs : other keyword arguments passed to `analyze_pollution_data_async`
+
+    Returns:
+        - (Dict[Path, BaseException | None]) : the exception raised for each work directory, None if it succeeded
+    """
+    validate_workers(max_workers)
+    validate_workers(max_concurrent_copies)
+    work_dirs = [Path(work_dir) for work_dir in work_dirs]
+    semaphore = asyncio.Semaphore(max_concurrent_copies)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        outcomes = await asyncio.gather(
+            *(analyze_pollution_data_async(work_dir, executor=executor, semaphore=semaphore,
+                                           max_concurrent_copies=copies_per_dir, **kwargs)
+              for work_dir in work_dirs),
+            return_exceptions=True,
+        )
+    return dict(zip(work_dirs, outcomes))
+
+
+def expand_work_dirs(patterns: Iterable[str | Path]) -> List[Path]:
+    """Expand the glob patterns in patterns (e.g. regions/*) into the existing directories they match.
+        Paths without wildcards are kept as they are, so that missing directories are reported later.
+
+    Parameters:
+        - patterns (Iterable[str | Path]) : paths or glob patterns of work directories
+
+    Returns:
+        - work_dirs (List[pathlib.Path]) : the work directories, without duplicates, in the order of patterns
+    """
+    work_dirs = []
+    for pattern in patterns:
+        if glob.has_magic(str(pattern)):
+            matches = sorted(Path(match) for match in glob.glob(str(pattern)) if os.path.isdir(match))
+        else:
+            matches = [Path(pattern)]
+        work_dirs.extend(match for match in matches if match not in work_dirs)
+    return work_dirs
+
+
+def _init_batch_worker() -> None:
+    """Import the heavy dependencies once when a batch worker process starts, instead of once per work directory."""
+    import analytic_tools.plotting  # noqa: F401
+
+
+def _analyze_one(work_dir: Path, verbose: bool, kwargs: Dict, collect_metrics: bool, profile: str | None) -> Dict:
+    """Run analyze_pollution_data on one work directory of a batch and report its duration and error, if any,
+        and its metrics if collect_metrics is True or profile is set.
+    """
+    result = {"work_dir": str(work_dir), "seconds": 0.0, "error": None}
+    metrics = Metrics(profile=profile) if collect_metrics or profile is not None else None
+    start = time.perf_counter()
+    try:
+        # The diagnostics of many work directories printed at the same time would be unreadable
+        with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            analyze_pollution_data(work_dir, metrics=metrics, **kwargs)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    if metrics is not None:
+        result["metrics"] = metrics.to_dict()
+        if profile == "cprofile":
+            metrics.dump_profile(work_dir / "profile.pstats")
+    return result
+
+
+def analyze_batch(
+    work_dirs: Iterable[str | Path],
+    processes: int = 1,
+    summary_path: str | Path | None = None,
+    verbose: bool = False,
+    collect_metrics: bool = False,
+    profile: str | None = None,
+    **kwargs,
+) -> Dict:
+    """Run analyze_pollution_data on many work directories, spread over a pool of processes.
+        A failing work directory does not stop the others, its error is reported in the summary.
+
+    Parameters:
+        - work_dirs (Iterable[str | Path]) : paths or glob patterns of the work directories, see `expand_work_dirs`
+        - processes (int) : Number of processes analyzing work directories at the same time, default to one
+        - summary_path (str or pathlib.Path or None) : Absolute path to a JSON file to write the summary to
+        - verbose (bool) : If True, the diagnostics and directory trees are printed, default to False
+        - collect_metrics (bool) : If True, the metrics of each work directory (see `Metrics.to_dict`) are added to its result
+        - profile (str or None) : Profiling mode of the metrics, see `Metrics`. With "cprofile", the statistics of each
+                                  work directory are written to profile.pstats in it.
+        - **kwargs : other keyword arguments passed to `analyze_pollution_data`
+
+    Returns:
+        - summary (Dict) : a dictionary with following keys: work directories, failed, seconds (total wall time)
+                           and results (one dictionary per work directory with keys work_dir, seconds, error
+                           and metrics if collected)
+    """
+    validate_workers(processes)
+    work_dirs = expand_work_dirs(work_dirs)
+    start = time.perf_counter()
+
+    if processes == 1 or len(work_dirs) <= 1:
+        results = [_analyze_one(work_dir, verbose, kwargs, collect_metrics, profile) for work_dir in work_dirs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(work_dirs)), initializer=_init_batch_worker) as executor:
+            n = len(work_dirs)
+            results = list(executor.map(_analyze_one, work_dirs, [verbose] * n, [kwargs] * n,
+                                        [collect_metrics] * n, [profile] * n))
+
+    summary = {
+        "work directories": len(results),
+        "failed": sum(result["error"] is not None for result in results),
+        "seconds": time.perf_counter() - start,
+        "results": results,
+    }
+    if summary_path is not None:
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def _scratch_parent() -> str | None:
+    """First directory of SCRATCH_DIRS this process can create directories in, None for the default of tempfile."""
+    for candidate in SCRATCH_DIRS:
+        if os.path.isdir(candidate) and os.access(candidate, os.W_OK | os.X_OK):
+            return candidate
+    return None
+
+
+def _publish_figures(src_dir: Path, dest_dir: Path, fmt: str) -> List[Path]:
+    """Copy the figures of src_dir to a staging directory next to dest_dir, on the same filesystem, and move them
+        into dest_dir with atomic renames: a new dest_dir appears with all its figures at once, and each figure of
+        an existing dest_dir is replaced at once. The figures of gasses which are no longer drawn are removed.
+    """
+    staging = Path(tempfile.mkdtemp(prefix=f".{dest_dir.name}-", dir=dest_dir.parent))
+    try:
+        names = sorted(figpath.name for figpath in src_dir.glob(f"gas_*.{fmt}"))
+        for name in names:
+            copy_file(src_dir / name, staging / name)
+        try:
+            os.rename(staging, dest_dir)
+            return [dest_dir / name for name in names]
+        except OSError:
+            # dest_dir already exists
+            pass
+        for name in names:
+            os.replace(staging / name, dest_dir / name)
+        for figpath in dest_dir.glob(f"gas_*.{fmt}"):
+            if figpath.name not in names:
+                figpath.unlink()
+        return [dest_dir / name for name in names]
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def analyze_pollution_data_tmp(
+    work_dir: str | Path,
+    plot_workers: int = 1,
+    fmt: str = "png",
+    scratch_dir: str | Path | None = None,
+) -> None:
     """Do the restructuring of the pollution_data in a temporary directory and create the figures
        showing emissions of each gas as function of all the corresponding
        sources. The new figures are saved in a real directory under work_dir.
 
+       The temporary directory is created in a memory-backed location (see SCRATCH_DIRS) when one is available,
+       and the source files are placed in it as symbolic links, so that restructuring writes nothing to disk.
+       Only the figures are written under work_dir.
+
     Parameters:
         - work_dir (str or pathlib.Path) : Absolute path to the working directory that
                                     contains the pollution_data directory and where the figures will be saved
+        - plot_workers (int) : Number of processes drawing the plots, default to one
+        - fmt (str) : File format of the figures, see `plot_pollution_data`
+        - scratch_dir (str or pathlib.Path or None) : Absolute path to the directory to create the temporary directory
+                                    in, the first usable directory of SCRATCH_DIRS (or the default of tempfile) if None
 
     Returns:
     None
 
     Pseudocode:
-    - Create a temporary directory and copy pollution_data directory to it
+    - Create a temporary directory and link pollution_data files into it
     - Perform the same operations as in analyze_pollution_data
-    - Copy (or directly save) the figures to a directory named `figures` under the original working directory pointed to by `work_dir`
+    - Move the figures atomically to a directory named `figures` under the original working directory pointed to by `work_dir`
     """
 
-    # NOTE: This is a bonus task, if you are skipping it, remove `raise NotImplementedError()`
-    # in the function body
-    ...
+    # Check that work_dir is a path-like object
+    if not isinstance(work_dir, (str, Path)):
+        raise TypeError("The provided path must be a str or Path object")
+
+    work_dir = Path(work_dir)
+    pollution_dir = work_dir / "pollution_data"
+
+    # Check that work_dir and pollution_data exist
+    if not work_dir.is_dir():
+        raise NotADirectoryError("Work directory must be an existing directory")
+    if not pollution_dir.is_dir():
+        raise NotADirectoryError(f"Expected an existing directory, but received {pollution_dir}")
+
+    if scratch_dir is None:
+        scratch_dir = _scratch_parent()
+    with tempfile.TemporaryDirectory(prefix="pollution_data_", dir=scratch_dir) as tmp_dir:
+        by_gas_dir = Path(tmp_dir) / "by_gas"
+        figures_dir = Path(tmp_dir) / "figures"
+        by_gas_dir.mkdir()
+        figures_dir.mkdir()
+
+        # Walk the pollution_data tree once and display it
+        index = scan_directory(pollution_dir)
+        display_diagnostics(pollution_dir, get_diagnostics(pollution_dir, index=index))
+        display_directory_tree(pollution_dir, maxfiles=3, index=index)
+
+        # Link the original gas files into the temporary directory instead of copying them
+        results = restructure_pollution_data(pollution_dir, by_gas_dir, index=index, placement="symlink")
+        _check_results(results, by_gas_dir)
+
+        # Draw every figure in the temporary directory, then publish them under work_dir
+        from analytic_tools.plotting import plot_pollution_data
+
+        plot_pollution_data(by_gas_dir, figures_dir, workers=plot_workers, fmt=fmt)
+        _publish_figures(figures_dir, work_dir / "figures", fmt)
+
+
+def main(argv: List[str] | None = None) -> int:
+    """Command-line entry point: analyze one or many work directories.
+
+    Parameters:
+        - argv (List[str] or None) : command-line arguments, sys.argv[1:] if None
+
+    Returns:
+        - (int) : exit status, 1 if any work directory failed
+    """
+    parser = argparse.ArgumentParser(
+        description="Restructure the pollution_data directory of one or many work directories and plot the emissions.")
+    parser.add_argument("work_dirs", nargs="*", default=[str(Path(__file__).parent)],
+                        help="work directories containing pollution_data, or glob patterns of them "
+                             "(default: the directory of this script)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                        help="stages to run (default: all of them)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only display the files which would be copied or removed and the figures which would be drawn")
+    parser.add_argument("--full", action="store_true",
+                        help="copy every file and redraw every figure instead of only the changed ones")
+    parser.add_argument("--validate", action="store_true", help="parse and validate the files while copying them")
+    parser.add_argument("--gas-registry",
+                        help="JSON file registering more gasses (formula, label, unit), see analytic_tools.gases")
+    parser.add_argument("--formats", nargs="+", choices=sorted(BUILTIN_FORMATS),
+                        help="formats of the source files to restructure, by priority when a gas of a source is "
+                             "given in several formats (default: csv)")
+    parser.add_argument("--placement", default="copy", choices=PLACEMENT_MODES,
+                        help="how the files are placed in by_gas: copied, hard linked, cloned or symbolically linked")
+    parser.add_argument("--dedup", action="store_true",
+                        help="report the identical source files and store their copies once, as hard links")
+    parser.add_argument("--persistent-index", action="store_true",
+                        help="keep an index of pollution_data in the work directory and only list the directories "
+                             "modified since the previous run")
+    parser.add_argument("--fsync", default="none", choices=FSYNC_POLICIES,
+                        help="flush the restructured files to the disk: never, by batches, or each file")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="number of processes analyzing work directories at the same time")
+    parser.add_argument("--workers", type=int, default=1, help="number of threads copying files")
+    parser.add_argument("--plot-workers", type=int, default=1, help="number of processes drawing plots")
+    parser.add_argument("--format", default="png", choices=["png", "svg", "pdf"], help="file format of the figures")
+    parser.add_argument("--figsize", type=float, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="size of the figures in inches (default: 10 8)")
+    parser.add_argument("--dpi", type=int, help="resolution of the figures in dots per inch (default: 200, 72 for a preview)")
+    parser.add_argument("--preview", action="store_true",
+                        help="draw cheaper preview figures: plain text labels and fast .png compression")
+    parser.add_argument("--summary", help="JSON file to write the summary of timings and failures to")
+    parser.add_argument("--metrics", action="store_true",
+                        help="time each stage and count the files and bytes copied, reported in the summary")
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"],
+                        help="profile the stages, cprofile writes profile.pstats in each work directory")
+    parser.add_argument("--verbose", action="store_true", help="print the diagnostics of every work directory")
+    args = parser.parse_args(argv)
+
+    if args.gas_registry:
+        # Fail early on an invalid registry; the worker processes load it from the environment
+        set_registry(load_registry(args.gas_registry))
+        os.environ[GAS_REGISTRY_ENV] = str(Path(args.gas_registry).resolve())
+    if args.formats:
+        set_formats(parse_formats(args.formats))
+        os.environ[SOURCE_FORMATS_ENV] = ",".join(args.formats)
+
+    summary = analyze_batch(
+        args.work_dirs, processes=args.processes, summary_path=args.summary,
+        verbose=args.verbose or args.dry_run or len(args.work_dirs) == 1,
+        collect_metrics=args.metrics, profile=args.profile,
+        workers=args.workers, plot_workers=args.plot_workers, stages=args.stages, dry_run=args.dry_run,
+        incremental=not args.full, validate=args.validate, fmt=args.format, placement=args.placement,
+        figsize=tuple(args.figsize) if args.figsize else None, dpi=args.dpi, preview=args.preview, dedup=args.dedup,
+        persistent_index=args.persistent_index, fsync=args.fsync)
+
+    for result in summary["results"]:
+        status = "failed: " + result["error"] if result["error"] else "done"
+        print(f"{result['work_dir']}: {status} ({result['seconds']:.2f} s)")
+        for stage, seconds in result.get("metrics", {}).get("stages", {}).items():
+            print(f"    {stage:<16}{seconds:8.3f} s")
+        for figure, seconds in result.get("metrics", {}).get("samples", {}).get("render seconds", {}).items():
+            print(f"    {figure:<16}{seconds:8.3f} s")
+    print(f"{summary['work directories']} work directories, {summary['failed']} failed, {summary['seconds']:.2f} s")
+    return 1 if summary["failed"] else 0
 
 
 if __name__ == "__main__":
-    # Create a variable holding the path to your working directory
-    work_dir = "C:/Users/crist/OneDrive/Desktop/IN3110/IN3110-cristila/assignment2"
-    # Make a call to analyze_pollution_data
-    analyze_pollution_data(work_dir)
+    sys.exit(main())
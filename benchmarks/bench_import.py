@@ -0,0 +1,89 @@
+"""Import-time benchmark of analyze_pollution_data, guarding the fast startup of diagnostics and restructure-only runs.
+
+Run it from the repository root, for instance:
+
+    python benchmarks/bench_import.py --repeat 5 --output import.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+# Directory containing analyze_pollution_data.py
+REPO_ROOT = Path(__file__).parents[1].resolve()
+# Modules which must only be imported when plotting or loading the data numerically
+HEAVY_MODULES = ("matplotlib", "numpy")
+# Modules measured by default
+DEFAULT_MODULES = ("analyze_pollution_data", "analytic_tools.plotting")
+
+
+def measure_import(module: str) -> Dict:
+    """Import module in a fresh interpreter with -X importtime and measure its cumulative import time.
+
+    Parameters:
+        - module (str) : Name of the module to import
+
+    Returns:
+        - (Dict) : a dictionary with following keys: module, seconds (cumulative import time of the module),
+                   heavy modules (the modules of HEAVY_MODULES imported along with it)
+    """
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+
+    # Each stderr line reads "import time: self [us] | cumulative | imported package"
+    seconds = 0.0
+    for line in process.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            seconds = int(fields[1]) / 1e6
+    heavy = process.stdout.strip()
+    return {"module": module, "seconds": seconds, "heavy modules": heavy.split(",") if heavy else []}
+
+
+def run_benchmark(modules: List[str] = DEFAULT_MODULES, repeat: int = 5) -> List[Dict]:
+    """Measure the import time of each module repeat times.
+
+    Parameters:
+        - modules (List[str]) : Names of the modules to import
+        - repeat (int) : Number of fresh interpreters per module, the median time is reported
+
+    Returns:
+        - (List[Dict]) : for each module, the dictionary of measure_import with the median seconds over the repeats
+    """
+    reports = []
+    for module in modules:
+        runs = [measure_import(module) for _ in range(repeat)]
+        report = runs[0]
+        report["seconds"] = statistics.median(run["seconds"] for run in runs)
+        reports.append(report)
+    return reports
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the import time of analyze_pollution_data.")
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_MODULES), help="modules to import")
+    parser.add_argument("--repeat", type=int, default=5, help="number of imports per module")
+    parser.add_argument("--output", help="JSON file to write the reports to")
+    args = parser.parse_args(argv)
+
+    reports = run_benchmark(args.modules, repeat=args.repeat)
+    for report in reports:
+        heavy = ", ".join(report["heavy modules"]) or "none"
+        print(f"{report['module']:<28}{report['seconds'] * 1000:9.1f} ms   heavy modules: {heavy}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+    # A heavy module imported by the main script is a regression
+    main_report = next((r for r in reports if r["module"] == "analyze_pollution_data"), None)
+    return 1 if main_report is not None and main_report["heavy modules"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Benchmark suite for the stages of analyze_pollution_data on synthetic pollution_data trees.
+
+Run it from the repository root, for instance:
+
+    python benchmarks/bench_pipeline.py --files 1000 10000 100000 --output bench.json
+
+By default the number of src_* directories grows with the number of files, as in the real data, so that the number
+of original files copied by the restructure stage grows as well; --gases sets the number of figures drawn.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+# Make analyze_pollution_data importable when running this file as a script
+sys.path.insert(0, str(Path(__file__).parents[1].resolve()))
+
+from analyze_pollution_data import restructure_pollution_data  # noqa: E402
+from analytic_tools.gases import Gas, GasRegistry, get_registry, set_registry  # noqa: E402
+from analytic_tools.plotting import plot_pollution_data  # noqa: E402
+from analytic_tools.utilities import display_directory_tree, get_diagnostics  # noqa: E402
+
+# Gasses present in the real pollution_data
+DEFAULT_GASES = ("CO2", "CH4", "N2O")
+# Number of files in each src_* directory of the real pollution_data, used to scale the number of sources
+FILES_PER_SOURCE = 37
+# Header line of the original gas .csv files
+CSV_HEADER = 'aar,"Utslipp til luft (1 000 tonn CO2-ekvivalenter, AR5)"\n'
+
+
+def _random_tag(rng: random.Random, length: int = 3) -> str:
+    return "".join(rng.choices(string.ascii_letters, k=length))
+
+
+def generate_synthetic_tree(
+    work_dir: str | Path,
+    n_files: int,
+    years: Tuple[int, int] = (1990, 2022),
+    gases: Tuple[str, ...] = DEFAULT_GASES,
+    n_sources: int = 5,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """Create work_dir/pollution_data/by_src with the layout of the real data: src_* directories holding
+        one original [gas].csv per gas, plus decoys [gas]_xxx.csv (empty), [gas]_NNN.npy and xxxxx_NNNN.txt (empty).
+
+    Parameters:
+        - work_dir (str or pathlib.Path) : Absolute path to the work directory to create pollution_data in
+        - n_files (int) : Total number of files to create
+        - years (Tuple[int, int]) : First and last year of the emissions in the original .csv files
+        - gases (Tuple[str, ...]) : Gas formulas to create files for
+        - n_sources (int) : Number of src_* directories, the files are spread evenly over them
+        - seed (int) : Seed of the random generator, the same seed gives the same tree
+
+    Returns:
+        - counts (Dict[str, int]) : a dictionary with following keys: files, sources, original files, bytes
+    """
+    rng = random.Random(seed)
+    by_src = Path(work_dir) / "pollution_data" / "by_src"
+    by_src.mkdir(parents=True, exist_ok=True)
+    year_axis = np.arange(years[0], years[1] + 1)
+
+    files_per_source = -(-n_files // n_sources)
+    counts = {"files": 0, "sources": n_sources, "original files": 0, "bytes": 0}
+    for i in range(n_sources):
+        source_dir = by_src / f"src_synthetic_{i:03d}"
+        source_dir.mkdir(exist_ok=True)
+        in_source = max(0, min(files_per_source, n_files - counts["files"]))
+        for j in range(in_source):
+            gas = gases[j % len(gases)]
+            kind = j // len(gases)
+            if kind == 0:
+                # Original gas file
+                values = np.column_stack([year_axis, rng.randint(1, 5000) + np.arange(len(year_axis))])
+                content = CSV_HEADER + "".join(f"{year},{value}\n" for year, value in values)
+                (source_dir / f"{gas}.csv").write_text(content)
+                counts["original files"] += 1
+                counts["bytes"] += len(content)
+            elif kind % 3 == 1:
+                (source_dir / f"{gas}_{_random_tag(rng)}_{j}.csv").touch()
+            elif kind % 3 == 2:
+                np.save(source_dir / f"{gas}_{j}.npy", np.column_stack([year_axis, year_axis]).astype(float))
+            else:
+                (source_dir / f"{_random_tag(rng, 5)}_{j}.txt").touch()
+            counts["files"] += 1
+    return counts
+
+
+def synthetic_gases(n_gases: int) -> Tuple[str, ...]:
+    """Return n_gases gas formulas: the gasses of the real data first, then synthetic formulas G0001, G0002, ..."""
+    if n_gases < 1:
+        raise ValueError(f"Expected a positive number of gasses, but received {n_gases}")
+    extra = tuple(f"G{i:04d}" for i in range(1, n_gases - len(DEFAULT_GASES) + 1))
+    return (DEFAULT_GASES + extra)[:n_gases]
+
+
+def scaled_sources(n_files: int) -> int:
+    """Number of src_* directories of a synthetic tree of n_files files, with FILES_PER_SOURCE files each."""
+    return max(1, round(n_files / FILES_PER_SOURCE))
+
+
+def measure(function: Callable, *args, trace_memory: bool = True, **kwargs) -> Tuple[object, Dict[str, float]]:
+    """Call function(*args, **kwargs) and measure its wall time and peak Python memory use.
+
+    Parameters:
+        - function (Callable) : function to measure
+        - trace_memory (bool) : If True, the peak memory is measured with tracemalloc, which slows the call down
+
+    Returns:
+        - result : the value returned by function
+        - (Dict[str, float]) : a dictionary with following keys: seconds, peak MB (0 if trace_memory is False)
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        peak = 0
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result, {"seconds": seconds, "peak MB": peak / 2**20}
+
+
+def _rate(amount: float, seconds: float) -> float:
+    return amount / seconds if seconds > 0 else float("inf")
+
+
+def run_benchmark(
+    work_dir: str | Path,
+    n_files: int,
+    years: Tuple[int, int] = (1990, 2022),
+    workers: int = 1,
+    plot_workers: int = 1,
+    trace_memory: bool = True,
+    n_sources: int | None = None,
+    n_gases: int = len(DEFAULT_GASES),
+) -> Dict:
+    """Generate a synthetic tree of n_files files in work_dir and time each stage of analyze_pollution_data on it.
+
+    Parameters:
+        - work_dir (str or pathlib.Path) : Absolute path to an empty work directory
+        - n_files (int) : Number of files of the synthetic tree
+        - years (Tuple[int, int]) : First and last year of the emissions
+        - workers (int) : Number of threads copying files
+        - plot_workers (int) : Number of processes drawing plots
+        - trace_memory (bool) : If True, the peak memory of each stage is measured
+        - n_sources (int or None) : Number of src_* directories, see scaled_sources if None
+        - n_gases (int) : Number of gasses, hence of figures, see synthetic_gases. The synthetic gasses are
+                          registered in the gas registry for the duration of the run.
+
+    Returns:
+        - (Dict) : the size of the tree and, for each stage, its seconds, peak MB and throughput
+    """
+    registry = get_registry()
+    gases = synthetic_gases(n_gases)
+    set_registry(GasRegistry([*registry, *(Gas(gas, gas) for gas in gases if gas not in registry)]))
+    try:
+        return _run_stages(Path(work_dir), n_files, years, workers, plot_workers, trace_memory,
+                           n_sources or scaled_sources(n_files), gases)
+    finally:
+        set_registry(registry)
+
+
+def _run_stages(
+    work_dir: Path,
+    n_files: int,
+    years: Tuple[int, int],
+    workers: int,
+    plot_workers: int,
+    trace_memory: bool,
+    n_sources: int,
+    gases: Tuple[str, ...],
+) -> Dict:
+    """Body of run_benchmark, with the gasses registered."""
+    counts = generate_synthetic_tree(work_dir, n_files, years=years, gases=gases, n_sources=n_sources)
+    pollution_dir = work_dir / "pollution_data"
+    by_gas_dir = work_dir / "pollution_data_restructured" / "by_gas"
+    figures_dir = work_dir / "pollution_data_restructured" / "figures"
+    by_gas_dir.mkdir(parents=True)
+    figures_dir.mkdir()
+
+    report = {"files": counts["files"], "sources": counts["sources"], "gases": len(gases),
+              "original files": counts["original files"], "years": list(years), "stages": {}}
+    stages = report["stages"]
+
+    _, stages["get_diagnostics"] = measure(get_diagnostics, pollution_dir, trace_memory=trace_memory)
+    stages["get_diagnostics"]["files/s"] = _rate(counts["files"], stages["get_diagnostics"]["seconds"])
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        _, stages["display_directory_tree"] = measure(
+            display_directory_tree, pollution_dir, trace_memory=trace_memory)
+    stages["display_directory_tree"]["files/s"] = _rate(counts["files"], stages["display_directory_tree"]["seconds"])
+
+    results, stages["restructure_pollution_data"] = measure(
+        restructure_pollution_data, pollution_dir, by_gas_dir, workers=workers, trace_memory=trace_memory)
+    copied = sum(result["bytes"] for result in results)
+    # The whole tree is scanned to find the few original files to copy
+    stages["restructure_pollution_data"]["files/s"] = _rate(counts["files"], stages["restructure_pollution_data"]["seconds"])
+    stages["restructure_pollution_data"]["copied files"] = len(results)
+    stages["restructure_pollution_data"]["MB/s"] = _rate(copied / 2**20, stages["restructure_pollution_data"]["seconds"])
+
+    figpaths, stages["plot_pollution_data"] = measure(
+        plot_pollution_data, by_gas_dir, figures_dir, workers=plot_workers, trace_memory=trace_memory)
+    stages["plot_pollution_data"]["figures"] = len(figpaths)
+    stages["plot_pollution_data"]["figures/s"] = _rate(len(figpaths), stages["plot_pollution_data"]["seconds"])
+
+    return report
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the stages of analyze_pollution_data on synthetic trees.")
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000],
+                        help="sizes of the synthetic trees, in number of files")
+    parser.add_argument("--years", type=int, nargs=2, default=[1990, 2022], help="first and last year of the data")
+    parser.add_argument("--sources", type=int,
+                        help=f"number of src_* directories (default: one per {FILES_PER_SOURCE} files)")
+    parser.add_argument("--gases", type=int, default=len(DEFAULT_GASES),
+                        help="number of gasses, hence of figures drawn (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1, help="number of threads copying files")
+    parser.add_argument("--plot-workers", type=int, default=1, help="number of processes drawing plots")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure the peak memory (faster)")
+    parser.add_argument("--output", help="JSON file to write the reports to")
+    args = parser.parse_args(argv)
+
+    reports = []
+    for n_files in args.files:
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = run_benchmark(work_dir, n_files, years=tuple(args.years), workers=args.workers,
+                                   plot_workers=args.plot_workers, trace_memory=not args.no_memory,
+                                   n_sources=args.sources, n_gases=args.gases)
+        reports.append(report)
+        print(f"{report['files']} files, {report['sources']} sources, {report['gases']} gasses, "
+              f"{report['original files']} original files")
+        for stage, measures in report["stages"].items():
+            rates = ", ".join(f"{value:.1f} {key}" for key, value in measures.items() if "/s" in key)
+            print(f"    {stage:<28}{measures['seconds']:9.3f} s {measures['peak MB']:9.1f} MB peak   {rates}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+""" Test script executing the unit tests for the functions in analytic_tools/analytics.py module
+    which is a part of the analytic_tools package
+"""
+import csv
+from pathlib import Path
+
+import numpy as np
+
+from analyze_pollution_data import restructure_pollution_data
+from analytic_tools.analytics import summarize, write_summary_csv
+from analytic_tools.dataset import build_emissions, load_emissions
+
+
+def test_summarize():
+    """Test the statistics of summarize on a small dataset with missing years
+
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+    data = build_emissions([
+        ("src_a", "CO2", np.array([[2000, 10.0], [2001, 30.0], [2002, 0.0]])),
+        ("src_b", "CO2", np.array([[2000, 30.0], [2001, 10.0]])),
+        ("src_a", "CH4", np.array([[2001, 5.0], [2002, 10.0]])),
+    ])
+
+    summary = summarize(data, factors={"CH4": 2.0})
+
+    nan = np.nan
+    assert summary.gases == ["CH4", "CO2"] and summary.sources == ["src_a", "src_b"]
+    np.testing.assert_array_equal(summary.totals, [[nan, 40.0], [5.0, 40.0], [10.0, 0.0]])
+    np.testing.assert_array_equal(summary.shares[:, :, 1], [[0.25, 0.75], [0.75, 0.25], [nan, nan]])
+    np.testing.assert_array_equal(summary.deltas, [[nan, nan], [nan, 0.0], [5.0, -40.0]])
+    np.testing.assert_array_equal(summary.relative_deltas, [[nan, nan], [nan, 0.0], [1.0, -1.0]])
+    np.testing.assert_array_equal(summary.co2_equivalents, [40.0, 50.0, 20.0])
+
+
+def test_write_summary_csv(tmp_workdir: Path):
+    """Test that the summary of the restructured data is written as one row per year and gas
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    by_gas = tmp_workdir / "by_gas"
+    by_gas.mkdir()
+    restructure_pollution_data(tmp_workdir / "pollution_data", by_gas)
+    data = load_emissions(by_gas)
+    summary = summarize(data)
+
+    write_summary_csv(summary, tmp_workdir / "summary.csv")
+
+    with open(tmp_workdir / "summary.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == np.count_nonzero(~np.isnan(summary.totals))
+    shares = [float(rows[0][f"share {source}"] or 0) for source in data.sources]
+    assert abs(sum(shares) - 1) < 1e-9, "The shares of the sources must add up to one"
@@ -1,11 +1,19 @@
+import asyncio
+import shutil
 from pathlib import Path
 
+import analyze_pollution_data as analyze_pollution_data_module
 import pytest
 from analyze_pollution_data import (
+    analyze_batch,
+    analyze_many_async,
     analyze_pollution_data,
     analyze_pollution_data_tmp,
+    main,
+    plan_analysis,
     restructure_pollution_data,
 )
+from analytic_tools.instrumentation import Metrics
 
 
 @pytest.mark.task31
@@ -44,6 +52,403 @@ def test_restructure_pollution_data(tmp_workdir: Path):
         ), f"{p} is an invalid subdirectory in pollution_data_restructured/by_gas "
 
 
+def test_restructure_pollution_data_workers(tmp_workdir: Path):
+    """Test that restructuring with a pool of threads gives the same files as the sequential copy
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    sequential = tmp_workdir / "sequential"
+    parallel = tmp_workdir / "parallel"
+    sequential.mkdir()
+    parallel.mkdir()
+
+    results = restructure_pollution_data(pollution_data, sequential)
+    parallel_results = restructure_pollution_data(pollution_data, parallel, workers=4)
+
+    assert all(r["error"] is None for r in results + parallel_results), "Some files failed to be copied"
+    assert len(results) == len(parallel_results) == 15, "Expected 15 original gas files to be copied"
+    for result in results:
+        copied = parallel / result["destination"].relative_to(sequential)
+        assert copied.read_bytes() == result["destination"].read_bytes(), f"{copied} differs"
+
+
+@pytest.mark.parametrize("placement", ["hardlink", "symlink"])
+def test_restructure_pollution_data_placement(tmp_workdir: Path, placement):
+    """Test that linking the files into by_gas gives the same layout as copying them, without copying data
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+        - placement (str): placement mode to restructure with
+    Returns:
+        - None
+    """
+    copied = tmp_workdir / "copied"
+    linked = tmp_workdir / "linked"
+    copied.mkdir()
+    linked.mkdir()
+
+    restructure_pollution_data(tmp_workdir / "pollution_data", copied)
+    results = restructure_pollution_data(tmp_workdir / "pollution_data", linked, placement=placement, validate=True)
+
+    assert all(r["status"] == "copied" and r["bytes"] == 0 for r in results), "Expected every file linked"
+    names = sorted(p.relative_to(copied) for p in copied.glob("*/*.csv"))
+    assert names == sorted(p.relative_to(linked) for p in linked.glob("*/*.csv")), "The layouts differ"
+    for name in names:
+        assert (linked / name).read_bytes() == (copied / name).read_bytes(), f"{name} has the wrong contents"
+
+
+def test_restructure_pollution_data_dedup(tmp_workdir: Path):
+    """Test that the copies of identical source files are stored once, as hard links to the first copy
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    by_src = tmp_workdir / "pollution_data" / "by_src"
+    shutil.copytree(by_src / "src_agriculture", by_src / "src_agriculture_copy")
+    dest = tmp_workdir / "by_gas"
+    dest.mkdir()
+
+    results = restructure_pollution_data(tmp_workdir / "pollution_data", dest, dedup=True, validate=True)
+
+    destinations = {r["source"]: r["destination"] for r in results}
+    duplicates = [r for r in results if r.get("duplicate of") is not None]
+    assert len(duplicates) == 3, "Expected the three files of one of the two identical sources to be duplicates"
+    for result in duplicates:
+        assert result["status"] == "copied" and result["bytes"] == 0
+        assert result["source"].read_bytes() == result["duplicate of"].read_bytes()
+        assert result["destination"].samefile(destinations[result["duplicate of"]]), "A duplicate must be stored once"
+    assert len(results) == 18 and all(r["error"] is None for r in results)
+
+
+def test_restructure_pollution_data_fsync(tmp_workdir: Path):
+    """Test that the batched copies are all in place when restructuring returns, and that the temporary files
+        of an interrupted run are removed
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    dest = tmp_workdir / "by_gas"
+    (dest / "gas_CO2").mkdir(parents=True)
+    leftover = dest / "gas_CO2" / ".agriculture_CO2.csv.0123456789ab.tmp"
+    leftover.write_bytes(b"1990,")
+
+    results = restructure_pollution_data(tmp_workdir / "pollution_data", dest, fsync="batch",
+                                         manifest_path=tmp_workdir / "manifest.json")
+
+    assert len(results) == 15 and all(r["status"] == "copied" for r in results)
+    assert all(r["destination"].read_bytes() == r["source"].read_bytes() for r in results)
+    assert not leftover.exists() and not list(dest.glob("*/.*")), "No temporary file must be left"
+    assert (tmp_workdir / "manifest.json").exists()
+
+
+def test_restructure_pollution_data_incremental(tmp_workdir: Path):
+    """Test that restructuring with a manifest only copies new or changed files and removes stale copies
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True)
+    manifest = tmp_workdir / "pollution_data_restructured" / "manifest.json"
+
+    first = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest)
+    assert [r["status"] for r in first] == ["copied"] * 15, "All files should be copied on the first run"
+
+    second = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest)
+    assert [r["status"] for r in second] == ["unchanged"] * 15, "No file should be copied on the second run"
+
+    # Change one source file and delete another one
+    changed = pollution_data / "by_src" / "src_industry" / "CO2.csv"
+    changed.write_text(changed.read_text() + "2023,1\n")
+    (pollution_data / "by_src" / "src_agriculture" / "N2O.csv").unlink()
+
+    third = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest)
+    statuses = {r["destination"].name: r["status"] for r in third if r["status"] != "unchanged"}
+    assert statuses == {"src_industry_CO2.csv": "copied", "src_agriculture_N2O.csv": "removed"}, \
+        f"Unexpected files processed: {statuses}"
+    assert (by_gas / "gas_CO2" / "src_industry_CO2.csv").read_text() == changed.read_text()
+    assert not (by_gas / "gas_N2O" / "src_agriculture_N2O.csv").exists(), "Stale copy was not removed"
+
+
+def test_restructure_pollution_data_incremental_placement(tmp_workdir: Path):
+    """Test that changing the placement places every file again, even if no source file changed
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "by_gas"
+    by_gas.mkdir()
+    manifest = tmp_workdir / "manifest.json"
+
+    restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest, placement="symlink")
+    results = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest, placement="copy")
+    assert [r["status"] for r in results] == ["copied"] * 15, "Every link should be replaced by a copy"
+    assert not any(r["destination"].is_symlink() for r in results)
+
+    results = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest, placement="copy")
+    assert [r["status"] for r in results] == ["unchanged"] * 15
+
+    # A copy replaced behind the back of the manifest is placed again
+    copy = by_gas / "gas_CO2" / "src_industry_CO2.csv"
+    copy.unlink()
+    copy.symlink_to(pollution_data / "by_src" / "src_industry" / "CO2.csv")
+    results = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest, placement="copy")
+    assert [r["destination"] for r in results if r["status"] == "copied"] == [copy]
+    assert not copy.is_symlink()
+
+
+def test_restructure_pollution_data_incremental_validate(tmp_workdir: Path, monkeypatch):
+    """Test that an incremental restructuring with validation reads each new or changed source file once,
+        and does not write again a source file whose contents did not change
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "by_gas"
+    by_gas.mkdir()
+    manifest = tmp_workdir / "manifest.json"
+    opened = []
+    builtin_open = open
+
+    def spy(file, *args, **kwargs):
+        if pollution_data in Path(file).parents:
+            opened.append(Path(file))
+        return builtin_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", spy)
+    results = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest, validate=True, workers=2)
+    assert [r["status"] for r in results] == ["copied"] * 15
+    assert sorted(opened) == sorted(r["source"] for r in results), "Each source file should be read once"
+
+    # Touch one source file and change another one
+    touched = pollution_data / "by_src" / "src_industry" / "CO2.csv"
+    changed = pollution_data / "by_src" / "src_agriculture" / "CH4.csv"
+    touched.write_bytes(touched.read_bytes())
+    changed.write_text(changed.read_text() + "2023,1\n")
+    opened.clear()
+    results = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest, validate=True)
+    assert sorted(opened) == sorted([touched, changed])
+    statuses = {r["source"]: r["status"] for r in results if r["status"] != "unchanged"}
+    assert statuses == {changed: "copied"}, f"Unexpected files processed: {statuses}"
+
+    # The manifest records the contents hashed by the pipeline, so that nothing is read on the next run
+    opened.clear()
+    results = restructure_pollution_data(pollution_data, by_gas, manifest_path=manifest, validate=True)
+    assert [r["status"] for r in results] == ["unchanged"] * 15
+    assert opened == []
+
+
+def test_restructure_pollution_data_validate(tmp_workdir: Path):
+    """Test that restructuring with validation does not copy malformed files and writes the dataset cache
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    restructured = tmp_workdir / "pollution_data_restructured"
+    by_gas = restructured / "by_gas"
+    by_gas.mkdir(parents=True)
+    (pollution_data / "by_src" / "src_industry" / "CO2.csv").write_text("aar,value\n1990,12\n1991,twelve\n")
+
+    results = restructure_pollution_data(pollution_data, by_gas, validate=True, workers=2, cache_dir=restructured)
+
+    failed = [r for r in results if r["status"] == "failed"]
+    assert len(failed) == 1 and "ValueError" in failed[0]["error"], "The malformed file should fail validation"
+    assert not failed[0]["destination"].exists(), "The malformed file should not be copied"
+    assert sum(r["status"] == "copied" for r in results) == 14, "The other files should be copied"
+    assert all("data" not in r for r in results), "The parsed blocks should not be returned"
+    assert not (restructured / "emissions.npy").exists(), "No cache should be written after a failure"
+
+    (pollution_data / "by_src" / "src_industry" / "CO2.csv").write_text("aar,value\n1990,12\n")
+    results = restructure_pollution_data(pollution_data, by_gas, validate=True, cache_dir=restructured)
+    assert all(r["status"] == "copied" for r in results), "All files should be copied"
+    assert (restructured / "emissions.npy").exists(), "The dataset cache should be written"
+
+
+def test_restructure_pollution_data_validate_memory(tmp_workdir: Path, monkeypatch):
+    """Test that the parsed blocks are only kept while restructuring when the dataset cache is requested
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    kept = []
+    finish_restructure = analyze_pollution_data_module._finish_restructure
+
+    def spy(results, *args):
+        kept.append(sum(r.get("data") is not None for r in results))
+        return finish_restructure(results, *args)
+
+    monkeypatch.setattr(analyze_pollution_data_module, "_finish_restructure", spy)
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "by_gas"
+    by_gas.mkdir()
+
+    restructure_pollution_data(pollution_data, by_gas, validate=True, workers=2)
+    restructure_pollution_data(pollution_data, by_gas, validate=True, cache_dir=tmp_workdir)
+    assert kept == [0, 15], "The parsed blocks should only be kept for the dataset cache"
+
+
+def test_analyze_many_async(tmp_workdir: Path):
+    """Test that analyze_many_async processes several work directories at the same time and reports failures
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    work_dirs = [tmp_workdir / f"tenant_{i}" for i in range(3)]
+    for work_dir in work_dirs:
+        shutil.copytree(tmp_workdir / "pollution_data", work_dir / "pollution_data")
+    missing = tmp_workdir / "missing_tenant"
+
+    outcomes = asyncio.run(analyze_many_async(work_dirs + [missing], max_workers=4, max_concurrent_copies=3))
+
+    assert isinstance(outcomes[missing], NotADirectoryError), "The missing work directory should fail"
+    for work_dir in work_dirs:
+        assert outcomes[work_dir] is None, f"{work_dir} failed with {outcomes[work_dir]}"
+        figures = sorted(p.name for p in (work_dir / "pollution_data_restructured" / "figures").iterdir())
+        assert figures == ["gas_CH4.png", "gas_CO2.png", "gas_N2O.png"], f"Wrong figures in {work_dir}"
+        copies = list((work_dir / "pollution_data_restructured" / "by_gas").rglob("*.csv"))
+        assert len(copies) == 15, f"Expected 15 restructured files in {work_dir}"
+
+
+def test_analyze_batch(tmp_workdir: Path):
+    """Test that analyze_batch expands glob patterns, runs every work directory and writes a summary
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    for region in ["region_a", "region_b"]:
+        shutil.copytree(tmp_workdir / "pollution_data", tmp_workdir / "regions" / region / "pollution_data")
+    (tmp_workdir / "regions" / "region_c").mkdir()
+    # A pollution_data which is a file cannot be analyzed
+    (tmp_workdir / "regions" / "region_c" / "pollution_data").touch()
+    summary_path = tmp_workdir / "summary.json"
+
+    summary = analyze_batch([tmp_workdir / "regions" / "region_*"], processes=2, summary_path=summary_path)
+
+    assert summary["work directories"] == 3, "Expected the glob to match three work directories"
+    assert summary["failed"] == 1, "Expected region_c to fail"
+    errors = {Path(r["work_dir"]).name: r["error"] for r in summary["results"]}
+    assert errors["region_a"] is None and errors["region_b"] is None, f"Unexpected failures: {errors}"
+    assert summary_path.exists(), "The summary was not written"
+    assert (tmp_workdir / "regions" / "region_b" / "pollution_data_restructured" / "figures" / "gas_CO2.png").exists()
+
+
+def test_analyze_pollution_data_metrics(tmp_workdir: Path):
+    """Test that analyze_pollution_data records the time of each stage, the files copied and the figures drawn
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    measures = []
+    metrics = Metrics(callback=measures.append)
+    analyze_pollution_data(tmp_workdir, metrics=metrics)
+
+    report = metrics.to_dict()
+    assert set(report["stages"]) >= {"scan", "diagnostics", "tree", "restructure", "plot"}
+    assert report["counters"]["files copied"] > 0, "Expected the copied files to be counted"
+    assert report["counters"]["bytes copied"] > 0, "Expected the copied bytes to be counted"
+    assert set(report["samples"]["render seconds"]) == {"gas_CO2", "gas_CH4", "gas_N2O"}
+    assert {"stage", "count", "sample"} == {measure["kind"] for measure in measures}
+
+    # Nothing changed, so the second run copies and draws nothing
+    metrics = Metrics()
+    analyze_pollution_data(tmp_workdir, metrics=metrics)
+    assert "files copied" not in metrics.counters and metrics.counters["files unchanged"] > 0
+    assert "render seconds" not in metrics.samples
+
+
+def test_analyze_pollution_data_stages(tmp_workdir: Path):
+    """Test that analyze_pollution_data only runs the selected stages
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    restructured = tmp_workdir / "pollution_data_restructured"
+
+    analyze_pollution_data(tmp_workdir, stages=["diagnose", "tree"])
+    assert not restructured.exists(), "The diagnose and tree stages must not write anything"
+
+    analyze_pollution_data(tmp_workdir, stages=["restructure"])
+    assert (restructured / "by_gas" / "gas_CO2").is_dir(), "The restructure stage did not run"
+    assert not (restructured / "figures").exists(), "The plot stage should not have run"
+
+    analyze_pollution_data(tmp_workdir, stages=["plot"], fmt="svg")
+    assert sorted(p.name for p in (restructured / "figures").iterdir()) == ["gas_CH4.svg", "gas_CO2.svg", "gas_N2O.svg"]
+
+    with pytest.raises(ValueError):
+        analyze_pollution_data(tmp_workdir, stages=["restructure", "upload"])
+
+
+def test_analyze_pollution_data_dry_run(tmp_workdir: Path, capsys):
+    """Test that a dry run writes nothing and reports what the real run then does
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+        - capsys: pytest fixture capturing the standard output
+    Returns:
+        - None
+    """
+    restructured = tmp_workdir / "pollution_data_restructured"
+    plan = plan_analysis(tmp_workdir)
+    assert main([str(tmp_workdir), "--dry-run"]) == 0
+    assert not restructured.exists(), "A dry run must not write anything"
+    assert "Would copy 15 file(s)" in capsys.readouterr().out
+
+    analyze_pollution_data(tmp_workdir)
+    assert sorted(r["destination"] for r in plan["files"]) == sorted((restructured / "by_gas").glob("*/*.csv"))
+    assert sorted(plan["figures"]) == sorted((restructured / "figures").iterdir())
+
+    # After a change of one source, only its file is copied again and its figure redrawn
+    (tmp_workdir / "pollution_data" / "by_src" / "src_oil_and_gass" / "CH4.csv").write_text("aar,value\n2000,1.0\n")
+    plan = plan_analysis(tmp_workdir, stages=["restructure", "plot"])
+    assert [r["source"].parent.name for r in plan["files"] if r["status"] == "copied"] == ["src_oil_and_gass"]
+    assert plan["figures"] == [restructured / "figures" / "gas_CH4.png"]
+
+
+def test_analyze_pollution_data_dry_run_empty(tmp_path: Path, capsys):
+    """Test that a dry run of a work directory without pollution_data reports an empty plan and writes nothing
+
+    Parameters:
+        - tmp_path (pathlib.Path): empty temporary directory
+        - capsys: pytest fixture capturing the standard output
+    Returns:
+        - None
+    """
+    assert plan_analysis(tmp_path) == {"files": [], "figures": []}
+    assert main([str(tmp_path), "--dry-run"]) == 0
+    assert "Would copy 0 file(s)" in capsys.readouterr().out
+    assert list(tmp_path.iterdir()) == [], "A dry run must not write anything"
+
+
 @pytest.mark.task32
 def test_analyze_pollution_data(tmp_workdir: Path):
     """Test analyze_pollution_data function
@@ -144,3 +549,27 @@ def test_analyze_pollution_data_tmp(tmp_workdir: Path):
     for p in actual_figures:
         # Figures must only contain correctly named directories
         assert p in possible_files, f"{p} is an invalid file in figures"
+
+
+def test_analyze_pollution_data_tmp_scratch(tmp_workdir: Path, tmp_path_factory):
+    """Test that analyze_pollution_data_tmp leaves nothing behind in the scratch directory
+    and replaces the figures of a previous run
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+        - tmp_path_factory (pytest.TempPathFactory): factory of the scratch directory
+    Returns:
+        - None
+    """
+    scratch = tmp_path_factory.mktemp("scratch")
+    figures = tmp_workdir / "figures"
+    figures.mkdir()
+    (figures / "gas_SF6.png").write_bytes(b"stale")
+    (figures / "notes.txt").write_text("kept")
+
+    analyze_pollution_data_tmp(tmp_workdir, scratch_dir=scratch)
+
+    assert not list(scratch.iterdir()), "The scratch directory must be removed"
+    assert sorted(p.name for p in figures.iterdir()) == ["gas_CH4.png", "gas_CO2.png", "gas_N2O.png", "notes.txt"]
+    assert not (tmp_workdir / "pollution_data_restructured").exists(), "Nothing but the figures is written to work_dir"
+    assert [p.name for p in tmp_workdir.iterdir() if p.name.startswith(".figures")] == [], "The staging must be removed"
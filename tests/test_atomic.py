@@ -0,0 +1,98 @@
+""" Test script executing the unit tests for the functions in analytic_tools/atomic.py module
+    which is a part of the analytic_tools package
+"""
+from pathlib import Path
+
+import pytest
+
+from analytic_tools import atomic
+from analytic_tools.atomic import AtomicWriter, remove_temp_files, temp_path, write_bytes_atomic
+
+
+@pytest.mark.parametrize("fsync", ["none", "batch", "always"])
+def test_atomic_writer(tmp_path: Path, monkeypatch, fsync):
+    """Test that each policy replaces the destination, and that only the batch policy defers it until flush
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory
+        - fsync (str): the fsync policy
+    Returns:
+        - None
+    """
+    synced = []
+    monkeypatch.setattr(atomic, "_fsync_path", lambda path, directory=False: synced.append((Path(path), directory)))
+    dst = tmp_path / "CO2.csv"
+    dst.write_bytes(b"old")
+
+    with AtomicWriter(fsync) as writer:
+        assert write_bytes_atomic(dst, b"1990,1\n", writer) == 7
+        write_bytes_atomic(tmp_path / "CH4.csv", b"1990,2\n", writer)
+        if fsync == "batch":
+            assert dst.read_bytes() == b"old", "A batched file must only replace its destination when flushed"
+            assert not synced
+    assert dst.read_bytes() == b"1990,1\n"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["CH4.csv", "CO2.csv"]
+
+    directories = [path for path, directory in synced if directory]
+    files = [path for path, directory in synced if not directory]
+    expected = {"none": (0, 0), "batch": (2, 1), "always": (2, 2)}[fsync]
+    assert (len(files), len(directories)) == expected, "Wrong number of flushes for the policy"
+    assert all(directory == tmp_path for directory in directories)
+
+
+def test_atomic_writer_failure(tmp_path: Path):
+    """Test that a failing write keeps the previous destination and leaves no temporary file behind
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory
+    Returns:
+        - None
+    """
+    dst = tmp_path / "CO2.csv"
+    dst.write_bytes(b"old")
+
+    def write(tmp: Path) -> None:
+        tmp.write_bytes(b"partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError, match="disk full"):
+        AtomicWriter().write(dst, write)
+    assert dst.read_bytes() == b"old"
+    assert [path.name for path in tmp_path.iterdir()] == ["CO2.csv"]
+
+    with pytest.raises(ValueError):
+        AtomicWriter("sometimes")
+    with pytest.raises(ValueError):
+        AtomicWriter("batch", batch_size=0)
+
+
+def test_remove_temp_files(tmp_path: Path):
+    """Test that the temporary files left by an interrupted write are removed, and only them
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory
+    Returns:
+        - None
+    """
+    (tmp_path / "CO2.csv").write_bytes(b"1990,1\n")
+    (tmp_path / "notes.tmp").write_bytes(b"not ours")
+    temp_path(tmp_path / "CO2.csv").write_bytes(b"1990,")
+    temp_path(tmp_path / "CH4.csv").write_bytes(b"")
+
+    assert remove_temp_files(tmp_path) == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["CO2.csv", "notes.tmp"]
+
+
+def test_atomic_writer_without_directory_fsync(tmp_path: Path, monkeypatch):
+    """Test that the fsync policies still work where directories cannot be flushed, as on Windows
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory
+    Returns:
+        - None
+    """
+    monkeypatch.delattr(atomic.os, "O_DIRECTORY")
+    for fsync in ("batch", "always"):
+        with AtomicWriter(fsync) as writer:
+            write_bytes_atomic(tmp_path / f"{fsync}.csv", b"1990,1\n", writer)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["always.csv", "batch.csv"]
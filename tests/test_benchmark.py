@@ -0,0 +1,75 @@
+""" Test script checking the synthetic tree generator and a small run of the benchmark suite in benchmarks/
+"""
+from pathlib import Path
+
+from benchmarks.bench_import import run_benchmark as run_import_benchmark
+from benchmarks.bench_pipeline import generate_synthetic_tree, run_benchmark
+from analytic_tools.gases import get_registry
+from analytic_tools.utilities import get_diagnostics
+
+
+def test_generate_synthetic_tree(tmp_path: Path):
+    """Test that the synthetic tree has the requested number of files and the layout of pollution_data
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    counts = generate_synthetic_tree(tmp_path, 100, years=(2000, 2009), n_sources=4)
+
+    res = get_diagnostics(tmp_path / "pollution_data")
+    assert res["files"] == counts["files"] == 100, f"Expected 100 files but got {res['files']}"
+    assert res["subdirectories"] == 5, "Expected by_src and four src_* subdirectories"
+    assert res[".csv files"] > counts["original files"] == 12, "Expected one original file per gas and source"
+    assert res[".npy files"] > 0 and res[".txt files"] > 0, "Expected .npy and .txt decoys"
+    lines = (tmp_path / "pollution_data" / "by_src" / "src_synthetic_000" / "CO2.csv").read_text().splitlines()
+    assert len(lines) == 11 and lines[1].startswith("2000,"), "Wrong year range in an original file"
+
+
+def test_run_benchmark(tmp_path: Path):
+    """Test that a small benchmark run reports every stage with its throughput
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    report = run_benchmark(tmp_path, 60, trace_memory=False)
+
+    assert list(report["stages"]) == ["get_diagnostics", "display_directory_tree",
+                                      "restructure_pollution_data", "plot_pollution_data"]
+    assert report["stages"]["restructure_pollution_data"]["MB/s"] > 0, "No bytes were copied"
+    assert report["stages"]["plot_pollution_data"]["figures/s"] > 0, "No figures were drawn"
+
+
+def test_run_benchmark_scaling(tmp_path: Path):
+    """Test that the number of sources grows with the number of files and that the gasses set the figures drawn
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    report = run_benchmark(tmp_path, 150, trace_memory=False, n_gases=5)
+
+    assert report["sources"] == 4 and report["gases"] == 5
+    assert report["stages"]["restructure_pollution_data"]["copied files"] == report["original files"] == 20
+    assert report["stages"]["plot_pollution_data"]["figures"] == 5
+    assert "G0001" not in get_registry(), "The synthetic gasses should only be registered during the run"
+
+
+def test_import_is_lazy():
+    """Test that importing analyze_pollution_data does not import matplotlib or numpy
+
+    Returns:
+        None
+    """
+    reports = run_import_benchmark(["analyze_pollution_data", "analytic_tools.plotting"], repeat=1)
+
+    assert reports[0]["heavy modules"] == [], f"analyze_pollution_data imported {reports[0]['heavy modules']}"
+    assert reports[1]["heavy modules"] == ["matplotlib", "numpy"], "Expected plotting to import its dependencies"
+    assert all(report["seconds"] > 0 for report in reports), "The import times were not measured"
@@ -0,0 +1,130 @@
+""" Test script executing the unit tests for the functions in analytic_tools/dataset.py module
+    which is a part of the analytic_tools package
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from analyze_pollution_data import restructure_pollution_data
+from analytic_tools.dataset import (
+    load_emissions,
+    parse_emissions,
+    parse_emissions_csv,
+    read_emissions,
+    read_emissions_cache,
+)
+
+
+def test_parse_emissions_csv():
+    """Test that parse_emissions_csv gives the same result as np.loadtxt
+
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+    raw = b'aar,"Utslipp til luft (1 000 tonn CO2-ekvivalenter, AR5)"\n1990,3113\r\n1991,3080.5\n1992,-1\n'
+    data = parse_emissions_csv(raw)
+    assert data.shape == (3, 2), f"Expected a (3, 2) array but got {data.shape}"
+    assert np.array_equal(data, [[1990, 3113], [1991, 3080.5], [1992, -1]]), "Wrong parsed values"
+    assert parse_emissions_csv(b"").shape == (0, 2), "An empty file should give an empty array"
+
+    raw = b"aar,x\n1990,1\n\n  \r\n1991,2\n\n"
+    assert np.array_equal(parse_emissions_csv(raw), [[1990, 1], [1991, 2]]), "Blank lines should be skipped"
+    assert parse_emissions_csv(b"aar,x\n\n\n").shape == (0, 2)
+
+
+@pytest.mark.parametrize(
+    "raw", [b"aar,x\n1990,1\n1991\n", b"aar,x\n1990,one\n", b"aar,x\n1990,1,2\n", b"h\n1990,1,2\n1991\n"])
+def test_parse_emissions_csv_exceptions(raw):
+    """Test that malformed .csv contents raise a ValueError
+
+    Parameters:
+        raw (bytes): malformed .csv contents
+
+    Returns:
+        None
+    """
+    with pytest.raises(ValueError):
+        parse_emissions_csv(raw)
+
+
+def test_load_emissions(tmp_workdir: Path):
+    """Test that load_emissions gathers every restructured .csv file into one year x source x gas array
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True)
+    restructure_pollution_data(tmp_workdir / "pollution_data", by_gas)
+
+    data = load_emissions(by_gas)
+
+    assert data.gases == ["CH4", "CO2", "N2O"], f"Wrong gases {data.gases}"
+    assert data.sources == ["src_agriculture", "src_airtraffic", "src_industry", "src_oil_and_gass",
+                            "src_road_traffic"], f"Wrong sources {data.sources}"
+    assert data.values.shape == (len(data.years), 5, 3), f"Wrong shape {data.values.shape}"
+    expected = np.loadtxt(by_gas / "gas_CH4" / "src_agriculture_CH4.csv", delimiter=",", skiprows=1)
+    rows = np.searchsorted(data.years, expected[:, 0])
+    assert np.array_equal(data.values[rows, 0, 0], expected[:, 1]), "Values differ from np.loadtxt"
+
+
+def test_load_emissions_cache(tmp_workdir: Path):
+    """Test that load_emissions memory-maps its binary cache and invalidates it when a file changes
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    restructured = tmp_workdir / "pollution_data_restructured"
+    by_gas = restructured / "by_gas"
+    by_gas.mkdir(parents=True)
+    restructure_pollution_data(tmp_workdir / "pollution_data", by_gas)
+
+    parsed = load_emissions(by_gas, cache_dir=restructured)
+    cached = load_emissions(by_gas, cache_dir=restructured)
+    assert isinstance(cached.values, np.memmap), "The cached values should be memory-mapped"
+    assert np.array_equal(parsed.values, cached.values, equal_nan=True), "The cached values differ"
+    assert cached.sources == parsed.sources and cached.gases == parsed.gases, "The cached labels differ"
+
+    # Add a year to one of the files, the cache must be rebuilt
+    changed = by_gas / "gas_CO2" / "src_industry_CO2.csv"
+    changed.write_text(changed.read_text() + "2023,1\n")
+    reloaded = load_emissions(by_gas, cache_dir=restructured)
+    assert reloaded.years[-1] == 2023, "The cache was not invalidated"
+    assert read_emissions_cache(restructured)[0].years[-1] == 2023, "The cache was not rewritten"
+
+
+def test_readers(tmp_path: Path):
+    """Test that the .npy reader memory-maps the dumps and that every reader rejects malformed files
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory
+    Returns:
+        - None
+    """
+    expected = np.array([[1990.0, 1.5], [1991.0, 2.5]])
+    np.save(tmp_path / "CO2_1.npy", expected)
+    (tmp_path / "CO2_2.txt").write_text("# year value\n1990 1.5\n1991, 2.5\n")
+
+    data = read_emissions(tmp_path / "CO2_1.npy")
+    assert isinstance(data, np.memmap), "The .npy dumps must be memory-mapped"
+    np.testing.assert_array_equal(data, expected)
+    np.testing.assert_array_equal(read_emissions(tmp_path / "CO2_2.txt"), expected)
+    np.testing.assert_array_equal(parse_emissions((tmp_path / "CO2_1.npy").read_bytes(), "CO2_1.npy"), expected)
+
+    np.save(tmp_path / "CO2_3.npy", np.zeros(3))
+    with pytest.raises(ValueError):
+        read_emissions(tmp_path / "CO2_3.npy")
+    with pytest.raises(ValueError):
+        parse_emissions(b"not an array", "CO2_4.npy")
+    with pytest.raises(ValueError):
+        parse_emissions(b"1990 1 2\n", "CO2_5.txt")
+    with pytest.raises(ValueError):
+        read_emissions(tmp_path / "CO2.xlsx")
@@ -0,0 +1,44 @@
+""" Test script executing the unit tests for the functions in analytic_tools/dedup.py module
+    which is a part of the analytic_tools package
+"""
+from pathlib import Path
+
+import pytest
+
+from analytic_tools import dedup
+from analytic_tools.dedup import PREFIX_SIZE, duplicate_report, find_duplicates
+from analytic_tools.utilities import get_diagnostics, scan_directory
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_find_duplicates(tmp_path: Path, monkeypatch, workers):
+    """Test that identical files are grouped and that the files of unique size are never opened
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory
+        - workers (int): number of threads reading the files
+    Returns:
+        - None
+    """
+    big = b"x" * (2 * PREFIX_SIZE)
+    contents = {
+        "a.csv": b"1990,1\n", "b.csv": b"1990,1\n", "c.csv": b"1990,2\n",
+        "big1.npy": big, "big2.npy": big, "big3.npy": big[:-1] + b"y",
+        "empty1.txt": b"", "empty2.txt": b"", "unique.md": b"a file of its own size",
+    }
+    for name, data in contents.items():
+        (tmp_path / name).write_bytes(data)
+
+    opened = []
+    read_prefix = dedup._read_prefix
+    monkeypatch.setattr(dedup, "_read_prefix", lambda path: opened.append(path.name) or read_prefix(path))
+
+    groups = find_duplicates(scan_directory(tmp_path)[tmp_path], workers=workers)
+
+    expected = [["empty1.txt", "empty2.txt"], ["a.csv", "b.csv"], ["big1.npy", "big2.npy"]]
+    assert [[path.name for path in group.paths] for group in groups] == expected
+    assert "unique.md" not in opened and "empty1.txt" not in opened
+    assert duplicate_report(groups) == {"duplicate groups": 3, "duplicate files": 3, "wasted bytes": 7 + len(big)}
+
+    res = get_diagnostics(tmp_path, duplicates=True)
+    assert res["files"] == 9 and res["wasted bytes"] == 7 + len(big)
@@ -0,0 +1,70 @@
+""" Test script executing the unit tests for the source formats in analytic_tools/formats.py module
+    which is a part of the analytic_tools package
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from analyze_pollution_data import restructure_pollution_data
+from analytic_tools.dataset import load_emissions, read_emissions_csv
+from analytic_tools.formats import get_formats, parse_formats, set_formats
+from analytic_tools.utilities import classify_csv_files
+
+
+@pytest.fixture
+def npy_formats():
+    """Ingest the .npy dumps in priority over the original .csv files"""
+    set_formats(parse_formats(["npy", "csv"]))
+    yield get_formats()
+    set_formats(None)
+
+
+def test_classify_formats(tmp_path):
+    """Test that each gas of each source is classified once, from the file of the format of highest priority
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory
+    Returns:
+        None
+    """
+    names = ["CO2.csv", "CO2_875.npy", "CO2_305.npy", "CH4.csv", "CH4_AgG.csv", "N2O_10.npy", "AXciZ_4408.txt"]
+    paths = [tmp_path / "src_a" / name for name in names]
+
+    batch = classify_csv_files(paths, tmp_path, formats=parse_formats(["npy", "csv"]))
+    assert batch.new_names == [None, None, "src_a_CO2.npy", "src_a_CH4.csv", None, "src_a_N2O.npy", None]
+    assert batch.gases == [None, None, "CO2", "CH4", None, "N2O", None]
+
+    batch = classify_csv_files(paths, tmp_path, formats=parse_formats(["csv", "npy"]))
+    assert batch.new_names == ["src_a_CO2.csv", None, None, "src_a_CH4.csv", None, "src_a_N2O.npy", None]
+
+    # By default, only the original .csv files are classified
+    assert classify_csv_files(paths, tmp_path).new_names == ["src_a_CO2.csv", None, None, "src_a_CH4.csv", None, None, None]
+
+    with pytest.raises(ValueError):
+        parse_formats(["xlsx"])
+
+
+def test_restructure_npy(tmp_workdir: Path, npy_formats):
+    """Test that the .npy dumps are restructured and loaded like the .csv files they duplicate
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_dir = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "by_gas"
+    by_gas.mkdir()
+
+    results = restructure_pollution_data(pollution_dir, by_gas, validate=True)
+
+    assert all(result["error"] is None for result in results)
+    files = sorted(path.name for path in by_gas.glob("gas_CO2/*"))
+    assert files == [f"{source}_CO2.npy" for source in
+                     ["src_agriculture", "src_airtraffic", "src_industry", "src_oil_and_gass", "src_road_traffic"]]
+
+    data = load_emissions(by_gas)
+    expected = read_emissions_csv(pollution_dir / "by_src" / "src_airtraffic" / "CO2.csv")
+    column = data.values[:, data.sources.index("src_airtraffic"), data.gases.index("CO2")]
+    np.testing.assert_array_equal(column[np.searchsorted(data.years, expected[:, 0])], expected[:, 1])
@@ -0,0 +1,109 @@
+""" Test script executing the unit tests for the persistent index in analytic_tools/fsindex.py module
+    which is a part of the analytic_tools package
+"""
+import os
+from pathlib import Path
+
+from analyze_pollution_data import analyze_pollution_data, restructure_pollution_data
+from analytic_tools.fsindex import INDEX_NAME, FileSystemIndex
+from analytic_tools.instrumentation import Metrics
+from analytic_tools.utilities import build_directory_tree, get_diagnostics, scan_directory
+
+# Modification time given to the directories, old enough for the index to trust it
+OLD_MTIME_NS = 1_000_000_000_000_000_000
+
+
+def _age_directories(root: Path) -> None:
+    """Set the modification time of root and of its subdirectories to OLD_MTIME_NS."""
+    for directory in [root, *(path for path in root.rglob("*") if path.is_dir())]:
+        os.utime(directory, ns=(OLD_MTIME_NS, OLD_MTIME_NS))
+
+
+def test_file_system_index(tmp_workdir: Path):
+    """Test that the index matches scan_directory and that a refresh only reports the changed files
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    root = tmp_workdir / "pollution_data"
+    industry = root / "by_src" / "src_industry"
+    _age_directories(root)
+
+    with FileSystemIndex(root, tmp_workdir / INDEX_NAME) as fsindex:
+        assert len(fsindex.refresh()) == get_diagnostics(root)["files"], "A new index reports every file"
+        assert fsindex.refresh() == []
+
+        index = fsindex.directory_index()
+        assert list(index) == list(scan_directory(root))
+        assert get_diagnostics(root, index=index) == get_diagnostics(root)
+        assert build_directory_tree(root, index=index) == build_directory_tree(root)
+        assert sorted(entry.gas for entry in index[industry] if entry.gas) == ["CH4", "CO2", "N2O"]
+
+        # A file modified in place does not change the modification time of its directory
+        (industry / "CO2.csv").write_text("aar,value\n1990,1\n")
+        os.utime(industry / "CO2.csv", ns=(OLD_MTIME_NS + 1, OLD_MTIME_NS + 1))
+        assert fsindex.refresh() == []
+        fsindex.mark_changed([industry / "CO2.csv"])
+        assert fsindex.refresh() == [industry / "CO2.csv"]
+
+        (industry / "N2O.csv").unlink()
+        (industry / "SF6.csv").write_text("aar,value\n1990,2\n")
+        assert sorted(fsindex.refresh()) == [industry / "N2O.csv", industry / "SF6.csv"]
+
+    # The index persists between runs
+    with FileSystemIndex(root, tmp_workdir / INDEX_NAME) as fsindex:
+        assert fsindex.refresh() == []
+        assert fsindex.refresh(full=True) == []
+
+
+def test_restructure_from_index(tmp_workdir: Path):
+    """Test that restructuring from the persistent index only copies the changed files
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    root = tmp_workdir / "pollution_data"
+    dest = tmp_workdir / "by_gas"
+    dest.mkdir()
+    manifest = tmp_workdir / "manifest.json"
+
+    with FileSystemIndex(root, tmp_workdir / INDEX_NAME) as fsindex:
+        fsindex.refresh()
+        restructure_pollution_data(root, dest, index=fsindex.directory_index(), manifest_path=manifest)
+
+        (root / "by_src" / "src_industry" / "CO2.csv").write_text("aar,value\n1990,1\n")
+        # As reported by a file system watcher
+        fsindex.mark_changed([root / "by_src" / "src_industry" / "CO2.csv"])
+        assert fsindex.refresh() == [root / "by_src" / "src_industry" / "CO2.csv"]
+        results = restructure_pollution_data(root, dest, index=fsindex.directory_index(), manifest_path=manifest)
+
+    copied = [result["source"] for result in results if result["status"] == "copied"]
+    assert copied == [root / "by_src" / "src_industry" / "CO2.csv"]
+    assert (dest / "gas_CO2" / "src_industry_CO2.csv").read_text() == "aar,value\n1990,1\n"
+
+
+def test_persistent_index_in_place_edit(tmp_workdir: Path):
+    """Test that a file modified in place is restructured again with the persistent index, without mark_changed
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    root = tmp_workdir / "pollution_data"
+    _age_directories(root)
+    analyze_pollution_data(tmp_workdir, stages=["restructure"], persistent_index=True)
+
+    with open(root / "by_src" / "src_industry" / "CO2.csv", "a") as f:
+        f.write("2023,99999\n")
+    metrics = Metrics()
+    analyze_pollution_data(tmp_workdir, stages=["restructure"], persistent_index=True, metrics=metrics)
+
+    assert metrics.counters["files changed"] == 0, "The directory was not modified, it is not listed again"
+    assert metrics.counters["files copied"] == 1 and metrics.counters["files unchanged"] == 14
+    copy = tmp_workdir / "pollution_data_restructured" / "by_gas" / "gas_CO2" / "src_industry_CO2.csv"
+    assert copy.read_text().endswith("2023,99999\n")
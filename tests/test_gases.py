@@ -0,0 +1,66 @@
+""" Test script executing the unit tests for the gas registry in analytic_tools/gases.py module
+    which is a part of the analytic_tools package
+"""
+import json
+from pathlib import Path
+
+import pytest
+
+from analytic_tools.gases import DEFAULT_UNIT, GasRegistry, get_registry, load_registry, set_registry
+from analytic_tools.utilities import classify_csv_files, is_gas_csv
+
+
+@pytest.fixture
+def registry_file(tmp_path):
+    """JSON registry adding ammonia to the default gasses and relabelling CO2"""
+    path = tmp_path / "gases.json"
+    path.write_text(json.dumps({"gases": [
+        {"formula": "NH3", "label": r"$\mathrm{NH_3}$", "unit": "tonnes"},
+        {"formula": "CO2", "label": "carbon dioxide"},
+    ]}))
+    yield path
+    set_registry(None)
+
+
+def test_load_registry(registry_file: Path):
+    """Test that a registry loaded from JSON extends the default gasses
+
+    Parameters:
+        registry_file (pathlib.Path): path to the JSON registry
+    Returns:
+        None
+    """
+    registry = load_registry(registry_file)
+
+    assert registry.formulas == {"CO2", "CH4", "N2O", "SF6", "H2", "NH3"}
+    assert registry.label("CO2") == "carbon dioxide" and registry.unit("CO2") == DEFAULT_UNIT
+    assert registry.unit("NH3") == "tonnes"
+    assert registry.label("XYZ") == "XYZ", "An unknown gas is labelled with its formula"
+    assert "NH3" in registry and "NH3_old" not in registry
+    assert load_registry(registry_file, include_defaults=False).formulas == {"CO2", "NH3"}
+
+    registry_file.write_text(json.dumps({"gases": [{"label": "no formula"}]}))
+    with pytest.raises(ValueError):
+        load_registry(registry_file)
+
+
+def test_registry_classification(registry_file: Path, tmp_path: Path):
+    """Test that is_gas_csv and classify_csv_files follow the registry in use
+
+    Parameters:
+        registry_file (pathlib.Path): path to the JSON registry
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+    Returns:
+        None
+    """
+    path = tmp_path / "src_farms" / "NH3.csv"
+    assert not is_gas_csv(path), "NH3 is not a default gas"
+
+    set_registry(load_registry(registry_file))
+    assert is_gas_csv(path)
+    assert classify_csv_files([path], tmp_path).destinations == [tmp_path / "gas_NH3" / "src_farms_NH3.csv"]
+
+    set_registry(GasRegistry([]))
+    assert not is_gas_csv(tmp_path / "CO2.csv"), "An empty registry has no gas"
+    set_registry(None)
+    assert get_registry().formulas == {"CO2", "CH4", "N2O", "SF6", "H2"}
@@ -0,0 +1,41 @@
+""" Test script executing the unit tests for the Metrics class in analytic_tools/instrumentation.py module
+    which is a part of the analytic_tools package
+"""
+import pstats
+from pathlib import Path
+
+from analytic_tools.instrumentation import Metrics
+
+
+def _render_after_load() -> bytes:
+    """Allocate a large block, as a stand-in for the work of an outer stage done after a nested stage."""
+    return bytes(4 * 2**20)
+
+
+def test_nested_stages(tmp_path: Path):
+    """Test that a nested stage neither stops the profiling of the outer stage nor hides its peak memory
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory
+    Returns:
+        - None
+    """
+    metrics = Metrics(profile="cprofile")
+    with metrics.stage("plot"):
+        with metrics.stage("load emissions"):
+            pass
+        _render_after_load()
+    assert set(metrics.stages) == {"plot", "load emissions"}
+    metrics.dump_profile(tmp_path / "stages.prof")
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / "stages.prof")).stats}
+    assert "_render_after_load" in functions, "The outer stage must still be profiled after the nested one"
+
+    metrics = Metrics(profile="tracemalloc")
+    with metrics.stage("plot"):
+        with metrics.stage("load emissions"):
+            block = bytes(2 * 2**20)
+        del block
+        _render_after_load()
+    peaks = metrics.to_dict()["peak memory"]
+    assert 2 * 2**20 <= peaks["load emissions"] < 4 * 2**20
+    assert peaks["plot"] >= 4 * 2**20, "The outer stage must be traced after the nested one"
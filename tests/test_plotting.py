@@ -0,0 +1,90 @@
+""" Test script executing the unit tests for the functions in analytic_tools/plotting.py module
+    which is a part of the analytic_tools package
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from analyze_pollution_data import restructure_pollution_data
+from analytic_tools.instrumentation import Metrics
+from analytic_tools.plotting import plot_pollution_data
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_plot_pollution_data_workers(tmp_workdir: Path, workers):
+    """Test that plot_pollution_data draws one plot per gas and returns them ordered by gas
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+        - workers (int): number of processes to draw the plots with
+    Returns:
+        - None
+    """
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    figures = tmp_workdir / "pollution_data_restructured" / "figures"
+    by_gas.mkdir(parents=True)
+    figures.mkdir()
+    restructure_pollution_data(tmp_workdir / "pollution_data", by_gas)
+
+    figpaths = plot_pollution_data(by_gas, figures, workers=workers)
+
+    expected = [figures / "gas_CH4.png", figures / "gas_CO2.png", figures / "gas_N2O.png"]
+    assert figpaths == expected, f"Expected {expected} but got {figpaths}"
+    for figpath in figpaths:
+        assert figpath.stat().st_size > 0, f"{figpath} is empty"
+
+
+def test_plot_pollution_data_options(tmp_workdir: Path):
+    """Test the size, resolution, format and preview options of the plots and their reported render cost
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    figures = tmp_workdir / "pollution_data_restructured" / "figures"
+    by_gas.mkdir(parents=True)
+    figures.mkdir()
+    restructure_pollution_data(tmp_workdir / "pollution_data", by_gas)
+
+    metrics = Metrics()
+    figpaths = plot_pollution_data(by_gas, figures, metrics=metrics, figsize=(4, 3), dpi=50)
+    assert Image.open(figpaths[0]).size == (200, 150)
+    assert set(metrics.samples["render seconds"]) == {"gas_CH4", "gas_CO2", "gas_N2O"}
+    assert metrics.samples["figure bytes"]["gas_CO2"] == (figures / "gas_CO2.png").stat().st_size
+
+    previews = plot_pollution_data(by_gas, figures, preview=True)
+    assert Image.open(previews[0]).size == (720, 576), "A preview is drawn at PREVIEW_DPI"
+    assert previews[0].name == "gas_CH4.preview.png"
+    assert Image.open(figpaths[0]).size == (200, 150), "A preview must not replace the full plot"
+
+    svgs = plot_pollution_data(by_gas, figures, fmt="svg", preview=True)
+    assert [p.name for p in svgs] == ["gas_CH4.preview.svg", "gas_CO2.preview.svg", "gas_N2O.preview.svg"]
+    assert "$" not in svgs[1].read_text(), "The labels of a preview are plain text"
+
+    # Without changes of the data, only the plots drawn with other options are redrawn
+    assert plot_pollution_data(by_gas, figures, gases=set(), figsize=(4, 3), dpi=50) == []
+    assert plot_pollution_data(by_gas, figures, gases=set(), preview=True) == []
+    redrawn = plot_pollution_data(by_gas, figures, gases=set())
+    assert redrawn == figpaths and Image.open(figpaths[0]).size == (2000, 1600)
+
+    with pytest.raises(ValueError):
+        plot_pollution_data(by_gas, figures, dpi=0)
+    with pytest.raises(ValueError):
+        plot_pollution_data(by_gas, figures, figsize=(10, -1))
+
+
+def test_plotting_keeps_backend():
+    """Test that importing the plotting module does not switch the matplotlib backend chosen by the user
+
+    Returns:
+        - None
+    """
+    code = "import matplotlib; matplotlib.use('svg'); import analytic_tools.plotting; print(matplotlib.get_backend())"
+    backend = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=Path(__file__).parents[1]).stdout.strip()
+    assert backend == "svg"
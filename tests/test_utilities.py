@@ -3,16 +3,27 @@
 """
 
 # Include the necessary packages here
+import json
+import os
+import shutil
 from pathlib import Path
 
 import pytest
 
 # This should work if analytic_tools has been installed properly in your environment
 from analytic_tools.utilities import (
+    build_directory_tree,
+    classify_csv_files,
+    copy_files,
+    display_directory_tree,
     get_dest_dir_from_csv_file,
+    get_detailed_diagnostics,
     get_diagnostics,
     is_gas_csv,
+    iter_index_files,
     merge_parent_and_basename,
+    place_file,
+    scan_directory,
 )
 
 
@@ -55,6 +66,64 @@ def test_get_diagnostics(example_config):
         'other files'], f"{res['other files']} other files but expected {res_test['other files']}"
 
 
+def test_scan_directory(example_config):
+    """Test that scan_directory indexes every directory of the tree once and that
+    get_diagnostics gives the same result from a prebuilt index
+
+    Parameters:
+        example_config (pytest fixture): a preconfigured temporary directory containing the example configuration
+                                     from Figure 1 in assignment2.md
+
+    Returns:
+        None
+    """
+    index = scan_directory(example_config)
+
+    # The root and its five subdirectories must all be indexed
+    assert len(index) == 6, f"Expected 6 indexed directories but got {len(index)}"
+    assert example_config in index, "The root directory is missing from the index"
+
+    csv_names = sorted(entry.name for entry in iter_index_files(index, ".csv"))
+    assert csv_names == sorted(["H2.csv", "H2_mkL.csv", "CO2.csv", "CO2_GHk.csv", "CH4.csv",
+                                "SF6_Hgt.csv", "H2O.csv", "CO2.csv"]), "Wrong .csv files in the index"
+
+    assert get_diagnostics(example_config, index=index) == get_diagnostics(
+        example_config), "Diagnostics from the index differ from a fresh scan"
+
+
+def test_scan_directory_unreadable(example_config, monkeypatch):
+    """Test that scan_directory skips the subdirectories it cannot read instead of failing
+
+    Parameters:
+        example_config (pytest fixture): a preconfigured temporary directory containing the example configuration
+                                     from Figure 1 in assignment2.md
+
+    Returns:
+        None
+    """
+    unreadable = next(entry for entry in os.scandir(example_config) if entry.is_dir())
+    refused = {unreadable.path}
+    scandir = os.scandir
+
+    # Tests may run as root, which is allowed to read any directory: refuse it in os.scandir instead of chmod
+    def refuse(path="."):
+        if os.fspath(path) in refused:
+            raise PermissionError(13, "Permission denied", os.fspath(path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", refuse)
+    index = scan_directory(example_config)
+    assert Path(unreadable.path) not in index, "The unreadable directory should not be indexed"
+    assert unreadable.name in [entry.name for entry in index[example_config]], \
+        "The unreadable directory should still be listed in its parent"
+    assert all(Path(unreadable.path) not in directory.parents for directory in index)
+
+    # An unreadable root is still an error
+    refused.add(os.fspath(example_config))
+    with pytest.raises(PermissionError):
+        scan_directory(example_config)
+
+
 @pytest.mark.task12
 @pytest.mark.parametrize(
     "exception, dir",
@@ -297,3 +366,175 @@ def test_merge_parent_and_basename_exceptions(exception, path):
             excinfo.value, ValueError), "The exception should be a ValueError"
         assert str(
             excinfo.value) == "Missing filename or parent_name in the path", "The exception message does not match"
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_copy_files(tmp_path, workers):
+    """Test that copy_files copies every job and reports failures without stopping
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        workers (int): number of threads to copy with
+
+    Returns:
+        None
+    """
+    jobs = []
+    for i in range(10):
+        src = tmp_path / f"src_{i}.csv"
+        src.write_text("aar,value\n" + f"1990,{i}\n" * i)
+        jobs.append((src, tmp_path / f"dst_{i}.csv"))
+    # A job whose source does not exist must fail on its own
+    jobs.insert(3, (tmp_path / "missing.csv", tmp_path / "dst_missing.csv"))
+
+    results = copy_files(jobs, workers=workers)
+
+    assert [r["source"] for r in results] == [src for src, _ in jobs], "Results are not in the order of the jobs"
+    failed = [r for r in results if r["error"] is not None]
+    assert len(failed) == 1 and failed[0]["source"].name == "missing.csv", "Only the missing file should fail"
+    for src, dst in jobs:
+        if src.exists():
+            assert dst.read_bytes() == src.read_bytes(), f"{dst} is not an exact copy of {src}"
+
+
+@pytest.mark.parametrize("placement", ["copy", "hardlink", "reflink", "symlink"])
+def test_place_file(tmp_path, placement):
+    """Test that place_file makes the file readable at its destination in every placement mode,
+        and that placing over an existing link never modifies the source it points to
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        placement (str): placement mode to test
+
+    Returns:
+        None
+    """
+    src = tmp_path / "by_src" / "src_industry" / "CO2.csv"
+    src.parent.mkdir(parents=True)
+    src.write_text("aar,value\n1990,1.0\n")
+    dst = tmp_path / "by_gas" / "gas_CO2" / merge_parent_and_basename(src)
+    dst.parent.mkdir(parents=True)
+
+    place_file(src, dst, placement)
+
+    assert dst.read_bytes() == src.read_bytes(), f"{dst} does not have the contents of {src}"
+    if placement == "hardlink":
+        assert dst.stat().st_ino == src.stat().st_ino, "Expected a hard link to the source"
+    if placement == "symlink":
+        assert dst.is_symlink() and not Path(dst.readlink()).is_absolute(), "Expected a relative symbolic link"
+
+    # Placing a copy over the link must replace the link, not write through it
+    other = tmp_path / "other.csv"
+    other.write_text("aar,value\n2000,2.0\n")
+    place_file(other, dst, "copy")
+    assert src.read_text() == "aar,value\n1990,1.0\n", "The source was modified through the link"
+    assert dst.read_bytes() == other.read_bytes() and not dst.is_symlink()
+
+    with pytest.raises(ValueError):
+        place_file(src, dst, "move")
+
+
+def test_classify_csv_files(tmp_path):
+    """Test that classify_csv_files agrees with is_gas_csv and merge_parent_and_basename,
+        and creates each gas directory again after it was removed
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    by_src = tmp_path / "by_src"
+    paths = [by_src / "src_a" / "CO2.csv", by_src / "src_a" / "CO2_old.csv", str(by_src / "src_b" / "CH4.csv"),
+             by_src / "src_b" / "notes.txt", by_src / "src_c" / "H2.csv"]
+    dest = tmp_path / "by_gas"
+    dest.mkdir()
+
+    batch = classify_csv_files(paths, dest)
+
+    assert batch.sources == [Path(p) for p in paths]
+    assert batch.gases == ["CO2", None, "CH4", None, "H2"]
+    for path, name, destination in zip(paths, batch.new_names, batch.destinations):
+        if Path(path).suffix == ".csv" and is_gas_csv(path):
+            assert name == merge_parent_and_basename(path)
+            assert destination == dest / f"gas_{Path(path).stem}" / name
+        else:
+            assert name is None and destination is None
+    assert not list(dest.iterdir()), "No directory must be created unless requested"
+
+    classify_csv_files(paths, dest, create_dirs=True)
+    assert sorted(p.name for p in dest.iterdir()) == ["gas_CH4", "gas_CO2", "gas_H2"]
+
+    # The remembered directories are created again once dest is recreated
+    shutil.rmtree(dest)
+    dest.mkdir()
+    classify_csv_files(paths, dest, create_dirs=True)
+    assert sorted(p.name for p in dest.iterdir()) == ["gas_CH4", "gas_CO2", "gas_H2"]
+
+
+def test_build_directory_tree(tmp_path, capsys):
+    """Test that build_directory_tree keeps maxfiles entries per directory, stops at max_depth,
+        gives the same tree with and without an index and is displayed in the usual format
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        capsys: pytest fixture capturing the standard output
+
+    Returns:
+        None
+    """
+    root = tmp_path / "data"
+    (root / "big").mkdir(parents=True)
+    for i in range(500):
+        (root / "big" / f"file_{i}.txt").touch()
+    (root / "a" / "b" / "c").mkdir(parents=True)
+    (root / "a" / "b" / "c" / "deep.txt").touch()
+
+    tree = build_directory_tree(root, maxfiles=3)
+    assert tree == build_directory_tree(root, maxfiles=3, index=scan_directory(root))
+    assert json.loads(json.dumps(tree)) == tree, "The tree must be serializable as JSON"
+    big = next(child for child in tree["children"] if child["name"] == "big")
+    assert len(big["children"]) == 3 and big["truncated"], "Expected three of the 500 files and a truncation"
+    a = next(child for child in tree["children"] if child["name"] == "a")
+    assert a["children"][0]["children"][0]["children"] == [{"name": "deep.txt", "type": "file"}]
+
+    shallow = build_directory_tree(root, maxfiles=3, max_depth=1)
+    a = next(child for child in shallow["children"] if child["name"] == "a")
+    assert a["children"] == [] and a["truncated"], "Directories below max_depth must not be expanded"
+
+    display_directory_tree(root, maxfiles=1, max_depth=0)
+    assert capsys.readouterr().out == "data/\n    ...\n"
+
+    with pytest.raises(ValueError):
+        build_directory_tree(root, max_depth=-1)
+
+
+@pytest.mark.parametrize("workers, processes, use_index", [(1, False, False), (3, False, False), (2, True, False),
+                                                           (1, False, True)])
+def test_get_detailed_diagnostics(tmp_path, workers, processes, use_index):
+    """Test that the sharded diagnostics count like get_diagnostics and add up the bytes per extension and source
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        workers (int): number of workers walking the shards
+        processes (bool): whether the workers are processes
+        use_index (bool): whether to diagnose from an index instead of walking the tree
+
+    Returns:
+        None
+    """
+    by_src = tmp_path / "pollution_data" / "by_src"
+    for source, size in [("src_a", 10), ("src_b", 20), ("src_c", 30)]:
+        (by_src / source / "nested").mkdir(parents=True)
+        (by_src / source / "CO2.csv").write_bytes(b"x" * size)
+        (by_src / source / "nested" / "data.npy").write_bytes(b"x" * size)
+        (by_src / source / "README").write_bytes(b"x")
+    (tmp_path / "pollution_data" / "notes.txt").write_bytes(b"x" * 7)
+    root = tmp_path / "pollution_data"
+
+    index = scan_directory(root) if use_index else None
+    res = get_detailed_diagnostics(root, index=index, workers=workers, processes=processes)
+
+    assert res["counts"] == get_diagnostics(root) == get_diagnostics(root, workers=workers)
+    assert res["bytes per extension"] == {".csv": 60, ".npy": 60, "": 3, ".txt": 7}
+    assert res["bytes per source"] == {"src_a": 21, "src_b": 41, "src_c": 61}, "notes.txt belongs to no source"